@@ -4,16 +4,22 @@ load_dotenv(find_dotenv())
 
 import streamlit as st
 import os
-import asyncio
 import tempfile
 import base64
+import io
+import wave
 import urllib.parse
 from openai import OpenAI
 from huggingface_hub import InferenceClient
 from faster_whisper import WhisperModel
-import edge_tts
 import chromadb
-from sentence_transformers import SentenceTransformer
+from utils.embeddings import EmbeddingCache
+from utils.usage import usage_tracker
+from utils.answer_cache import AnswerCache, is_cacheable, vehicle_fingerprint
+from utils.vector_index import VectorIndex
+from utils.embed_backends import load_embedder
+from utils.transcriber import TranscriptCache, audio_key, choose_profile, run_whisper
+from utils.tts import TTSService
 
 # --- Настройка страницы ---
 st.set_page_config(page_title="Мой Второй Пилот", page_icon="🚗", layout="centered", initial_sidebar_state="expanded")
@@ -31,6 +37,13 @@ if deepseek_key:
 if hf_token:
     client_vision = InferenceClient(token=hf_token)
 
+# Неизменная часть промпта чата идет первой (кэш префикса DeepSeek), данные запроса - в конце
+CHAT_SYSTEM_PROMPT = (
+    "Ты — Алекс, спокойный автоинструктор. Твоя цель — снизить стресс. "
+    "История ТО и выдержки из инструкции приходят отдельным системным сообщением перед вопросом. "
+    "Отвечай кратко (1-3 предложения)."
+)
+
 # --- Инициализация Whisper (STT) ---
 @st.cache_resource
 def load_whisper():
@@ -44,29 +57,64 @@ def load_whisper():
 
 whisper_model = load_whisper()
 
+@st.cache_resource
+def load_transcript_cache():
+    # Streamlit перезапускает скрипт на каждое действие - та же запись не распознается заново
+    return TranscriptCache(int(os.getenv("TRANSCRIPT_CACHE_SIZE", 512)))
+
+transcript_cache = load_transcript_cache()
+
+def wav_duration(data):
+    try:
+        with wave.open(io.BytesIO(data)) as w:
+            return w.getnframes() / w.getframerate()
+    except Exception:
+        return None
+
 # --- Инициализация Базы Знаний (RAG) ---
 @st.cache_resource
 def load_rag():
     try:
         # Модель для поиска по смыслам
-        embed_model = SentenceTransformer('all-MiniLM-L6-v2')
-        # Подключение к базе
-        db_client = chromadb.PersistentClient(path="chroma_db")
-        collection = db_client.get_collection(name="audi_manual")
-        return embed_model, collection
+        embed_model = load_embedder()  # бэкенд - из EMBED_BACKEND
+        # Готовый снимок инструкции (utils/vector_index.py) открывается мгновенно, иначе - Chroma
+        collection = VectorIndex.load(os.getenv("VECTOR_INDEX_DIR", "vector_index"))
+        if collection is None:
+            db_client = chromadb.PersistentClient(path="chroma_db")
+            collection = db_client.get_collection(name="audi_manual")
+        # Кэш живет вместе с моделью (cache_resource) и переживает перезапуски скрипта
+        return EmbeddingCache(lambda: embed_model), collection
     except Exception as e:
         st.info("ℹ️ База знаний (manual.pdf) не найдена или не создана. Алекс будет отвечать из общих знаний.")
         return None, None
 
 embedding_model, rag_collection = load_rag()
 
+@st.cache_resource
+def load_answer_cache():
+    # Общий на все сессии: похожие вопросы при том же пробеге и ТО отвечаются без DeepSeek
+    return AnswerCache(
+        threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.92)),
+        ttl=float(os.getenv("ANSWER_CACHE_TTL", 6 * 3600)),
+        max_size=int(os.getenv("ANSWER_CACHE_SIZE", 1000)),
+    )
+
+answer_cache = load_answer_cache()
+
+@st.cache_resource
+def load_tts():
+    # Один кэш озвучки на все сессии: повторный клик "Озвучить" и перезапуски скрипта не синтезируют заново
+    return TTSService(
+        cache_dir=os.getenv("TTS_CACHE_DIR", "tts_cache"),
+        max_bytes=int(os.getenv("TTS_CACHE_MB", 50)) * 1024 * 1024,
+    )
+
+tts_service = load_tts()
+
 # --- Функции ---
-async def text_to_speech(text):
-    communicate = edge_tts.Communicate(text, "ru-RU-SvetlanaNeural")
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-        tmp_path = tmp_file.name
-        await communicate.save(tmp_path)
-    return tmp_path
+def text_to_speech(text):
+    """mp3 (bytes) для st.audio - без временных файлов"""
+    return tts_service.synthesize_sync(text)
 
 # Custom CSS
 st.markdown("""
@@ -77,23 +125,12 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-import json
 from datetime import datetime
 
-# --- Состояние авто: Загрузка/Сохранение истории ---
-HISTORY_FILE = "service_history.json"
+# --- Состояние авто: история ТО (общая с ботом, в памяти между перезапусками скрипта) ---
+from utils.history_store import history_store
 
-def load_history():
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
-            return json.load(f)
-    return {"oil_change": {"mileage": 145000, "date": "2024-01-01"}}
-
-def save_history(history):
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f)
-
-history = load_history()
+history = history_store.snapshot()
 
 st.title("🚗 Мой Второй Пилот")
 
@@ -110,8 +147,7 @@ with col1:
     st.info(f"🔧 Масло через: **{oil_rem} км**")
     st.caption(f"Последняя замена: {last_oil['date']} ({last_oil['mileage']} км)")
     if st.button("🧼 Я поменял масло!", use_container_width=True):
-        history["oil_change"] = {"mileage": mileage, "date": datetime.now().strftime("%d.%m.%Y")}
-        save_history(history)
+        history_store.set_oil_change(mileage, datetime.now().strftime("%d.%m.%Y"))
         st.success("Данные обновлены!")
         st.rerun()
 
@@ -184,11 +220,19 @@ with tab_chat:
     if audio_inp:
         with st.spinner("Распознаю речь..."):
             try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_audio:
-                    tmp_audio.write(audio_inp.getvalue())
-                    temp_audio_path = tmp_audio.name
-                segments, _ = whisper_model.transcribe(temp_audio_path, beam_size=5)
-                voice_prompt = " ".join([segment.text for segment in segments])
+                audio_bytes = audio_inp.getvalue()
+                key = audio_key(audio_bytes)
+                voice_prompt = transcript_cache.get(key)
+                if voice_prompt is None:
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_audio:
+                        tmp_audio.write(audio_bytes)
+                        temp_audio_path = tmp_audio.name
+                    try:
+                        profile = choose_profile(wav_duration(audio_bytes), float(os.getenv("WHISPER_FAST_AFTER", 20)))
+                        voice_prompt = run_whisper(whisper_model, temp_audio_path, profile)
+                    finally:
+                        os.remove(temp_audio_path)
+                    transcript_cache.put(key, voice_prompt)
                 st.info(f"Распознано: {voice_prompt}")
             except Exception as e:
                 st.error(f"Ошибка STT: {e}")
@@ -199,8 +243,8 @@ with tab_chat:
             st.markdown(message["content"])
             if message["role"] == "assistant":
                 if st.button("🔊 Озвучить", key=f"audio_{i}"):
-                    audio_p = asyncio.run(text_to_speech(message["content"]))
-                    st.audio(audio_p, format="audio/mp3", autoplay=True)
+                    speech = text_to_speech(message["content"])
+                    st.audio(speech, format="audio/mp3", autoplay=True)
 
     # Ввод
     prompt = st.chat_input("Опиши ситуацию:")
@@ -219,27 +263,41 @@ with tab_chat:
                     # Добавляем инфо об истории ТО в контекст Алекса
                     service_context = f"\nИСТОРИЯ ТО: Последняя замена масла была {last_oil['date']} на пробеге {last_oil['mileage']} км. Сейчас пробег {mileage} км. До следующей замены {oil_rem} км."
                     
-                    if rag_collection and embedding_model:
+                    query_vector = embedding_model.encode(prompt) if embedding_model else None
+                    # Общий вопрос при том же пробеге и ТО - ответ из кэша
+                    cache_key, answer = None, None
+                    if query_vector is not None and is_cacheable(prompt):
+                        cache_key = (query_vector, vehicle_fingerprint(last_oil, history_store.last_events(3), mileage))
+                        answer = answer_cache.lookup(*cache_key)
+
+                    if answer is None and rag_collection and embedding_model:
                         # Поиск по базе знаний
-                        query_vector = embedding_model.encode(prompt).tolist()
-                        results = rag_collection.query(query_embeddings=[query_vector], n_results=3)
-                        context = "\nИНФОРМАЦИЯ ИЗ ИНСТРУКЦИИ МАШИНЫ:\n" + "\n".join(results['documents'][0])
+                        if isinstance(rag_collection, VectorIndex):
+                            documents, _ = rag_collection.search(query_vector, 3)
+                        else:
+                            documents = rag_collection.query(query_embeddings=[query_vector], n_results=3)['documents'][0]
+                        context = "\nИНФОРМАЦИЯ ИЗ ИНСТРУКЦИИ МАШИНЫ:\n" + "\n".join(documents)
 
                     try:
-                        response = client.chat.completions.create(
-                            model="deepseek-chat",
-                            messages=[
-                                {"role": "system", "content": f"Ты — Алекс, спокойный автоинструктор. Твоя цель — снизить стресс. {service_context} {context} \nОтвечай кратко (1-3 предложения)."},
-                            ] + st.session_state.messages
-                        )
-                        answer = response.choices[0].message.content
+                        if answer is None:
+                            response = client.chat.completions.create(
+                                model="deepseek-chat",
+                                messages=[{"role": "system", "content": CHAT_SYSTEM_PROMPT}]
+                                + st.session_state.messages[:-1]
+                                + [{"role": "system", "content": f"{service_context} {context}"}]
+                                + st.session_state.messages[-1:]
+                            )
+                            usage_tracker.record(response.usage, "app_chat")
+                            answer = response.choices[0].message.content
+                            if cache_key:
+                                answer_cache.store(*cache_key, prompt, answer)
                         st.markdown(answer)
                         st.session_state.messages.append({"role": "assistant", "content": answer})
                         
                         # АВТО-ОЗВУЧКА для любого типа ввода (голос или текст)
                         with st.spinner("Озвучиваю..."):
-                            audio_p = asyncio.run(text_to_speech(answer))
-                            st.audio(audio_p, format="audio/mp3", autoplay=True)
+                            speech = text_to_speech(answer)
+                            st.audio(speech, format="audio/mp3", autoplay=True)
                     except Exception as e:
                         st.error(f"Ошибка DeepSeek: {e}")
 
@@ -264,8 +322,8 @@ with tab_cam:
                 
                 # Авто-озвучка результата анализа фото
                 with st.spinner("Озвучиваю результат..."):
-                    audio_p = asyncio.run(text_to_speech(answer))
-                    st.audio(audio_p, format="audio/mp3", autoplay=True)
+                    speech = text_to_speech(answer)
+                    st.audio(speech, format="audio/mp3", autoplay=True)
             except Exception as e:
                 st.error(f"Ошибка фото-модуля: {e}")
 
@@ -279,10 +337,11 @@ with tab_map:
             with st.spinner("Ищу безопасный путь..."):
                 try:
                     res = client.chat.completions.create(model="deepseek-chat", messages=[{"role": "user", "content": f"Я новичок, еду из {start} в {end}. Подскажи спокойный путь."}])
+                    usage_tracker.record(res.usage, "app_route")
                     ans = res.choices[0].message.content
                     st.markdown(ans)
-                    audio_p = asyncio.run(text_to_speech(ans))
-                    st.audio(audio_p, format="audio/mp3", autoplay=True)
+                    speech = text_to_speech(ans)
+                    st.audio(speech, format="audio/mp3", autoplay=True)
                     link = f"https://yandex.ru/maps/?rtext={urllib.parse.quote(start)}~{urllib.parse.quote(end)}&rtm=auto"
                     st.link_button("🗺️ Яндекс Карты", link)
                 except Exception as e: st.error(f"Ошибка: {e}")
@@ -0,0 +1,79 @@
+"""Бенчмарки компонентов: python -m benchmarks [опции] (из папки my_copilot).
+
+  --only encode,chroma      - только эти группы (encode, chroma, manual_index, whisper, history, parts)
+  --quick                   - меньше размеров и повторов (проверка, что все работает)
+  --out PATH                - куда сохранить результаты (по умолчанию benchmarks/results/<время>.json)
+  --baseline PATH           - с чем сравнивать (по умолчанию benchmarks/baseline.json)
+  --save-baseline           - записать результаты как новую базовую линию
+  --tolerance 0.15          - допустимое отклонение p50 от базовой линии (разница меньше 0.05 мс - не в счет)
+
+Код возврата 1 - есть замедления больше tolerance (удобно для CI).
+Базовая линия зависит от машины: снимайте ее там же, где потом сравниваете.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+# Только локальный кэш моделей: бенчмарк не должен ходить в сеть
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+from benchmarks import components  # noqa: E402,F401 - регистрирует группы
+from benchmarks.harness import BENCHMARKS, compare, load, run, save  # noqa: E402
+
+HERE = os.path.dirname(__file__)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Бенчмарки горячих путей копилота")
+    parser.add_argument("--only", default="", help="группы через запятую: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--baseline", default=os.path.join(HERE, "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args(argv)
+
+    groups = [g.strip() for g in args.only.split(",") if g.strip()]
+    unknown = [g for g in groups if g not in BENCHMARKS]
+    if unknown:
+        parser.error(f"неизвестные группы: {', '.join(unknown)}")
+
+    report = run(groups, quick=args.quick)
+    out = args.out or os.path.join(HERE, "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    save(report, out)
+    print(f"Результаты: {out}")
+
+    for name, row in report["results"].items():
+        print(f"{name:<45} p50 {row['p50_ms']:>10.3f} мс   p95 {row['p95_ms']:>10.3f} мс")
+    for group, reason in report["skipped"].items():
+        print(f"{group:<45} пропущен: {reason}")
+
+    if args.save_baseline:
+        save(report, args.baseline)
+        print(f"Базовая линия обновлена: {args.baseline}")
+        return 0
+
+    baseline = load(args.baseline)
+    if baseline is None:
+        print(f"Базовой линии {args.baseline} нет - сравнивать не с чем (--save-baseline, чтобы создать)")
+        return 0
+    if baseline.get("meta", {}).get("quick") != args.quick:
+        print("Внимание: базовая линия снята в другом режиме (--quick), сравнение неточное")
+    regressions = 0
+    print(f"\nСравнение с {args.baseline} (коммит {baseline.get('meta', {}).get('commit')}):")
+    for name, old, new, ratio, status in compare(report, baseline, args.tolerance):
+        if status in ("regression", "improvement"):
+            print(f"{status.upper():<12} {name:<45} {old:.3f} -> {new:.3f} мс (x{ratio})")
+        elif status != "ok":
+            print(f"{status:<12} {name}")
+        regressions += status == "regression"
+    print(f"Замедлений: {regressions}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""Бенчмарки горячих компонентов по отдельности, без сети.
+
+Модели берутся только из локального кэша (HF_HUB_OFFLINE=1 выставляет
+__main__): если эмбеддингов или Whisper там нет, группа пропускается.
+Chroma и снимок индекса наполняются случайными нормированными векторами
+нужного размера, история ТО - во временной папке, рабочие файлы бота не трогаются.
+"""
+import contextlib
+import glob
+import json
+import os
+import tempfile
+import wave
+
+import numpy as np
+
+from benchmarks.harness import Skip, bench, measure
+
+DIM = 384  # all-MiniLM-L6-v2
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def _unit_vectors(n: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+# --- Эмбеддинги ---
+
+@bench("encode")
+def bench_encode(quick: bool) -> dict:
+    try:
+        from utils.embed_backends import SAMPLE_QUERIES, load_embedder
+        model = load_embedder(verify=False)
+    except Exception as e:
+        raise Skip(f"модель эмбеддингов недоступна: {e}")
+    results = {}
+    for batch_size in ((1, 32) if quick else (1, 8, 32, 128)):
+        texts = [SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)] for i in range(batch_size)]
+        results[f"batch={batch_size}"] = measure(
+            lambda: model.encode(texts, batch_size=batch_size), repeats=5 if quick else 20,
+            items=batch_size, backend=model.embed_backend,
+        )
+    return results
+
+
+# --- Векторный поиск ---
+
+def _chroma_collection(client, name: str, n: int):
+    collection = client.create_collection(name=name)
+    vectors = _unit_vectors(n)
+    step = min(5000, client.get_max_batch_size()) if hasattr(client, "get_max_batch_size") else 5000
+    for start in range(0, n, step):
+        stop = min(n, start + step)
+        collection.add(
+            ids=[str(i) for i in range(start, stop)],
+            embeddings=vectors[start:stop].tolist(),
+            documents=[f"фрагмент {i}" for i in range(start, stop)],
+        )
+    return collection
+
+
+@bench("chroma")
+def bench_chroma(quick: bool) -> dict:
+    """Запросы как в bot.query_rag: инструкция - top-2, история машины - top-3"""
+    try:
+        import chromadb
+        from chromadb.config import Settings
+    except ImportError as e:
+        raise Skip(f"нет chromadb: {e}")
+    queries = _unit_vectors(50, seed=1).tolist()
+    sizes = {
+        "audi_manual": (1000, 5000) if quick else (1000, 5000, 20000),
+        "user_history": (100, 1000) if quick else (100, 1000, 10000),
+    }
+    n_results = {"audi_manual": 2, "user_history": 3}
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        client = chromadb.PersistentClient(path=tmp, settings=Settings(anonymized_telemetry=False))
+        for name, counts in sizes.items():
+            for n in counts:
+                collection = _chroma_collection(client, f"{name}_{n}", n)
+                it = iter(queries * 100)
+                results[f"{name}[n={n}]"] = measure(
+                    lambda: collection.query(query_embeddings=[next(it)], n_results=n_results[name]),
+                    repeats=20 if quick else 100, warmup=5,
+                )
+                client.delete_collection(f"{name}_{n}")
+    return results
+
+
+@bench("manual_index")
+def bench_manual_index(quick: bool) -> dict:
+    """Снимок инструкции (utils/vector_index.py) - путь, которым бот ищет по инструкции при наличии артефакта"""
+    from utils.vector_index import MANIFEST, VectorIndex
+    queries = _unit_vectors(50, seed=1)
+    results = {}
+    for n in ((1000, 5000) if quick else (1000, 5000, 20000)):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "bench"))
+            _unit_vectors(n).tofile(os.path.join(tmp, "bench", "vectors.f32"))
+            with open(os.path.join(tmp, "bench", "chunks.json"), "w", encoding="utf-8") as f:
+                json.dump({"ids": [str(i) for i in range(n)], "documents": [f"фрагмент {i}" for i in range(n)]}, f)
+            with open(os.path.join(tmp, MANIFEST), "w") as f:
+                json.dump({"version": "bench", "count": n, "dim": DIM}, f)
+            index = VectorIndex.load(tmp)
+            it = iter(list(queries) * 100)
+            results[f"n={n}"] = measure(lambda: index.search(next(it), 2), repeats=20 if quick else 100, warmup=5)
+            del index
+    return results
+
+
+# --- Whisper ---
+
+def synthetic_wav(path: str, seconds: float, rate: int = 16000):
+    """Речеподобный сигнал: гармоники с "слоговой" модуляцией и шумом. Распознавать в нем нечего,
+    но декодирование, VAD и энкодер Whisper работают на полную длину"""
+    t = np.arange(int(seconds * rate)) / rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) * (np.sin(2 * np.pi * 0.25 * t) > -0.5)
+    signal = 0.3 * voice * envelope + 0.01 * np.random.default_rng(0).standard_normal(len(t))
+    pcm = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(pcm.tobytes())
+
+
+def _duration(path: str):
+    if path.endswith(".wav"):
+        with wave.open(path, "rb") as f:
+            return f.getnframes() / f.getframerate()
+    try:
+        from faster_whisper.audio import decode_audio
+        return len(decode_audio(path)) / 16000  # decode_audio отдает 16 кГц
+    except Exception:
+        return None
+
+
+@contextlib.contextmanager
+def audio_fixtures(quick: bool):
+    """Записи из benchmarks/fixtures/ (wav/ogg/mp3), а если их нет - синтетические wav 5/20/45 с.
+
+    В репозитории лежат два голосовых на русском в ogg/opus, как их присылает Telegram:
+    ru_oil_pressure_3s ("Горит лампа давления масла. Что делать?") и ru_abs_after_wash_14s
+    (вопрос про значок ABS после мойки). Речь синтезирована espeak-ng и не меняется между
+    прогонами - p50 можно сравнивать с базовой линией. Свои записи кладите рядом"""
+    files = sorted(p for ext in ("wav", "ogg", "mp3") for p in glob.glob(os.path.join(FIXTURES_DIR, f"*.{ext}")))
+    if files:
+        yield [(os.path.basename(p), p, False) for p in files[:1 if quick else None]]
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = []
+        for seconds in ((5,) if quick else (5, 20, 45)):
+            path = os.path.join(tmp, f"synthetic_{seconds}s.wav")
+            synthetic_wav(path, seconds)
+            fixtures.append((os.path.basename(path), path, True))
+        yield fixtures
+
+
+@bench("whisper")
+def bench_whisper(quick: bool) -> dict:
+    try:
+        from faster_whisper import WhisperModel
+        model = WhisperModel(os.getenv("BENCH_WHISPER_MODEL", "base"), device="cpu", compute_type="int8")
+    except Exception as e:
+        raise Skip(f"Whisper недоступен: {e}")
+    from utils.transcriber import PROFILES, run_whisper
+    results = {}
+    with audio_fixtures(quick) as fixtures:
+        for name, path, synthetic in fixtures:
+            # В синтетике VAD вырезал бы почти все - отключаем, чтобы мерить полный проход
+            overrides = {"vad_filter": False} if synthetic else {}
+            duration = _duration(path)
+            for profile in PROFILES:
+                row = measure(lambda: run_whisper(model, path, profile, **overrides),
+                              repeats=2 if quick else 3, warmup=1, profile=profile, synthetic=synthetic)
+                if duration:
+                    row["audio_seconds"] = round(duration, 1)
+                    row["realtime_factor"] = round(row["mean_ms"] / 1000 / duration, 3)
+                results[f"{name}[{profile}]"] = row
+    return results
+
+
+# --- История ТО и навыки ---
+
+@contextlib.contextmanager
+def temporary_history(events: int):
+    """Хранилище истории с events событиями во временной папке; навыки на время переключаются на него"""
+    from utils import skills
+    from utils.history_store import DEFAULT_HISTORY, HistoryStore
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "service_history.json")
+        data = dict(DEFAULT_HISTORY, history=[
+            {"date": "01.01.2024", "work": f"Событие номер {i}: замена расходников", "mileage": 140000 + i}
+            for i in range(events)
+        ])
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        saved = skills.history_store
+        skills.history_store = HistoryStore(path)
+        try:
+            yield path
+        finally:
+            skills.history_store = saved
+
+
+@bench("history")
+def bench_history(quick: bool) -> dict:
+    """Холодная загрузка истории (снапшот + журнал), запись события через навык и отчет по ТО"""
+    from utils.history_store import HistoryStore
+    from utils.skills import SkillManager
+    results = {}
+    for events in ((100, 1000) if quick else (100, 1000, 10000)):
+        with temporary_history(events) as path:
+            results[f"load_history[n={events}]"] = measure(lambda: HistoryStore(path).snapshot(),
+                                                           repeats=10 if quick else 30)
+            results[f"service_report[n={events}]"] = measure(SkillManager.generate_service_report,
+                                                             repeats=10 if quick else 30)
+            # 60 записей: в замер попадает и свертка журнала (compact_every=50)
+            results[f"log_car_event[n={events}]"] = measure(
+                lambda: SkillManager.log_car_event("Бенчмарк: замена масла", 150000), repeats=60, warmup=0)
+    return results
+
+
+@bench("parts")
+def bench_parts(quick: bool) -> dict:
+    """Поиск по VAG_PARTS - микросекунды, поэтому один замер = 1000 вызовов"""
+    from utils.skills import SkillManager
+
+    def lookups(part_name):
+        def run():
+            for _ in range(1000):
+                SkillManager.get_part_numbers(part_name)
+        return run
+
+    return {
+        "get_part_numbers[hit]x1000": measure(lookups("Масляный фильтр"), repeats=20, items=1000),
+        "get_part_numbers[miss]x1000": measure(lookups("рулевая рейка"), repeats=20, items=1000),
+    }
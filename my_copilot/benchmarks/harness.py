@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import time
+from collections import OrderedDict
+
+# Зарегистрированные бенчмарки: имя группы -> функция(quick) -> {имя замера: результат}
+BENCHMARKS = OrderedDict()
+
+
+class Skip(Exception):
+    """Бенчмарк нельзя выполнить в этом окружении (нет пакета, модели в кэше и т.п.)"""
+
+
+def bench(group: str):
+    """Декоратор регистрации группы бенчмарков (как @skill для навыков)"""
+    def decorator(func):
+        BENCHMARKS[group] = func
+        return func
+    return decorator
+
+
+def _percentile(sorted_values, q: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def measure(fn, repeats: int = 20, warmup: int = 2, items: int = 1, **extra) -> dict:
+    """Время одного вызова fn(): p50/p95/mean в мс и пропускная способность (items за вызов)"""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    times.sort()
+    mean = statistics.fmean(times)
+    return dict({
+        "p50_ms": round(_percentile(times, 0.5) * 1000, 3),
+        "p95_ms": round(_percentile(times, 0.95) * 1000, 3),
+        "mean_ms": round(mean * 1000, 3),
+        "items_per_s": round(items / mean, 1) if mean else None,
+        "repeats": repeats,
+    }, **extra)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5, cwd=os.path.dirname(__file__)).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run(groups=None, quick: bool = False) -> dict:
+    """Выполнить группы (по умолчанию все). Упавшая или пропущенная группа не останавливает остальные"""
+    results, skipped = OrderedDict(), OrderedDict()
+    for group, func in BENCHMARKS.items():
+        if groups and group not in groups:
+            continue
+        logging.info(f"Бенчмарк {group}...")
+        started = time.perf_counter()
+        try:
+            for name, row in func(quick).items():
+                results[f"{group}/{name}"] = row
+        except Skip as e:
+            skipped[group] = str(e)
+            logging.warning(f"{group} пропущен: {e}")
+        except Exception as e:
+            skipped[group] = f"ошибка: {e}"
+            logging.exception(f"{group} упал")
+        logging.info(f"{group}: {time.perf_counter() - started:.1f} с")
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "quick": quick,
+            "embed_backend": os.getenv("EMBED_BACKEND", "torch"),
+        },
+        "results": results,
+        "skipped": skipped,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.15, min_delta_ms: float = 0.05) -> list:
+    """Сравнение p50 с базовой линией: [(замер, было мс, стало мс, отношение, статус)].
+    Статус - regression / improvement (отклонение больше tolerance и больше min_delta_ms
+    по абсолютной величине, чтобы не ловить шум микросекундных замеров), ok, new или missing"""
+    rows = []
+    base = baseline.get("results", {})
+    # Группы, которые в этот раз не запускались (--only), пропавшими не считаем
+    ran = {name.split("/")[0] for name in current.get("results", {})} | set(current.get("skipped", {}))
+    for name, row in current.get("results", {}).items():
+        old = base.get(name)
+        if old is None:
+            rows.append((name, None, row["p50_ms"], None, "new"))
+            continue
+        ratio = row["p50_ms"] / old["p50_ms"] if old["p50_ms"] else float("inf")
+        if abs(row["p50_ms"] - old["p50_ms"]) < min_delta_ms:
+            status = "ok"
+        else:
+            status = "regression" if ratio > 1 + tolerance else "improvement" if ratio < 1 - tolerance else "ok"
+        rows.append((name, old["p50_ms"], row["p50_ms"], round(ratio, 3), status))
+    for name, old in base.items():
+        if name not in current.get("results", {}) and name.split("/")[0] in ran:
+            rows.append((name, old["p50_ms"], None, None, "missing"))
+    return rows
+
+
+def load(path: str):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save(report: dict, path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
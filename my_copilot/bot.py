@@ -4,17 +4,38 @@ import logging
 import tempfile
 import json
 import datetime
+import hmac
+import time
+import weakref
+import urllib.parse
 from dotenv import load_dotenv, find_dotenv
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from openai import OpenAI
+from openai import AsyncOpenAI
 # from faster_whisper import WhisperModel # Moved to lazy import
 # import edge_tts # Moved to lazy import
 # import chromadb # Moved to lazy import
 # from sentence_transformers import SentenceTransformer # Moved to lazy import
-from utils.skills import SkillManager, OPENCLAW_TOOLS
+from utils.skills import SkillManager, OPENCLAW_TOOLS, registry as skill_registry
+from utils.transcriber import TranscriptionPool, TranscriptionBusy, TranscriptCache
+from utils.embeddings import EmbeddingCache, EmbeddingBatcher
+from utils.streaming import TelegramStreamer, stream_completion, reply_html, ttft_stats
+from utils.weather import weather_service
+from utils.broadcast import Broadcaster, RateLimiter
+from utils.subscribers import SubscriberStore
+from utils.history_store import history_store
+from utils.conversations import ConversationStore
+from utils.prompting import PromptAssembler, log_prompt_report, request_messages
+from utils.usage import usage_tracker
+from utils.answer_cache import AnswerCache, is_cacheable, vehicle_fingerprint
+from utils.vector_index import VectorIndex
+from utils.embed_backends import load_embedder
+from utils.tts import TTSService
+from utils.warmup import ModelWarmup
+from utils import metrics, tracing
+from utils.metrics import stage, in_flight
 import threading
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # 1. Загрузка переменных
 load_dotenv(find_dotenv())
@@ -24,20 +45,68 @@ DEEPSEEK_KEY = os.getenv("DEEPSEEK_API_KEY")
 # 2. Настройка логирования
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 
-# Сервер для поддержания активности (Heartbeat) - запускаем СРАЗУ для Render
+# Модели грузятся фоном (utils/warmup.py), бот принимает апдейты сразу
+warmup = ModelWarmup()
+
+# Сервер для поддержания активности (Heartbeat) - запускаем СРАЗУ для Render.
+# "/" и /healthz - процесс жив; /readyz - модели загружены (иначе 503) и сколько грузилась каждая;
+# /metrics - метрики в формате Prometheus (utils/metrics.py)
 class HealthCheckHandler(BaseHTTPRequestHandler):
     def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/plain')
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            self._reply(200, "text/plain; version=0.0.4", metrics.registry.render().encode())
+        elif path == "/readyz":
+            report = warmup.report()
+            self._reply(200 if report["ready"] else 503, "application/json",
+                        json.dumps(report, ensure_ascii=False).encode())
+        elif path == "/debug/traces":
+            self._debug_traces()
+        elif path in ("/", "/healthz"):
+            self._reply(200, "text/plain", b"Alex Audi CoPilot is alive and running!")
+        else:
+            self._reply(404, "text/plain", b"Not found")
+
+    def _debug_traces(self):
+        """Самые медленные из последних трейсов с разбивкой по этапам:
+        /debug/traces?limit=20, /debug/traces?order=recent, /debug/traces?id=<trace_id>.
+        Маршрут выключен, пока не задан DEBUG_TOKEN (тексты вопросов не должны светиться
+        наружу), и требует параметр token=<DEBUG_TOKEN>"""
+        params = {k: v[0] for k, v in urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query).items()}
+        token = os.getenv("DEBUG_TOKEN")
+        if not token:
+            self._reply(404, "text/plain", b"Not found")
+            return
+        if not hmac.compare_digest(params.get("token", "").encode(), token.encode()):
+            self._reply(403, "text/plain", b"Forbidden")
+            return
+        if "id" in params:
+            body = tracing.buffer.get(params["id"])
+            if body is None:
+                self._reply(404, "text/plain", b"Trace not found")
+                return
+        else:
+            try:
+                limit = max(1, min(int(params.get("limit", 20)), 200))
+            except ValueError:
+                limit = 20
+            body = tracing.buffer.recent(limit) if params.get("order") == "recent" else tracing.buffer.slowest(limit)
+        self._reply(200, "application/json", json.dumps(body, ensure_ascii=False, indent=1).encode())
+
+    def _reply(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header('Content-type', f"{content_type}; charset=utf-8")
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        self.wfile.write(b"Alex Audi CoPilot is alive and running!")
+        self.wfile.write(body)
+
     def log_message(self, format, *args): return
 
 def run_health_server():
     port = int(os.environ.get("PORT", 10000))
     logging.info(f"Запуск Heartbeat сервера на порту {port}...")
     try:
-        server = HTTPServer(('0.0.0.0', port), HealthCheckHandler)
+        server = ThreadingHTTPServer(('0.0.0.0', port), HealthCheckHandler)
         server.serve_forever()
     except Exception as e:
         logging.error(f"Ошибка сервера здоровья: {e}")
@@ -47,51 +116,173 @@ health_thread = threading.Thread(target=run_health_server, daemon=True)
 health_thread.start()
 
 # 3. Инициализация моделей (STT, RAG, Клиенты)
-print("Загрузка моделей (это может занять время)...")
 whisper_model = None
 embed_model = None
 
-def load_models():
-    global whisper_model, embed_model
+def load_whisper():
+    global whisper_model
     from faster_whisper import WhisperModel
-    from sentence_transformers import SentenceTransformer
-    
     if whisper_model is None:
         whisper_model = WhisperModel("base", device="cpu", compute_type="int8")
+
+def load_embeddings():
+    global embed_model
     if embed_model is None:
-        embed_model = SentenceTransformer('all-MiniLM-L6-v2')
-    
-    # Init ChromaDB
+        # Бэкенд (torch / int8 / onnx / onnx_int8) - из EMBED_BACKEND, см. utils/embed_backends.py
+        embed_model = load_embedder()
+
+def load_models():
+    """Синхронная загрузка всего сразу (для скриптов; бот грузит фоном через warmup)"""
+    load_whisper()
+    load_embeddings()
     init_chroma()
 
-client = OpenAI(api_key=DEEPSEEK_KEY, base_url="https://api.deepseek.com")
+# Что нужно для ответа на текст (RAG) и на голосовое
+TEXT_MODELS = ("embeddings", "chroma")
+VOICE_MODELS = ("whisper",) + TEXT_MODELS
+WARMUP_WAIT = float(os.getenv("WARMUP_WAIT", 60))
+
+async def ensure_ready(message, *names):
+    """Модели готовы - сразу True. Иначе предупреждаем и ждем не дольше WARMUP_WAIT"""
+    if warmup.is_ready(*names):
+        return True
+    if not warmup.failed(*names):
+        await message.reply_text("⏳ Я только проснулся и прогреваю модели, отвечу через несколько секунд...")
+        if await warmup.wait(*names, timeout=WARMUP_WAIT):
+            return True
+    failed = warmup.failed(*names)
+    await message.reply_text(
+        f"Не удалось загрузить: {', '.join(failed)}. Напиши позже." if failed
+        else "Модели все еще загружаются. Попробуй через минуту."
+    )
+    return False
+
+# Эмбеддинги: одновременные запросы разных чатов склеиваются в один батч encode,
+# поверх - кэш запросов (общий для RAG, фото и журнала событий)
+embedding_batcher = EmbeddingBatcher(
+    lambda: embed_model,
+    max_batch=int(os.getenv("EMBED_BATCH_SIZE", 32)),
+    max_wait_ms=float(os.getenv("EMBED_BATCH_WAIT_MS", 5)),
+)
+embedding_cache = EmbeddingCache(
+    lambda: embed_model,
+    max_size=int(os.getenv("EMBED_CACHE_SIZE", 2048)),
+    batcher=embedding_batcher,
+)
+
+# Пул распознавания голосовых (Whisper вне event loop, очередь ограничена).
+# Записи длиннее WHISPER_FAST_AFTER секунд - быстрым профилем, расшифровки кэшируются по file_unique_id
+transcriber = TranscriptionPool(
+    lambda: whisper_model,
+    workers=int(os.getenv("WHISPER_WORKERS", 2)),
+    max_queue=int(os.getenv("WHISPER_QUEUE_SIZE", 8)),
+    cache=TranscriptCache(int(os.getenv("TRANSCRIPT_CACHE_SIZE", 512))),
+    fast_after=float(os.getenv("WHISPER_FAST_AFTER", 20)),
+)
+
+# Асинхронный клиент: долгий ответ DeepSeek не блокирует event loop и другие чаты
+# DEEPSEEK_BASE_URL - другой OpenAI-совместимый сервер (например, заглушка из loadtest/)
+client = AsyncOpenAI(api_key=DEEPSEEK_KEY, base_url=os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com"))
+
+# Сколько апдейтов Telegram обрабатывается одновременно
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", 64))
+# Потоковый вывод: ответ появляется в чате по мере генерации
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") == "1"
+# Сколько раундов вызова навыков разрешено за один ответ (таймауты - у навыков в реестре)
+MAX_TOOL_STEPS = int(os.getenv("MAX_TOOL_STEPS", 3))
+
+# Бюджет промпта в токенах: RAG и история ужимаются под него, старые реплики - в сводку
+prompt_assembler = PromptAssembler(
+    budget=int(os.getenv("PROMPT_TOKEN_BUDGET", 3000)),
+    rag_share=float(os.getenv("PROMPT_RAG_SHARE", 0.4)),
+    max_messages=int(os.getenv("HISTORY_MAX_MESSAGES", 10)),
+    keep_messages=int(os.getenv("HISTORY_KEEP_MESSAGES", 4)),
+)
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", 200))
+
+# Семантический кэш ответов на общие вопросы (ANSWER_CACHE_SIZE=0 - выключен)
+answer_cache = AnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.92)),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", 6 * 3600)),
+    max_size=int(os.getenv("ANSWER_CACHE_SIZE", 1000)),
+)
+
+# Неизменная часть промпта - всегда первой: DeepSeek кэширует совпадающий префикс запросов,
+# поэтому все, что меняется (ТО, RAG), идет отдельным сообщением в конце
+ALEX_SYSTEM_PROMPT = (
+    "Ты — Алекс, лаконичный и умный штурман Audi A3.\n"
+    "Твоя цель: давать МАКСИМАЛЬНО емкие и технически точные советы. "
+    "Пиши только по делу, исключи 'воду' и лишние приветствия.\n\n"
+    "<b>Формат ответа:</b>\n"
+    "• Суть проблемы/ответа (выделяй <b>ключевые данные</b>).\n"
+    "• Краткий план действий (1-2-3).\n"
+    "• В конце: полезный совет или вопрос (без слов 'Проактивно' или 'Совет').\n\n"
+    "Данные о машине и контекст к вопросу приходят отдельным системным сообщением перед ним.\n"
+    "<b>ВАЖНО:</b> Используй ТОЛЬКО HTML (<b>, <code>). НЕ используй звездочки. "
+    "Будь краток, как в мессенджере. Весь текст должен умещаться на одном экране телефона."
+)
+
+# Разбор фото: инструкция неизменна, само описание фото - отдельным сообщением после нее
+PHOTO_ANALYSIS_PROMPT = (
+    "Ты — Алекс, эксперт по Audi A3. Тебе прислали описание фотографии. "
+    "Определи, это: 1) Фото чека/заказ-наряда, 2) Фото приборной панели с ошибкой, 3) Что-то другое. "
+    "Если это ПРИБОРНАЯ ПАНЕЛЬ, назови ТОЧНОЕ НАЗВАНИЕ значка (например, 'check engine', 'oil pressure', 'brake pads'). "
+    "Если это ЧЕК, выдели работы и пробег. Ответь в формате JSON: {'type': 'dashboard'|'document'|'other', 'search_query': 'что искать в мануале', 'summary': 'кратко что видишь'}."
+)
+
+async def complete(streamer=None, label="chat", **kwargs):
+    """Запрос к DeepSeek. Со streamer - потоково с правками сообщения, иначе целиком.
+    Возвращает (сообщение ассистента как dict - его можно сразу класть в историю, usage)"""
+    with stage(f"deepseek_{label}"):
+        if streamer is not None:
+            msg, usage = await stream_completion(client, streamer, **kwargs)
+        else:
+            response = await client.chat.completions.create(**kwargs)
+            msg, usage = response.choices[0].message.model_dump(exclude_none=True), response.usage
+    usage_tracker.record(usage, label)
+    return msg, usage
 
-# 2.5 Хранилище пользователей (для проактивности)
-USER_DATA_FILE = "user_data.json"
-def save_user(chat_id):
-    users = []
-    if os.path.exists(USER_DATA_FILE):
-        with open(USER_DATA_FILE, "r") as f: users = json.load(f)
-    if chat_id not in users:
-        users.append(chat_id)
-        with open(USER_DATA_FILE, "w") as f: json.dump(users, f)
+# Общий лимит правок/сообщений потоковых ответов: Telegram ограничивает не только чат (~1/с),
+# но и весь бот (~30/с), а при concurrent_updates стримят десятки чатов сразу
+stream_limiter = RateLimiter(float(os.getenv("STREAM_GLOBAL_RATE", 25)))
 
-def get_users():
-    if os.path.exists(USER_DATA_FILE):
-        with open(USER_DATA_FILE, "r") as f: return json.load(f)
-    return []
+# 2.5 Хранилище пользователей (для проактивности): SQLite, старый user_data.json импортируется один раз
+subscribers = SubscriberStore("subscribers.db", legacy_json="user_data.json")
 
-# Хранилище истории диалогов (в памяти)
-user_histories = {}
+# Хранилище истории диалогов: в памяти в пределах бюджета, все - на диске (переживает перезапуск)
+conversations = ConversationStore(
+    "conversations.db",
+    memory_budget=int(os.getenv("CONVERSATION_MEMORY_MB", 8)) * 1024 * 1024,
+)
+
+# Блокировки по пользователям: история диалога и сводка хранятся по user_id, поэтому апдейты
+# одного пользователя (в личке и в группе) обрабатываются строго по очереди, разных - параллельно.
+# Слабые ссылки - замок живет, пока его кто-то ждет.
+user_locks = weakref.WeakValueDictionary()
+# Свертки истории в сводку: по одной на пользователя, чтобы каждая дописывала результат предыдущей
+summary_locks = weakref.WeakValueDictionary()
+
+def _get_lock(locks, key):
+    lock = locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        locks[key] = lock
+    return lock
+
+def get_user_lock(user_id):
+    return _get_lock(user_locks, user_id)
 
 # Подключение к ChromaDB (Lazy)
 db_client = None
 collection = None
 user_history_col = None
+# Снимок инструкции (utils/vector_index.py): если артефакт есть - поиск по нему, Chroma только для истории
+manual_index = None
 
 def init_chroma():
-    global db_client, collection, user_history_col
+    global db_client, collection, user_history_col, manual_index
     import chromadb
+    manual_index = VectorIndex.load(os.getenv("VECTOR_INDEX_DIR", os.path.join(os.path.dirname(__file__), "vector_index")))
     db_path = os.path.join(os.path.dirname(__file__), "chroma_db")
     db_client = chromadb.PersistentClient(path=db_path)
     try:
@@ -105,47 +296,68 @@ def init_chroma():
 
 # ChromaDB lazy init handled in init_chroma
 
-# Загрузка истории ТО
-HISTORY_FILE = "service_history.json"
-def load_history():
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f: return json.load(f)
-    return {"oil_change": {"mileage": 145000, "date": "2024-01-01"}}
+warmup.add("whisper", load_whisper)
+warmup.add("embeddings", load_embeddings)
+warmup.add("chroma", init_chroma)
+
+# История ТО: в памяти, на диске - журнал (utils/history_store.py)
 
 # 4. Функции
+# Озвучка: mp3 в памяти, кэш на диске по хэшу (текст, голос, формат)
+tts_service = TTSService(
+    cache_dir=os.getenv("TTS_CACHE_DIR", "tts_cache"),
+    max_bytes=int(os.getenv("TTS_CACHE_MB", 50)) * 1024 * 1024,
+)
+
 async def text_to_speech(text):
-    import edge_tts
-    communicate = edge_tts.Communicate(text, "ru-RU-SvetlanaNeural")
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-        tmp_path = tmp_file.name
-        await communicate.save(tmp_path)
-    return tmp_path
+    return await tts_service.synthesize(text)
 
 # 5. Обработчики команд
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    save_user(update.effective_chat.id)
+    await asyncio.to_thread(subscribers.add, update.effective_chat.id)
     await update.message.reply_text("Привет! Я Алекс, твой второй пилот Audi A3. Я поумнел: теперь ты можешь прислать мне фото чека из сервиса, и я запомню его. Для полного отчета по машине напиши /report.")
 
 # 5.5 Проактивные задачи (Jobs)
 async def morning_job(context: ContextTypes.DEFAULT_TYPE):
-    users = get_users()
-    brief = SkillManager.get_proactive_briefing("Калуга")
-    for chat_id in users:
-        try:
-            await context.bot.send_message(chat_id=chat_id, text=brief, parse_mode="HTML")
-        except Exception as e:
-            logging.error(f"Не удалось отправить бриф {chat_id}: {e}")
+    brief = await SkillManager.get_proactive_briefing("Калуга")
+    broadcaster = Broadcaster(
+        context.bot,
+        global_rate=float(os.getenv("BROADCAST_RATE", 25)),
+        chat_interval=float(os.getenv("BROADCAST_CHAT_INTERVAL", 1.0)),
+        concurrency=int(os.getenv("BROADCAST_CONCURRENCY", 20)),
+        on_blocked=subscribers.deactivate_many,
+    )
+    await broadcaster.send(subscribers.aiter_active(), brief, parse_mode="HTML")
 
 async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    report_text = SkillManager.generate_service_report()
+    report_text = await asyncio.to_thread(SkillManager.generate_service_report)
     await update.message.reply_text(report_text, parse_mode="HTML")
 
+async def run_update(kind, update: Update, context: ContextTypes.DEFAULT_TYPE, handler):
+    """Трейс апдейта + счетчик "в обработке" + очередь пользователя (ожидание лока - отдельный этап).
+    Апдейты одного пользователя - по очереди, чтобы его история диалога не перемешивалась"""
+    chat_id = update.effective_chat.id
+    user_id = update.effective_user.id if update.effective_user else chat_id
+    async with tracing.trace(kind, update_id=update.update_id, chat_id=chat_id), in_flight(kind):
+        lock = get_user_lock(user_id)
+        with stage("user_lock_wait"):
+            await lock.acquire()
+        try:
+            await handler(update, context)
+        finally:
+            lock.release()
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await run_update("photo", update, context, process_photo)
+
+async def process_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     photo_file = await update.message.photo[-1].get_file()
     with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_img:
-        await photo_file.download_to_drive(tmp_img.name)
+        with stage("telegram_download"):
+            await photo_file.download_to_drive(tmp_img.name)
         
-        await update.message.reply_text("👁 Вижу документ. Анализирую содержимое...")
+        with stage("telegram_send"):
+            await update.message.reply_text("👁 Вижу документ. Анализирую содержимое...")
         
         # Используем Hugging Face для 'зрения' (как в Streamlit)
         hf_token = os.getenv("HUGGINGFACE_API_KEY")
@@ -161,40 +373,42 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 img_bytes = f.read()
             
             # Базовое описание изображения (для чеков лучше использовать OCR, но начнем с описания)
-            description = hf_client.image_to_text(img_bytes, model="Salesforce/blip-image-captioning-large")
-            text_desc = description[0]["generated_text"] if isinstance(description, list) else description
+            # HF_VISION_MODEL - имя модели или URL эндпоинта
+            vision_model = os.getenv("HF_VISION_MODEL", "Salesforce/blip-image-captioning-large")
+            with stage("hf_vision"):
+                description = await asyncio.to_thread(hf_client.image_to_text, img_bytes, model=vision_model)
+            if isinstance(description, list):
+                description = description[0]
+            # Новые huggingface_hub возвращают ImageToTextOutput, старые - dict
+            text_desc = getattr(description, "generated_text", None) or description["generated_text"]
             
             # Передаем описание Алексу, чтобы он понял контекст
-            system_analysis_prompt = (
-                "Ты — Алекс, эксперт по Audi A3. Тебе прислали описание фотографии. "
-                "Твое описание: " + text_desc + ". "
-                "Определи, это: 1) Фото чека/заказ-наряда, 2) Фото приборной панели с ошибкой, 3) Что-то другое. "
-                "Если это ПРИБОРНАЯ ПАНЕЛЬ, назови ТОЧНОЕ НАЗВАНИЕ значка (например, 'check engine', 'oil pressure', 'brake pads'). "
-                "Если это ЧЕК, выдели работы и пробег. Ответь в формате JSON: {'type': 'dashboard'|'document'|'other', 'search_query': 'что искать в мануале', 'summary': 'кратко что видишь'}."
-            )
-            
-            analysis_response = client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[{"role": "system", "content": system_analysis_prompt}],
-                response_format={'type': 'json_object'}
-            )
+            with stage("deepseek_photo"):
+                analysis_response = await client.chat.completions.create(
+                    model="deepseek-chat",
+                    messages=[
+                        {"role": "system", "content": PHOTO_ANALYSIS_PROMPT},
+                        {"role": "user", "content": "Описание фотографии: " + text_desc}
+                    ],
+                    response_format={'type': 'json_object'}
+                )
+            usage_tracker.record(analysis_response.usage, "photo")
             analysis = json.loads(analysis_response.choices[0].message.content)
             
             if analysis['type'] == 'dashboard' and analysis['search_query']:
-                await update.message.reply_text(f"🔍 Вижу значок: <b>{analysis['search_query']}</b>. Сверяюсь с инструкцией Audi...")
+                with stage("telegram_send"):
+                    await update.message.reply_text(f"🔍 Вижу значок: <b>{analysis['search_query']}</b>. Сверяюсь с инструкцией Audi...")
                 
                 # RAG по мануалу
-                if collection:
-                    res_manual = collection.query(
-                        query_embeddings=[embed_model.encode(analysis['search_query']).tolist()],
-                        n_results=2
-                    )
-                else:
-                    res_manual = {'documents': [[]]}
+                manual_docs = []
+                if warmup.is_ready(*TEXT_MODELS) and (manual_index or collection):
+                    with stage("embedding"):
+                        search_vector = await embedding_cache.encode_async(analysis['search_query'])
+                    manual_docs, _ = await asyncio.to_thread(search_manual, search_vector, 2)
                 
                 manual_context = ""
-                if res_manual['documents'] and res_manual['documents'][0]:
-                    manual_context = "\nИНСТРУКЦИЯ ГОВОРИТ:\n" + "\n".join(res_manual['documents'][0])
+                if manual_docs:
+                    manual_context = "\nИНСТРУКЦИЯ ГОВОРИТ:\n" + "\n".join(manual_docs)
                 
                 final_prompt = (
                     f"На фото приборной панели замечен значок: {analysis['search_query']}.\n"
@@ -202,16 +416,21 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "Дай четкий план действий водителю на основе этой информации. Используй HTML."
                 )
                 
-                final_res = client.chat.completions.create(
-                    model="deepseek-chat",
-                    messages=[{"role": "system", "content": "Ты — Алекс, диагностический ассистент Audi. Используй ТОЛЬКО HTML."}, {"role": "user", "content": final_prompt}]
-                )
-                await update.message.reply_text(final_res.choices[0].message.content, parse_mode="HTML")
+                with stage("deepseek_photo"):
+                    final_res = await client.chat.completions.create(
+                        model="deepseek-chat",
+                        messages=[{"role": "system", "content": "Ты — Алекс, диагностический ассистент Audi. Используй ТОЛЬКО HTML."}, {"role": "user", "content": final_prompt}]
+                    )
+                usage_tracker.record(final_res.usage, "photo")
+                with stage("telegram_send"):
+                    await update.message.reply_text(final_res.choices[0].message.content, parse_mode="HTML")
             
             elif analysis['type'] == 'document':
-                await update.message.reply_text(f"📝 <b>Анализ документа:</b>\n{analysis['summary']}\n\nХочешь, чтобы я внес это в журнал обслуживания?", parse_mode="HTML")
+                with stage("telegram_send"):
+                    await update.message.reply_text(f"📝 <b>Анализ документа:</b>\n{analysis['summary']}\n\nХочешь, чтобы я внес это в журнал обслуживания?", parse_mode="HTML")
             else:
-                await update.message.reply_text(f"📸 На фото: {analysis['summary']}")
+                with stage("telegram_send"):
+                    await update.message.reply_text(f"📸 На фото: {analysis['summary']}")
             
         except Exception as e:
             await update.message.reply_text(f"Не удалось распознать фото: {e}")
@@ -219,149 +438,289 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             os.remove(tmp_img.name)
 
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    hist = load_history()
-    last = hist["oil_change"]
+    last = await asyncio.to_thread(history_store.oil_change)
     await update.message.reply_text(f"📊 <b>Текущий статус ТО:</b>\nПоследняя замена масла: {last['date']} ({last['mileage']} км).", parse_mode="HTML")
 
+async def sync_event_to_chroma(args, result):
+    """После log_car_event: синхронизируем с ChromaDB для семантического поиска"""
+    if user_history_col:
+        now = datetime.datetime.now()
+        vector = await embedding_cache.encode_async(args['event_description'])
+        await asyncio.to_thread(
+            user_history_col.add,
+            ids=[str(now.timestamp())],
+            documents=[f"Событие {now.strftime('%d.%m.%Y')}: {args['event_description']} (Пробег: {args.get('mileage', 0)} км)"],
+            embeddings=[vector]
+        )
+
+skill_registry.add_listener("log_car_event", sync_event_to_chroma)
+
+async def run_tool(tool_call):
+    """Один tool_call модели -> текст результата (таймауты и ошибки обрабатывает реестр)"""
+    func_name = tool_call["function"]["name"]
+    logging.info(f"Агент вызывает навык: {func_name}")
+    try:
+        args = json.loads(tool_call["function"]["arguments"] or "{}")
+    except json.JSONDecodeError as e:
+        return f"Некорректные аргументы для {func_name}: {e}"
+    return await skill_registry.call(func_name, args)
+
+async def retrieve_context(text_prompt):
+    """Поиск в RAG: эмбеддинг через батчер, запросы к Chroma - в потоке"""
+    with stage("embedding"):
+        query_vector = await embedding_cache.encode_async(text_prompt)
+    return await asyncio.to_thread(query_rag, query_vector)
+
+def search_manual(query_vector, n_results=2):
+    """Поиск по инструкции -> (документы, расстояния). Блокирующий"""
+    if manual_index is not None:
+        with stage("manual_query"):
+            return manual_index.search(query_vector, n_results)
+    if collection:
+        with stage("manual_query"):
+            res_manual = collection.query(query_embeddings=[query_vector], n_results=n_results)
+        return res_manual['documents'][0], res_manual['distances'][0]
+    return [], []
+
+def query_rag(query_vector):
+    """Два источника: Инструкция + Личная история. Блокирующий.
+    Возвращает фрагменты [(текст, расстояние, заголовок)] - отбор по бюджету делает PromptAssembler"""
+    snippets = []
+    
+    # 1. Из инструкции
+    docs, distances = search_manual(query_vector, 2)
+    snippets += [(doc, dist, "ИНФОРМАЦИЯ ИЗ ИНСТРУКЦИИ") for doc, dist in zip(docs, distances)]
+    
+    # 2. Из истории машины
+    if user_history_col:
+        with stage("history_query"):
+            res_user = user_history_col.query(query_embeddings=[query_vector], n_results=3)
+        if res_user['documents'][0]:
+            snippets += [(doc, dist, "ИЗ ИСТОРИИ ЭТОЙ МАШИНЫ") for doc, dist in zip(res_user['documents'][0], res_user['distances'][0])]
+    return snippets
+
+async def fold_into_summary(user_id, dropped):
+    """Свернуть вытесненные из истории реплики в сводку (фоном, после ответа).
+    Запрос к DeepSeek идет без лока пользователя - его следующее сообщение не ждет сеть;
+    лок берется только на запись готовой сводки"""
+    lines = []
+    for m in dropped:
+        if m["role"] in ("user", "assistant") and m.get("content"):
+            who = "Водитель" if m["role"] == "user" else "Алекс"
+            lines.append(f"{who}: {m['content']}")
+    if not lines:
+        return
+    async with _get_lock(summary_locks, user_id):
+        summary = await asyncio.to_thread(conversations.get_summary, user_id)
+        try:
+            with stage("deepseek_summary"):
+                response = await client.chat.completions.create(
+                    model="deepseek-chat",
+                    messages=[
+                        {"role": "system", "content": "Сожми переписку водителя с ассистентом в краткую сводку фактов (машина, проблемы, решения, договоренности). Без вступлений, до 5 пунктов."},
+                        {"role": "user", "content": f"Текущая сводка:\n{summary or '(пусто)'}\n\nНовые реплики:\n" + "\n".join(lines)}
+                    ],
+                    max_tokens=SUMMARY_MAX_TOKENS
+                )
+        except Exception as e:
+            logging.error(f"Не удалось обновить сводку диалога: {e}")
+            return
+        usage_tracker.record(response.usage, "summary")
+        async with get_user_lock(user_id):
+            await asyncio.to_thread(conversations.set_summary, user_id, response.choices[0].message.content)
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await run_update("message", update, context, process_message)
+
+async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if user_id not in user_histories:
-        user_histories[user_id] = []
+    if not await ensure_ready(update.message, *(VOICE_MODELS if update.message.voice else TEXT_MODELS)):
+        return
 
     # Если пришло голосовое сообщение
     text_prompt = None
     if update.message.voice:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".ogg") as tmp_ogg:
-            voice_file = await update.message.voice.get_file()
-            await voice_file.download_to_drive(tmp_ogg.name)
-            
-            # STT
-            with st.spinner("Слушаю..."):
-                segments, _ = whisper_model.transcribe(tmp_ogg.name, beam_size=5)
-                text_prompt = " ".join([segment.text for segment in segments])
-            if text_prompt:
-                await update.message.reply_text(f"🎤 Понял: \"{text_prompt}\"")
+        voice = update.message.voice
+        # Пересланное/повторное голосовое: тот же file_unique_id - не скачиваем и не распознаем
+        text_prompt = transcriber.cached(voice.file_unique_id)
+        if text_prompt is None:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".ogg") as tmp_ogg:
+                tmp_path = tmp_ogg.name
+            try:
+                voice_file = await voice.get_file()
+                with stage("telegram_download"):
+                    await voice_file.download_to_drive(tmp_path)
+
+                # STT в пуле воркеров, профиль - по длительности записи
+                with stage("whisper"):
+                    text_prompt = await transcriber.transcribe(
+                        tmp_path, duration=voice.duration, cache_key=voice.file_unique_id
+                    )
+            except TranscriptionBusy:
+                await update.message.reply_text("🎤 Сейчас много голосовых, не успеваю. Повтори через минутку или напиши текстом.")
+                return
+            finally:
+                os.remove(tmp_path)
+        if text_prompt:
+            await update.message.reply_text(f"🎤 Понял: \"{text_prompt}\"")
+        else:
+            await update.message.reply_text("🎤 Не расслышал. Повтори, пожалуйста, или напиши текстом.")
     else:
         text_prompt = update.message.text
 
     # Ответ от Алекса
     if text_prompt:
-        hist = load_history()
-        last_oil = hist["oil_change"]
-        
-        # Поиск в RAG (Два источника: Инструкция + Личная история)
-        combined_context = ""
-        query_vector = embed_model.encode(text_prompt).tolist()
-        
-        # 1. Из инструкции
-        if collection:
-            res_manual = collection.query(query_embeddings=[query_vector], n_results=2)
-            combined_context += "\nИНФОРМАЦИЯ ИЗ ИНСТРУКЦИИ:\n" + "\n".join(res_manual['documents'][0])
-        
-        # 2. Из истории машины
-        if user_history_col:
-            res_user = user_history_col.query(query_embeddings=[query_vector], n_results=3)
-            if res_user['documents'][0]:
-                combined_context += "\nИЗ ИСТОРИИ ЭТОЙ МАШИНЫ:\n" + "\n".join(res_user['documents'][0])
+        started = time.perf_counter()
+        # Чтения истории - в потоке: при изменении файлов другим процессом (app.py) снимок перечитывается с диска
+        last_oil = await asyncio.to_thread(history_store.oil_change)
+
+        # Общий вопрос при том же состоянии машины - отвечаем из кэша, без RAG и DeepSeek
+        cache_key = None
+        if is_cacheable(text_prompt):
+            fingerprint = vehicle_fingerprint(last_oil, await asyncio.to_thread(history_store.last_events, 3))
+            with stage("embedding"):
+                query_vector = await embedding_cache.encode_async(text_prompt)
+            cached = answer_cache.lookup(query_vector, fingerprint)
+            if cached:
+                logging.info(f"Ответ из кэша за {time.perf_counter() - started:.3f} с")
+                history = await asyncio.to_thread(conversations.get, user_id)
+                history += [{"role": "user", "content": text_prompt}, {"role": "assistant", "content": cached}]
+                await reply_html(update.message, cached)
+                await asyncio.to_thread(conversations.save, user_id, history)
+                return
+            cache_key = (query_vector, fingerprint)
+
+        # Поиск в RAG (эмбеддинг и Chroma - CPU/диск, уносим из event loop)
+        with stage("rag"):
+            snippets = await retrieve_context(text_prompt)
 
         service_info = f"Последняя замена масла: {last_oil['date']} на {last_oil['mileage']} км."
-        system_prompt = (
-            f"Ты — Алекс, лаконичный и умный штурман Audi A3. {service_info}\n"
-            "Твоя цель: давать МАКСИМАЛЬНО емкие и технически точные советы. "
-            "Пиши только по делу, исключи 'воду' и лишние приветствия.\n\n"
-            "<b>Формат ответа:</b>\n"
-            "• Суть проблемы/ответа (выделяй <b>ключевые данные</b>).\n"
-            "• Краткий план действий (1-2-3).\n"
-            "• В конце: полезный совет или вопрос (без слов 'Проактивно' или 'Совет').\n\n"
-            f"Контекст: {combined_context}\n"
-            "<b>ВАЖНО:</b> Используй ТОЛЬКО HTML (<b>, <code>). НЕ используй звездочки. "
-            "Будь краток, как в мессенджере. Весь текст должен умещаться на одном экране телефона."
-        )
-        
+
         # Добавляем сообщение пользователя в историю
-        user_histories[user_id].append({"role": "user", "content": text_prompt})
-        # Держим только последние 10 сообщений
-        user_histories[user_id] = user_histories[user_id][-10:]
+        history = await asyncio.to_thread(conversations.get, user_id)
+        summary = await asyncio.to_thread(conversations.get_summary, user_id)
+        history.append({"role": "user", "content": text_prompt})
+        
+        # Подгоняем промпт под бюджет: что не влезло из истории - уйдет в сводку
+        with tracing.span("prompt_build"):
+            combined_context, history, dropped, prompt_report = prompt_assembler.build(
+                ALEX_SYSTEM_PROMPT + service_info, snippets, summary, history
+            )
+        # Порядок для кэша префикса - utils/prompting.request_messages. Сводка меняется только при
+        # свертке, история между свертками только дописывается. Данные запроса в историю не сохраняются
+        state = {"role": "system", "content": f"{service_info}\nКонтекст: {combined_context or 'нет'}"}
+        turn_start = len(history) - 1
 
+        def messages():
+            return request_messages(ALEX_SYSTEM_PROMPT, summary, history, turn_start, state)
+
+        streamer = None
         try:
-            response = client.chat.completions.create(
+            if STREAM_ANSWERS:
+                streamer = TelegramStreamer(update.message, started_at=started, limiter=stream_limiter)
+                await streamer.start()
+
+            msg, usage = await complete(
+                streamer,
                 model="deepseek-chat",
-                messages=[{"role": "system", "content": system_prompt}] + user_histories[user_id],
+                messages=messages(),
                 tools=OPENCLAW_TOOLS,
                 tool_choice="auto"
             )
+            log_prompt_report(prompt_report, usage)
             
-            msg = response.choices[0].message
-            
-            if msg.tool_calls:
-                for tool_call in msg.tool_calls:
-                    func_name = tool_call.function.name
-                    args = json.loads(tool_call.function.arguments)
-                    
-                    logging.info(f"Агент вызывает навык: {func_name}")
-                    
-                    if func_name == "get_weather":
-                        result = SkillManager.get_weather(**args)
-                    elif func_name == "get_part_info":
-                        result = SkillManager.get_part_info(**args)
-                    elif func_name == "log_car_event":
-                        result = SkillManager.log_car_event(**args)
-                        # Синхронизируем с ChromaDB для семантического поиска
-                        if user_history_col:
-                            now = datetime.datetime.now()
-                            user_history_col.add(
-                                ids=[str(now.timestamp())],
-                                documents=[f"Событие {now.strftime('%d.%m.%Y')}: {args['event_description']} (Пробег: {args.get('mileage', 0)} км)"],
-                                embeddings=[embed_model.encode(args['event_description']).tolist()]
-                            )
-                    elif func_name == "remove_last_event":
-                        result = SkillManager.remove_last_event()
-                    elif func_name == "get_part_numbers":
-                        result = SkillManager.get_part_numbers(**args)
-                    elif func_name == "sos_help":
-                        result = SkillManager.sos_help(**args)
-                    elif func_name == "web_search":
-                        result = SkillManager.web_search(**args)
-                    else:
-                        result = "Навык не найден."
-                    
-                    user_histories[user_id].append(msg)
-                    user_histories[user_id].append({
+            # Навыки одного ответа выполняются параллельно, затем ровно один follow-up.
+            # Если модель снова просит навыки - следующий раунд, но не больше MAX_TOOL_STEPS
+            step = 0
+            while msg.get("tool_calls") and step < MAX_TOOL_STEPS:
+                step += 1
+                history.append(conversations.compact_message(msg))
+                with stage("tools"):
+                    results = await asyncio.gather(*(run_tool(tool_call) for tool_call in msg["tool_calls"]))
+                for tool_call, result in zip(msg["tool_calls"], results):
+                    # Сразу в сохраняемом виде: следующий ход увидит ровно этот текст
+                    history.append(conversations.compact_message({
                         "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "name": func_name,
+                        "tool_call_id": tool_call["id"],
+                        "name": tool_call["function"]["name"],
                         "content": result
-                    })
-                    
-                    final_res = client.chat.completions.create(
-                        model="deepseek-chat",
-                        messages=[{"role": "system", "content": system_prompt}] + user_histories[user_id]
-                    )
-                    answer = final_res.choices[0].message.content
-            else:
-                answer = msg.content
+                    }))
+                
+                request = dict(model="deepseek-chat", messages=messages())
+                if step < MAX_TOOL_STEPS:
+                    request.update(tools=OPENCLAW_TOOLS, tool_choice="auto")
+                msg, usage = await complete(streamer, label="chat_tools", **request)
+            answer = msg.get("content") or ""
             
             # Добавляем ответ в историю
-            user_histories[user_id].append({"role": "assistant", "content": answer})
+            history.append({"role": "assistant", "content": answer})
+            # Ответы с навыками (погода, журнал, поиск) зависят от момента - в кэш не кладем
+            if cache_key and step == 0:
+                answer_cache.store(*cache_key, text_prompt, answer)
             
             # Отправка текста с поддержкой HTML и фоллбэком
-            try:
-                await update.message.reply_text(answer, parse_mode="HTML")
-            except Exception as e_html:
-                logging.error(f"HTML Error: {e_html}. Sending raw text.")
-                # Если HTML сломан, отправляем как есть, но чистим теги чтобы не пугать юзера
-                clean_text = answer.replace("<b>", "").replace("</b>", "").replace("<i>", "").replace("</i>", "")
-                await update.message.reply_text(clean_text, parse_mode=None)
+            if streamer:
+                await streamer.finish(answer)
+            else:
+                await reply_html(update.message, answer)
             
         except Exception as e:
-            await update.message.reply_text(f"Упс, ошибка связи: {e}")
+            if streamer and streamer.message:
+                await streamer.finish(f"Упс, ошибка связи: {e}", html=False)
+            else:
+                await update.message.reply_text(f"Упс, ошибка связи: {e}")
+        finally:
+            await asyncio.to_thread(conversations.save, user_id, history)
+            if dropped:
+                context.application.create_task(fold_into_summary(user_id, dropped))
+
+# Метрики, которые уже считают сами компоненты, читаются в момент запроса /metrics
+def runtime_collector():
+    queue = transcriber.stats()
+    memory = conversations.stats()
+    batches = embedding_batcher.stats()
+    ttft = ttft_stats.stats()
+    return [
+        ("copilot_whisper_queue_depth", "gauge", "Голосовые в очереди Whisper", [({}, queue["queue_depth"])]),
+        ("copilot_whisper_running", "gauge", "Голосовые в распознавании", [({}, queue["running"])]),
+        ("copilot_whisper_rejected_total", "counter", "Голосовые, отклоненные из-за очереди", [({}, queue["rejected"])]),
+        ("copilot_conversations_memory_bytes", "gauge", "Истории диалогов в памяти", [({}, memory["memory_bytes"])]),
+        ("copilot_embedding_batch_size_avg", "gauge", "Средний размер батча эмбеддингов", [({}, batches["avg_batch_size"])]),
+        ("copilot_ttft_seconds", "gauge", "Время до первого видимого токена (последние ответы)",
+         [({"quantile": "0.5"}, ttft["p50"]), ({"quantile": "0.95"}, ttft["p95"])]),
+        ("copilot_ttft_answers_total", "counter", "Потоковые ответы с замером TTFT", [({}, ttft["count"])]),
+        ("copilot_models_ready", "gauge", "Модель загружена (1) или нет (0)",
+         [({"model": name}, int(m["status"] == "ready")) for name, m in warmup.report()["models"].items()]),
+    ]
+
+metrics.registry.add_collector(metrics.cache_collector({
+    "embedding": embedding_cache,
+    "answer": answer_cache,
+    "transcript": transcriber.cache,
+    "tts": tts_service,
+    "weather": weather_service,
+}))
+metrics.registry.add_collector(metrics.usage_collector(usage_tracker))
+metrics.registry.add_collector(runtime_collector)
+
+async def on_shutdown(app):
+    await weather_service.close()
+    await asyncio.to_thread(history_store.compact)
+    for label, row in usage_tracker.stats().items():
+        logging.info(f"DeepSeek итого [{label}]: {row['requests']} запросов, кэш префикса {row['cache_hit_rate']:.0%}")
+    logging.info(f"Кэш ответов: {answer_cache.stats()}")
 
 # 6. Запуск
 if __name__ == "__main__":
     if not TG_TOKEN:
         print("Ошибка: TELEGRAM_BOT_TOKEN не найден в .env")
     else:
-        app = Application.builder().token(TG_TOKEN).build()
+        builder = Application.builder().token(TG_TOKEN).concurrent_updates(MAX_CONCURRENT_UPDATES).post_shutdown(on_shutdown)
+        # TELEGRAM_API_BASE - свой Bot API сервер (или заглушка нагрузочного теста из loadtest/)
+        telegram_api = os.getenv("TELEGRAM_API_BASE")
+        if telegram_api:
+            builder = builder.base_url(f"{telegram_api}/bot").base_file_url(f"{telegram_api}/file/bot")
+        app = builder.build()
         
         # Настройка планировщика (Jobs)
         job_queue = app.job_queue
@@ -377,7 +736,7 @@ if __name__ == "__main__":
         
         print("Алекс в Телеграме запущен!")
         
-        # Ленивая загрузка моделей перед запуском бота
-        load_models()
+        # Модели грузятся параллельно в фоне, polling стартует сразу (готовность - /readyz)
+        warmup.start()
         
         app.run_polling()
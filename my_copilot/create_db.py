@@ -1,72 +1,185 @@
-import pypdf
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
+import hashlib
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 # НАСТРОЙКИ
 MANUAL_FILE = "manual.pdf"  # <-- Имя вашего файла с инструкцией Audi
 CHROMA_PATH = "chroma_db"   # Папка, где сохранится база знаний
-
-from dotenv import load_dotenv, find_dotenv
-
-# 0. Загрузка переменных
-load_dotenv(find_dotenv())
-
-# ПРИНУДИТЕЛЬНЫЙ ХАК: Если ваш токен в .env или в системе невалиден (ошибка 401),
-# мы удаляем его из текущего процесса, чтобы библиотеки работали в анонимном режиме.
-# Модели Whisper и Sentence-Transformers — публичные, им токен не обязателен.
-if "HF_TOKEN" in os.environ:
-    del os.environ["HF_TOKEN"]
-if "HUGGINGFACE_HUB_TOKEN" in os.environ:
-    del os.environ["HUGGINGFACE_HUB_TOKEN"]
-
-# 1. Инициализация модели (скачается при первом запуске ~100Мб)
-print("Загрузка модели для поиска смысловых связей...")
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-
-# 2. Чтение PDF
-print(f"Читаю файл {MANUAL_FILE}...")
-if not os.path.exists(MANUAL_FILE):
-    print(f"❌ Ошибка: Файл {MANUAL_FILE} не найден! Положите его в эту же папку.")
-    exit()
-
-reader = pypdf.PdfReader(MANUAL_FILE)
-text_data = ""
-
-for page in reader.pages:
-    text_data += page.extract_text() + "\n"
-
-# 3. Разбивка на куски (Chunks)
-chunks = []
-chunk_size = 1000
-overlap = 100
-
-for i in range(0, len(text_data), chunk_size - overlap):
-    chunk = text_data[i:i + chunk_size]
-    chunks.append(chunk)
-
-print(f"Текст разбит на {len(chunks)} кусочков.")
-
-# 4. Создание базы данных ChromaDB
-print("Создаю базу данных (это займет пару минут)...")
-client = chromadb.PersistentClient(path=CHROMA_PATH)
-
-# Вместо очистки через delete(where={}), просто удаляем и создаем коллекцию заново
-try:
-    client.delete_collection(name="audi_manual")
-except Exception:
-    pass # Если коллекции еще нет
-
-collection = client.create_collection(name="audi_manual")
-
-# Добавление данных
-ids = [str(i) for i in range(len(chunks))]
-# Разбиваем на батчи, если данных много (Chroma любит порции до 40000)
-collection.add(
-    documents=chunks,
-    ids=ids,
-    embeddings=[embedding_model.encode(chunk).tolist() for chunk in chunks]
-)
-
-print("✅ Готово! База знаний создана в папке 'chroma_db'. Теперь можно запускать app.py")
+INDEX_PATH = "vector_index" # Снимок для бота (utils/vector_index.py)
+EMBED_MODEL = "all-MiniLM-L6-v2"
+
+CHUNK_SIZE = 1000
+OVERLAP = 100
+PAGES_PER_TASK = 8          # Страниц на одну задачу воркера
+ENCODE_BATCH = int(os.getenv("INGEST_ENCODE_BATCH", 256))   # Кусочков в одном вызове encode
+INSERT_BATCH = int(os.getenv("INGEST_INSERT_BATCH", 1000))  # Записей в одном запросе к Chroma
+
+
+def extract_pages(path, start, stop):
+    """Текст страниц [start, stop) - выполняется в отдельном процессе"""
+    import pypdf
+    reader = pypdf.PdfReader(path)
+    return [(reader.pages[i].extract_text() or "") for i in range(start, stop)]
+
+
+def iter_pages(path, workers=None):
+    """Страницы по порядку; извлечение идет параллельно на всех ядрах"""
+    import pypdf
+    total = len(pypdf.PdfReader(path).pages)
+    starts = range(0, total, PAGES_PER_TASK)
+    stops = [min(i + PAGES_PER_TASK, total) for i in starts]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for texts in pool.map(extract_pages, [path] * len(starts), starts, stops):
+            yield from texts
+
+
+def iter_chunks(pages, chunk_size=CHUNK_SIZE, overlap=OVERLAP):
+    """Куски режутся внутри страницы; первый кусок страницы начинается с хвоста (overlap символов)
+    предыдущей, чтобы фраза на стыке страниц не терялась. Границы зависят только от своей страницы,
+    поэтому правка в инструкции меняет куски этой страницы и первый кусок следующей, а не все последующие"""
+    step = chunk_size - overlap
+    tail = ""
+    for text in pages:
+        text = text.strip()
+        if not text:
+            continue
+        buf = tail + text
+        for start in range(0, len(buf), step):
+            yield buf[start:start + chunk_size]
+            if start + chunk_size >= len(buf):
+                break
+        tail = text[-overlap:] + "\n"
+
+
+def chunk_id(chunk):
+    # id = хэш содержимого: неизменившийся кусок при повторном запуске не пересчитывается
+    return hashlib.sha1(chunk.encode("utf-8")).hexdigest()[:20]
+
+
+def existing_ids(collection, page_size=INSERT_BATCH):
+    ids, offset = set(), 0
+    while True:
+        page = collection.get(include=[], limit=page_size, offset=offset)
+        if not page["ids"]:
+            return ids
+        ids.update(page["ids"])
+        offset += len(page["ids"])
+
+
+def open_collection(client, backend="torch"):
+    """Коллекция audi_manual; если эмбеддинги в ней от другой модели или другого бэкенда
+    (torch / int8 / onnx / onnx_int8 дают немного разные векторы) - создается заново"""
+    metadata = {"embed_model": EMBED_MODEL, "embed_backend": backend}
+    collection = client.get_or_create_collection(name="audi_manual", metadata=metadata)
+    stored = collection.metadata or {}
+    # Коллекции до появления бэкендов посчитаны torch fp32
+    if (stored.get("embed_model"), stored.get("embed_backend", "torch")) != (EMBED_MODEL, backend):
+        print(f"Коллекция посчитана другой моделью или бэкендом ({stored}) - пересоздаю...")
+        client.delete_collection(name="audi_manual")
+        collection = client.create_collection(name="audi_manual", metadata=metadata)
+    return collection
+
+
+def main():
+    from dotenv import load_dotenv, find_dotenv
+    import chromadb
+
+    # 0. Загрузка переменных
+    load_dotenv(find_dotenv())
+
+    # ПРИНУДИТЕЛЬНЫЙ ХАК: Если ваш токен в .env или в системе невалиден (ошибка 401),
+    # мы удаляем его из текущего процесса, чтобы библиотеки работали в анонимном режиме.
+    # Модели Whisper и Sentence-Transformers — публичные, им токен не обязателен.
+    if "HF_TOKEN" in os.environ:
+        del os.environ["HF_TOKEN"]
+    if "HUGGINGFACE_HUB_TOKEN" in os.environ:
+        del os.environ["HUGGINGFACE_HUB_TOKEN"]
+
+    if not os.path.exists(MANUAL_FILE):
+        print(f"❌ Ошибка: Файл {MANUAL_FILE} не найден! Положите его в эту же папку.")
+        return
+
+    # 1. Инициализация модели (скачается при первом запуске ~100Мб)
+    print("Загрузка модели для поиска смысловых связей...")
+    # Бэкенд (torch / int8 / onnx / onnx_int8) - из EMBED_BACKEND; сверка с fp32: python -m utils.embed_backends check
+    from utils.embed_backends import load_embedder
+    embedding_model = load_embedder(model_name=EMBED_MODEL)
+
+    # 2. База: что уже посчитано
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    collection = open_collection(client, embedding_model.embed_backend)
+    known = existing_ids(collection)
+    insert_batch = min(INSERT_BATCH, getattr(client, "get_max_batch_size", lambda: INSERT_BATCH)())
+    print(f"В базе уже {len(known)} кусочков.")
+
+    # 3. Конвейер: страницы (параллельно) -> куски -> новые копятся в батч -> encode -> Chroma
+    started = time.perf_counter()
+    stats = {"pages": 0, "chunks": 0, "new": 0, "encode_s": 0.0, "insert_s": 0.0}
+    seen = set()
+    pending = []
+
+    def flush():
+        if not pending:
+            return
+        t = time.perf_counter()
+        vectors = embedding_model.encode([c for _, c in pending], batch_size=min(len(pending), 64))
+        stats["encode_s"] += time.perf_counter() - t
+        t = time.perf_counter()
+        for i in range(0, len(pending), insert_batch):
+            part = pending[i:i + insert_batch]
+            collection.add(
+                ids=[cid for cid, _ in part],
+                documents=[c for _, c in part],
+                embeddings=vectors[i:i + insert_batch].tolist(),
+            )
+        stats["insert_s"] += time.perf_counter() - t
+        stats["new"] += len(pending)
+        pending.clear()
+
+    def counted(pages):
+        for text in pages:
+            stats["pages"] += 1
+            yield text
+
+    print(f"Читаю файл {MANUAL_FILE}...")
+    for chunk in iter_chunks(counted(iter_pages(MANUAL_FILE))):
+        cid = chunk_id(chunk)
+        if cid in seen:
+            continue  # одинаковые куски (колонтитулы и т.п.) храним один раз
+        seen.add(cid)
+        stats["chunks"] += 1
+        if cid not in known:
+            pending.append((cid, chunk))
+            if len(pending) >= ENCODE_BATCH:
+                flush()
+    flush()
+
+    # 4. Куски, которых больше нет в инструкции
+    stale = list(known - seen)
+    for i in range(0, len(stale), insert_batch):
+        collection.delete(ids=stale[i:i + insert_batch])
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"Страниц: {stats['pages']} ({stats['pages'] / elapsed:.1f} стр/с), "
+        f"кусочков: {stats['chunks']} ({stats['chunks'] / elapsed:.1f} кус/с), "
+        f"новых: {stats['new']}, без изменений: {stats['chunks'] - stats['new']}, удалено: {len(stale)}"
+    )
+    if stats["new"]:
+        print(
+            f"Эмбеддинги: {stats['new'] / max(stats['encode_s'], 1e-9):.1f} кус/с, "
+            f"запись в Chroma: {stats['new'] / max(stats['insert_s'], 1e-9):.1f} кус/с"
+        )
+
+    # 5. Снимок для бота: матрица в mmap открывается мгновенно
+    if collection.count():
+        from utils.vector_index import export_collection
+        manifest = export_collection(collection, INDEX_PATH)
+        print(f"Векторный индекс: версия {manifest['version']}, {manifest['count']} кусочков в папке '{INDEX_PATH}'")
+
+    print(f"✅ Готово за {elapsed:.1f} с! База знаний в папке '{CHROMA_PATH}'. Теперь можно запускать app.py")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Нагрузочный тест бота без сети: python -m loadtest [опции] (из папки my_copilot).
+
+Поднимает заглушки Telegram Bot API и DeepSeek/Hugging Face на localhost, запускает
+bot.py отдельным процессом (во временной рабочей папке, с TELEGRAM_API_BASE и
+DEEPSEEK_BASE_URL на заглушки), ждет /readyz и гоняет пользователей. Модели
+(Whisper, эмбеддинги) и chroma_db должны быть на диске - их бот грузит как обычно.
+
+  --users 5,10,20,40        - ступени числа одновременных чатов (каждая --duration секунд)
+  --duration 60             - длительность ступени после разгона (--ramp-up)
+  --mix text=0.7,voice=0.2,photo=0.1
+  --think 1,3               - пауза пользователя между сообщениями, с
+  --llm-first-token 0.8     - задержка DeepSeek до первого токена, с (--llm-jitter)
+  --llm-tps 40              - скорость потока, слов/с; --answer-words 60; --tool-ratio 0.2
+  --no-stream               - STREAM_ANSWERS=0 у бота
+  --no-answer-cache         - ANSWER_CACHE_SIZE=0 у бота (каждый вопрос идет в DeepSeek)
+  --repeat-voice            - одно и то же голосовое (работает кэш расшифровок)
+  --voice PATH              - свое голосовое (по умолчанию loadtest/fixtures/*.ogg|wav или синтетика)
+  --no-bot                  - не запускать бот: печатает переменные окружения и ждет уже запущенный
+  --out report.json         - полный отчет (с самыми медленными трейсами бота)
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from loadtest.fake_llm import FakeLLM
+from loadtest.fake_telegram import FakeTelegram
+from loadtest.generator import LoadGenerator, load_voice
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot.py")
+DEBUG_TOKEN = "loadtest"  # /debug/traces у бота открыт только с токеном
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get_json(url: str, timeout: float = 5.0):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"null")
+
+
+def _parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        kind, _, share = part.partition("=")
+        if kind.strip() not in ("text", "voice", "photo"):
+            raise argparse.ArgumentTypeError(f"неизвестный тип сообщения: {kind}")
+        mix[kind.strip()] = float(share)
+    return mix
+
+
+def bot_env(args, telegram: FakeTelegram, llm: FakeLLM, health_port: int) -> dict:
+    env = {
+        "TELEGRAM_BOT_TOKEN": "123456:loadtest",
+        "TELEGRAM_API_BASE": telegram.url,
+        "DEEPSEEK_API_KEY": "loadtest",
+        "DEEPSEEK_BASE_URL": llm.url,
+        "HUGGINGFACE_API_KEY": "loadtest",
+        "HF_VISION_MODEL": f"{llm.url}/hf/blip",
+        "PORT": str(health_port),
+        "STREAM_ANSWERS": "0" if args.no_stream else "1",
+        "TRACE_BUFFER_SIZE": "2000",
+        "DEBUG_TOKEN": DEBUG_TOKEN,
+    }
+    if args.no_answer_cache:
+        env["ANSWER_CACHE_SIZE"] = "0"
+    return env
+
+
+def start_bot(env: dict, workdir: str):
+    log = open(os.path.join(workdir, "bot.log"), "wb")
+    process = subprocess.Popen([sys.executable, BOT_PATH], cwd=workdir, env=dict(os.environ, **env),
+                               stdout=log, stderr=subprocess.STDOUT)
+    logging.info(f"bot.py запущен (pid {process.pid}), лог: {log.name}")
+    return process
+
+
+def wait_ready(health_url: str, telegram: FakeTelegram, process, timeout: float):
+    """Модели прогреты (/readyz) и бот начал опрашивать getUpdates"""
+    deadline = time.monotonic() + timeout
+    report = None
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"bot.py завершился с кодом {process.returncode}")
+        try:
+            code, report = _get_json(f"{health_url}/readyz")
+        except OSError:
+            code = None
+        if code == 200 and telegram.calls["getUpdates"]:
+            return report
+        if report and any(m["status"] == "failed" for m in report["models"].values()):
+            raise RuntimeError(f"модели не загрузились: {json.dumps(report['models'], ensure_ascii=False)}")
+        time.sleep(1)
+    raise RuntimeError(f"бот не готов за {timeout:.0f} с: {report}")
+
+
+def stop_bot(process):
+    if process is None or process.poll() is not None:
+        return
+    process.send_signal(signal.SIGINT)  # run_polling корректно останавливается по SIGINT
+    try:
+        process.wait(20)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def print_level(report: dict):
+    row = report["all"]
+    print(f"\n=== {report['users']} чатов, {report['duration_s']} с ===")
+    print(f"{'':<7} {'отпр.':>6} {'ответ/с':>8} {'ошибки':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'1-й ответ p50':>14}")
+    for name, row in [("все", report["all"])] + list(report["by_kind"].items()):
+        def fmt(v):
+            return f"{v:.2f}" if v is not None else "-"
+        print(f"{name:<7} {row['sent']:>6} {row['throughput_per_s']:>8.2f} {row['error_rate']:>7.1%} "
+              f"{fmt(row['latency_p50_s']):>7} {fmt(row['latency_p95_s']):>7} {fmt(row['latency_p99_s']):>7} "
+              f"{fmt(row['first_reply_p50_s']):>14}")
+    for detail, count in report["errors"]:
+        print(f"  {count} x {detail}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m loadtest", description="Нагрузочный тест bot.py на заглушках")
+    parser.add_argument("--users", default="10")
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--ramp-up", type=float, default=5)
+    parser.add_argument("--mix", type=_parse_mix, default=_parse_mix("text=0.7,voice=0.2,photo=0.1"))
+    parser.add_argument("--think", default="1,3")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--llm-first-token", type=float, default=0.8)
+    parser.add_argument("--llm-jitter", type=float, default=0.3)
+    parser.add_argument("--llm-tps", type=float, default=40)
+    parser.add_argument("--answer-words", type=int, default=60)
+    parser.add_argument("--tool-ratio", type=float, default=0.2)
+    parser.add_argument("--no-stream", action="store_true")
+    parser.add_argument("--no-answer-cache", action="store_true")
+    parser.add_argument("--repeat-voice", action="store_true")
+    parser.add_argument("--voice", default=None)
+    parser.add_argument("--no-bot", action="store_true")
+    parser.add_argument("--health-port", type=int, default=None)
+    parser.add_argument("--ready-timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args(argv)
+
+    levels = [int(u) for u in args.users.split(",")]
+    think = tuple(float(t) for t in args.think.split(","))
+    telegram = FakeTelegram().start()
+    llm = FakeLLM(first_token=args.llm_first_token, jitter=args.llm_jitter, tokens_per_s=args.llm_tps,
+                  answer_words=args.answer_words, tool_ratio=args.tool_ratio, seed=args.seed).start()
+    health_port = args.health_port or _free_port()
+    env = bot_env(args, telegram, llm, health_port)
+    health_url = f"http://127.0.0.1:{health_port}"
+    process = None
+    results = {"config": vars(args), "levels": []}
+    try:
+        if args.no_bot:
+            print("Запустите bot.py с переменными окружения:")
+            for key, value in env.items():
+                print(f"  export {key}={value}")
+        else:
+            workdir = tempfile.mkdtemp(prefix="copilot-loadtest-")
+            process = start_bot(env, workdir)
+            results["workdir"] = workdir
+        results["ready"] = wait_ready(health_url, telegram, process, args.ready_timeout)
+        voice = load_voice(args.voice)
+        for users in levels:
+            generator = LoadGenerator(telegram, users=users, duration=args.duration, mix=args.mix, think_time=think,
+                                      timeout=args.timeout, ramp_up=args.ramp_up, voice=voice,
+                                      unique_voice=not args.repeat_voice, seed=args.seed)
+            level = generator.run()
+            print_level(level)
+            results["levels"].append(level)
+        try:
+            results["slowest_traces"] = _get_json(f"{health_url}/debug/traces?limit=5&token={DEBUG_TOKEN}")[1]
+        except OSError as e:
+            logging.warning(f"Трейсы бота недоступны: {e}")
+        results["telegram_calls"] = dict(telegram.calls)
+        results["llm_calls"] = dict(llm.counts)
+        print(f"\nTelegram API: {dict(telegram.calls)}\nDeepSeek: {dict(llm.counts)}")
+    except RuntimeError as e:
+        logging.error(str(e))
+        return 1
+    finally:
+        stop_bot(process)
+        telegram.stop()
+        llm.stop()
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2, ensure_ascii=False, default=str)
+            print(f"Отчет: {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""Заглушка DeepSeek (OpenAI-совместимый /chat/completions) и описания фото Hugging Face.
+
+Задержка первого токена и скорость генерации настраиваются, ответы бывают
+потоковыми (SSE) и с вызовом навыков. Каждый итоговый ответ заканчивается
+ANSWER_MARKER - по нему генератор нагрузки понимает, что ответ показан целиком.
+"""
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER_MARKER = "[конец ответа]"
+
+# Навыки без сети и без записи в базы бота: их модель "вызывает" в нагрузочном тесте
+SAFE_TOOLS = {
+    "get_part_numbers": {"part_name": "масляный фильтр"},
+    "get_part_info": {"part_name": "тормозные колодки"},
+    "sos_help": {"situation_type": "поломка"},
+}
+
+WORDS = ("проверь", "<b>уровень масла</b>", "и", "давление", "в", "шинах,", "затем", "осмотри",
+         "тормозные", "колодки", "и", "датчик", "ABS.", "Если", "лампа", "горит", "постоянно,", "езжай", "в", "сервис.")
+
+
+class FakeLLM:
+    """OpenAI-совместимый сервер на localhost.
+
+    first_token - секунды до первого токена (± jitter), tokens_per_s - скорость потока,
+    answer_words - длина ответа, tool_ratio - доля первых ответов с вызовом навыка.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, first_token: float = 0.8, jitter: float = 0.3,
+                 tokens_per_s: float = 40.0, answer_words: int = 60, tool_ratio: float = 0.2, seed: int = None):
+        self.first_token = first_token
+        self.jitter = jitter
+        self.tokens_per_s = tokens_per_s
+        self.answer_words = answer_words
+        self.tool_ratio = tool_ratio
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.counts = {"chat": 0, "stream": 0, "tool_calls": 0, "json": 0, "caption": 0}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-llm", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def _delay(self) -> float:
+        with self._lock:
+            return max(0.0, self.first_token + self._random.uniform(-self.jitter, self.jitter))
+
+    def _chance(self, p: float) -> bool:
+        with self._lock:
+            return self._random.random() < p
+
+    # --- Содержимое ответов ---
+
+    def _answer(self, messages) -> str:
+        after_tools = bool(messages) and messages[-1].get("role") == "tool"
+        words = [WORDS[i % len(WORDS)] for i in range(self.answer_words)]
+        prefix = "По данным навыка: " if after_tools else ""
+        return prefix + " ".join(words) + " " + ANSWER_MARKER
+
+    def _tool_call(self, request):
+        offered = {t["function"]["name"] for t in request.get("tools") or []}
+        names = [n for n in SAFE_TOOLS if n in offered]
+        messages = request.get("messages") or []
+        if not names or not messages or messages[-1].get("role") != "user" or not self._chance(self.tool_ratio):
+            return None
+        with self._lock:
+            name = self._random.choice(names)
+        return {"id": f"call_{next(self._ids)}", "type": "function",
+                "function": {"name": name, "arguments": json.dumps(SAFE_TOOLS[name], ensure_ascii=False)}}
+
+    def _photo_analysis(self) -> str:
+        if self._chance(0.5):
+            return json.dumps({"type": "dashboard", "search_query": "check engine",
+                               "summary": "Горит значок двигателя"}, ensure_ascii=False)
+        return json.dumps({"type": "document", "search_query": "",
+                           "summary": f"Заказ-наряд: замена масла, 150000 км {ANSWER_MARKER}"}, ensure_ascii=False)
+
+    @staticmethod
+    def _usage(request, completion: str) -> dict:
+        prompt = sum(len(str(m.get("content") or "")) for m in request.get("messages") or []) // 3
+        hit = prompt // 2
+        done = len(completion) // 3
+        return {"prompt_tokens": prompt, "completion_tokens": done, "total_tokens": prompt + done,
+                "prompt_cache_hit_tokens": hit, "prompt_cache_miss_tokens": prompt - hit}
+
+    def _handler(self):
+        llm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                path = self.path.split("?")[0]
+                if path.endswith("/chat/completions"):
+                    self._chat(json.loads(body or b"{}"))
+                elif path.startswith("/hf/"):
+                    llm._count("caption")
+                    time.sleep(llm._delay() / 2)
+                    self._json([{"generated_text": "приборная панель автомобиля, горит желтый значок двигателя"}])
+                else:
+                    self._json({"error": {"message": f"unknown path {path}"}}, 404)
+
+            def _chat(self, request):
+                time.sleep(llm._delay())
+                model = request.get("model", "deepseek-chat")
+                created = int(time.time())
+                completion_id = f"chatcmpl-{next(llm._ids)}"
+                tool_call = llm._tool_call(request)
+                if (request.get("response_format") or {}).get("type") == "json_object":
+                    llm._count("json")
+                    content = llm._photo_analysis()
+                elif tool_call is None:
+                    content = llm._answer(request.get("messages") or [])
+                else:
+                    llm._count("tool_calls")
+                    content = ""
+                llm._count("stream" if request.get("stream") else "chat")
+
+                if not request.get("stream"):
+                    message = {"role": "assistant", "content": content or None}
+                    if tool_call:
+                        message["tool_calls"] = [tool_call]
+                    self._json({
+                        "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                        "choices": [{"index": 0, "message": message,
+                                     "finish_reason": "tool_calls" if tool_call else "stop"}],
+                        "usage": llm._usage(request, content),
+                    })
+                    return
+
+                def chunk(delta, finish=None, usage=None):
+                    data = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                            "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish}]}
+                    if usage:
+                        data["usage"] = usage
+                    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    self.wfile.write(chunk({"role": "assistant", "content": ""}))
+                    if tool_call:
+                        self.wfile.write(chunk({"tool_calls": [dict(tool_call, index=0)]}))
+                        self.wfile.write(chunk({}, "tool_calls"))
+                    else:
+                        pause = 1.0 / llm.tokens_per_s if llm.tokens_per_s > 0 else 0.0
+                        for word in content.split(" "):
+                            self.wfile.write(chunk({"content": word + " "}))
+                            self.wfile.flush()
+                            time.sleep(pause)
+                        self.wfile.write(chunk({}, "stop"))
+                    if (request.get("stream_options") or {}).get("include_usage"):
+                        self.wfile.write(chunk(None, usage=llm._usage(request, content)))
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    logging.debug("Клиент закрыл поток ответа")
+
+            def _json(self, payload, code=200):
+                body = json.dumps(payload, ensure_ascii=False).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args): return
+
+        return Handler
@@ -0,0 +1,236 @@
+"""Заглушка Telegram Bot API для нагрузочного теста.
+
+Бот ходит сюда вместо api.telegram.org (TELEGRAM_API_BASE): getUpdates отдает
+апдейты, которые кладет генератор, sendMessage/editMessageText записываются
+по чатам, файлы голосовых и фото скачиваются отсюда же.
+
+Ответы бота относятся к апдейту, который в этот момент ждет ответа в чате:
+сообщения, созданные во время ожидания, "принадлежат" ему, поэтому поздняя
+правка предыдущего ответа не засчитывается следующему вопросу.
+"""
+import email.parser
+import itertools
+import json
+import logging
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loadtest.fake_llm import ANSWER_MARKER
+
+# Ответы бота, после которых продолжения не будет: (начало текста, исход)
+TERMINAL_REPLIES = (
+    ("🎤 Не расслышал", "no_speech"),
+    ("🎤 Сейчас много голосовых", "rejected"),
+    ("Упс, ошибка связи", "error"),
+    ("Не удалось", "error"),
+    ("Ошибка:", "error"),
+    ("Модели все еще загружаются", "error"),
+)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Alex", "username": "alex_loadtest_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+class Pending:
+    """Апдейт, ждущий ответа: время отправки, первого ответа бота и итог"""
+
+    def __init__(self, update_id: int, chat_id: int, kind: str):
+        self.update_id = update_id
+        self.chat_id = chat_id
+        self.kind = kind
+        self.sent_at = time.perf_counter()
+        self.first_reply_at = None
+        self.done_at = None
+        self.outcome = None
+        self.detail = None
+        self.message_ids = set()
+        self.done = threading.Event()
+
+    def _finish(self, outcome: str, detail: str = None):
+        if self.outcome is None:
+            self.outcome, self.detail, self.done_at = outcome, detail, time.perf_counter()
+            self.done.set()
+
+
+class FakeTelegram:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, long_poll_cap: float = 5.0):
+        self.long_poll_cap = long_poll_cap
+        self._cond = threading.Condition()
+        self._updates = []  # еще не подтвержденные ботом (offset)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._pending = {}  # chat_id -> Pending
+        self._owners = {}  # message_id -> Pending
+        self.files = {}  # file_path -> bytes
+        self._file_ids = {}  # file_id -> file_path
+        self.calls = Counter()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-telegram", daemon=True).start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._cond.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    # --- Сторона генератора ---
+
+    def add_file(self, file_id: str, file_path: str, data: bytes):
+        self.files[file_path] = data
+        self._file_ids[file_id] = file_path
+
+    def push(self, chat_id: int, kind: str, payload: dict) -> Pending:
+        """Отправить боту сообщение от пользователя chat_id. payload - поля Message (text/voice/photo)"""
+        user = {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}"}
+        with self._cond:
+            update_id = next(self._update_ids)
+            pending = Pending(update_id, chat_id, kind)
+            self._pending[chat_id] = pending
+            message = dict(payload, message_id=next(self._message_ids), date=int(time.time()),
+                           chat={"id": chat_id, "type": "private", "first_name": user["first_name"]}, **{"from": user})
+            self._updates.append({"update_id": update_id, "message": message})
+            self._cond.notify_all()
+        return pending
+
+    def expire(self, pending: Pending):
+        """Ответа не дождались: поздние сообщения бота этому апдейту уже не засчитываются"""
+        with self._cond:
+            pending._finish("timeout")
+            for mid in pending.message_ids:
+                self._owners.pop(mid, None)
+
+    # --- Сторона бота ---
+
+    def _get_updates(self, params) -> list:
+        offset = int(params.get("offset") or 0)
+        timeout = min(float(params.get("timeout") or 0), self.long_poll_cap)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._updates = [u for u in self._updates if u["update_id"] >= offset]
+                if self._updates:
+                    return self._updates[:limit]
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return []
+                self._cond.wait(left)
+
+    def _on_bot_text(self, chat_id: int, message_id: int, text: str, new: bool):
+        with self._cond:
+            if new:
+                pending = self._pending.get(chat_id)
+                if pending is not None and pending.outcome is None:
+                    self._owners[message_id] = pending
+                    pending.message_ids.add(message_id)
+            else:
+                pending = self._owners.get(message_id)
+            if pending is None or pending.outcome is not None:
+                return
+            if pending.first_reply_at is None:
+                pending.first_reply_at = time.perf_counter()
+            if ANSWER_MARKER in text:
+                pending._finish("ok")
+            else:
+                for prefix, outcome in TERMINAL_REPLIES:
+                    if text.startswith(prefix):
+                        pending._finish(outcome, text[:200])
+                        break
+            if pending.outcome is not None:
+                # Поздние правки этих сообщений уже никому не засчитываются
+                for mid in pending.message_ids:
+                    self._owners.pop(mid, None)
+
+    def _message(self, chat_id: int, message_id: int, text: str) -> dict:
+        return {"message_id": message_id, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER}
+
+    def _call(self, method: str, params: dict):
+        self.calls[method] += 1
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method == "sendMessage":
+            chat_id, message_id = int(params["chat_id"]), next(self._message_ids)
+            self._on_bot_text(chat_id, message_id, params.get("text", ""), new=True)
+            return self._message(chat_id, message_id, params.get("text", ""))
+        if method == "editMessageText":
+            chat_id, message_id = int(params["chat_id"]), int(params["message_id"])
+            self._on_bot_text(chat_id, message_id, params.get("text", ""), new=False)
+            return self._message(chat_id, message_id, params.get("text", ""))
+        if method in ("sendVoice", "sendAudio", "sendPhoto", "sendDocument"):
+            chat_id, message_id = int(params["chat_id"]), next(self._message_ids)
+            self._on_bot_text(chat_id, message_id, params.get("caption", ""), new=True)
+            return self._message(chat_id, message_id, params.get("caption", ""))
+        if method == "getFile":
+            file_id = params["file_id"]
+            file_path = self._file_ids.get(file_id)
+            if file_path is None:
+                raise KeyError(f"file {file_id} not found")
+            return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files[file_path]),
+                    "file_path": file_path}
+        return True  # deleteWebhook, sendChatAction, setMyCommands и прочее
+
+    def _handler(self):
+        telegram = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                # /file/bot<token>/<file_path>
+                parts = urllib.parse.unquote(self.path).split("/", 3)
+                data = telegram.files.get(parts[3]) if len(parts) == 4 and parts[1] == "file" else None
+                if data is None:
+                    self._send(404, b"Not found", "text/plain")
+                else:
+                    self._send(200, data, "application/octet-stream")
+
+            def do_POST(self):
+                # /bot<token>/<method>
+                method = self.path.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                try:
+                    result = telegram._call(method, self._params(body))
+                    payload, code = {"ok": True, "result": result}, 200
+                except (KeyError, ValueError) as e:
+                    payload, code = {"ok": False, "error_code": 400, "description": f"Bad Request: {e}"}, 400
+                self._send(code, json.dumps(payload, ensure_ascii=False).encode(), "application/json")
+
+            def _params(self, body: bytes) -> dict:
+                content_type = self.headers.get("Content-Type", "")
+                if content_type.startswith("application/json"):
+                    return json.loads(body or b"{}")
+                if content_type.startswith("multipart/form-data"):
+                    message = email.parser.BytesParser().parsebytes(
+                        f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+                    params = {}
+                    for part in message.get_payload() or []:
+                        name = part.get_param("name", header="content-disposition")
+                        if name and part.get_filename() is None:
+                            params[name] = part.get_payload(decode=True).decode("utf-8", "replace")
+                    return params
+                return {k: v[0] for k, v in urllib.parse.parse_qs(body.decode()).items()}
+
+            def _send(self, code, body, content_type):
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    logging.debug("Бот закрыл соединение")
+
+            def log_message(self, format, *args): return
+
+        return Handler
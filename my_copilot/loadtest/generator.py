@@ -0,0 +1,169 @@
+import glob
+import itertools
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import wave
+from collections import Counter
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+QUESTIONS = (
+    "Что значит желтый значок двигателя на панели?",
+    "Какое масло лить в двигатель 1.6 BSE?",
+    "Горит лампа давления масла, что делать?",
+    "Как часто менять тормозную жидкость?",
+    "Какое давление должно быть в шинах?",
+    "Где находится предохранитель прикуривателя?",
+    "Мигает значок ABS после мойки",
+    "Когда менять ремень ГРМ на моей машине?",
+    "Плохо заводится в мороз, с чего начать проверку?",
+    "Подбери артикул салонного фильтра",
+)
+
+# Минимальный JPEG (SOI + EOI): бот его не декодирует, описание дает заглушка Hugging Face
+PHOTO_BYTES = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00\xff\xd9"
+
+
+def load_voice(path: str = None):
+    """Голосовое для нагрузки: (байты, длительность). Файл из loadtest/fixtures (лучше настоящая речь -
+    иначе Whisper ничего не распознает), а если его нет - синтетический wav из бенчмарков"""
+    files = [path] if path else sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.ogg")) +
+                                       glob.glob(os.path.join(FIXTURES_DIR, "*.wav")))
+    if not files:
+        from benchmarks.components import synthetic_wav
+        with tempfile.TemporaryDirectory() as tmp:
+            files = [os.path.join(tmp, "synthetic.wav")]
+            synthetic_wav(files[0], 6)
+            return _read_voice(files[0])
+    return _read_voice(files[0])
+
+
+def _read_voice(path: str):
+    with open(path, "rb") as f:
+        data = f.read()
+    duration = 5
+    if path.endswith(".wav"):
+        with wave.open(path, "rb") as w:
+            duration = max(1, round(w.getnframes() / w.getframerate()))
+    return data, duration
+
+
+def percentile(sorted_values, q: float):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return round(sorted_values[index], 3)
+
+
+class LoadGenerator:
+    """N пользователей-потоков: каждый шлет сообщение (текст, голос или фото по mix),
+    ждет ответа бота (или timeout), думает think_time секунд и шлет следующее.
+
+    Пользователи стартуют равномерно за ramp_up секунд; в статистику идут апдейты,
+    отправленные после разгона. unique_voice=False - одно и то же голосовое
+    (проверка кэша расшифровок), иначе у каждого свой file_unique_id.
+    """
+
+    def __init__(self, telegram, users: int = 10, duration: float = 60.0, mix=None, think_time=(1.0, 3.0),
+                 timeout: float = 120.0, ramp_up: float = 5.0, voice=None, unique_voice: bool = True, seed: int = None):
+        self.telegram = telegram
+        self.users = users
+        self.duration = duration
+        self.mix = mix or {"text": 0.7, "voice": 0.2, "photo": 0.1}
+        self.think_time = think_time
+        self.timeout = timeout
+        self.ramp_up = ramp_up
+        self.voice_bytes, self.voice_duration = voice or load_voice()
+        self.unique_voice = unique_voice
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._file_ids = itertools.count(1)
+        self.results = []
+
+    def _choice(self):
+        with self._lock:
+            kind = self._random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+            return kind, self._random.choice(QUESTIONS), self._random.uniform(*self.think_time)
+
+    def _payload(self, kind: str, question: str) -> dict:
+        if kind == "text":
+            return {"text": question}
+        n = next(self._file_ids)
+        if kind == "voice":
+            file_id = f"voice-{n}"
+            unique_id = f"uv-{n}" if self.unique_voice else "uv-shared"
+            self.telegram.add_file(file_id, f"voice/{file_id}.oga", self.voice_bytes)
+            return {"voice": {"file_id": file_id, "file_unique_id": unique_id,
+                              "duration": self.voice_duration, "mime_type": "audio/ogg"}}
+        file_id = f"photo-{n}"
+        self.telegram.add_file(file_id, f"photos/{file_id}.jpg", PHOTO_BYTES)
+        return {"photo": [{"file_id": file_id, "file_unique_id": f"up-{n}", "width": 1280, "height": 960}]}
+
+    def _user(self, index: int, started: float, deadline: float):
+        chat_id = 100000 + index
+        time.sleep(self.ramp_up * index / max(1, self.users))
+        while time.perf_counter() < deadline:
+            kind, question, pause = self._choice()
+            pending = self.telegram.push(chat_id, kind, self._payload(kind, question))
+            if not pending.done.wait(self.timeout):
+                self.telegram.expire(pending)
+            with self._lock:
+                self.results.append({
+                    "kind": kind,
+                    "outcome": pending.outcome,
+                    "detail": pending.detail,
+                    "sent": pending.sent_at - started,
+                    "latency": pending.done_at - pending.sent_at,
+                    "first_reply": pending.first_reply_at - pending.sent_at if pending.first_reply_at else None,
+                    "warm": pending.sent_at - started >= self.ramp_up,
+                })
+            time.sleep(pause)
+
+    def run(self) -> dict:
+        started = time.perf_counter()
+        deadline = started + self.ramp_up + self.duration
+        threads = [threading.Thread(target=self._user, args=(i, started, deadline), name=f"user-{i}", daemon=True)
+                   for i in range(self.users)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        logging.info(f"Нагрузка завершена за {elapsed:.1f} с, апдейтов: {len(self.results)}")
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> dict:
+        # Окно - отведенная длительность: хвост ожидания последних ответов пропускную способность не размывает
+        warm = [r for r in self.results if r["warm"]]
+        window = self.duration
+        return {
+            "users": self.users,
+            "duration_s": round(window, 1),
+            "elapsed_s": round(elapsed, 1),
+            "all": self._summary(warm, window),
+            "by_kind": {kind: self._summary([r for r in warm if r["kind"] == kind], window) for kind in self.mix},
+            "errors": Counter(r["detail"] or r["outcome"] for r in warm
+                              if r["outcome"] not in ("ok", "no_speech")).most_common(10),
+        }
+
+    @staticmethod
+    def _summary(rows: list, window: float) -> dict:
+        outcomes = Counter(r["outcome"] for r in rows)
+        answered = sorted(r["latency"] for r in rows if r["outcome"] in ("ok", "no_speech"))
+        first = sorted(r["first_reply"] for r in rows if r["first_reply"] is not None)
+        failed = len(rows) - len(answered)
+        return {
+            "sent": len(rows),
+            "outcomes": dict(outcomes),
+            "throughput_per_s": round(len(answered) / window, 3),
+            "error_rate": round(failed / len(rows), 4) if rows else 0.0,
+            "latency_p50_s": percentile(answered, 0.5),
+            "latency_p95_s": percentile(answered, 0.95),
+            "latency_p99_s": percentile(answered, 0.99),
+            "first_reply_p50_s": percentile(first, 0.5),
+            "first_reply_p95_s": percentile(first, 0.95),
+        }
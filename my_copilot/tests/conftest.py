@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Тесты запускаются из my_copilot (python -m pytest): модули импортируются как utils.*
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+from telegram.error import Forbidden
+
+from utils.broadcast import Broadcaster
+from utils.subscribers import SubscriberStore
+
+
+class FakeBot:
+    def __init__(self, blocked=()):
+        self.blocked = set(blocked)
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.blocked:
+            raise Forbidden("bot was blocked by the user")
+        self.sent.append(chat_id)
+
+
+def test_broadcast_reads_and_deactivates_off_the_event_loop(tmp_path, monkeypatch):
+    store = SubscriberStore(str(tmp_path / "subscribers.db"), legacy_json=None)
+    store.add_many(range(1, 1201))
+    loop_thread = threading.get_ident()
+    threads = []
+
+    def spy(method):
+        def wrapper(*args, **kwargs):
+            threads.append(threading.get_ident())
+            return method(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(store, "active_page", spy(store.active_page))
+    monkeypatch.setattr(store, "deactivate_many", spy(store.deactivate_many))
+    bot = FakeBot(blocked={7, 900})
+    broadcaster = Broadcaster(bot, global_rate=10000, chat_interval=0, concurrency=50,
+                              on_blocked=store.deactivate_many)
+
+    report = asyncio.run(broadcaster.send(store.aiter_active(page_size=500), "Бриф"))
+    assert report["delivered"] == 1198 and report["blocked"] == 2
+    assert sorted(bot.sent) == [c for c in range(1, 1201) if c not in (7, 900)]
+    assert len(threads) == 4 + 1  # 3 страницы + пустая, затем деактивация
+    assert loop_thread not in threads
+    assert store.count() == 1198 and not store.is_subscribed(7)
+    store.close()
@@ -0,0 +1,64 @@
+import threading
+import time
+
+from utils.history_store import HistoryStore
+
+
+def event(i):
+    return {"date": "01.01.2024", "work": f"Работа {i}", "mileage": 150000 + i}
+
+
+def test_journal_and_compaction_survive_reload(tmp_path):
+    path = str(tmp_path / "service_history.json")
+    store = HistoryStore(path, compact_every=3)
+    for i in range(5):
+        store.add_event(event(i))
+    store.set_oil_change(151000, "02.02.2024")
+    assert store.pop_event()["work"] == "Работа 4"
+
+    reloaded = HistoryStore(path)
+    assert [e["work"] for e in reloaded.last_events(10)] == [f"Работа {i}" for i in range(4)]
+    assert reloaded.oil_change() == {"mileage": 151000, "date": "02.02.2024"}
+    assert reloaded.snapshot()["history"] == store.snapshot()["history"]
+
+
+def test_readers_get_copies(tmp_path):
+    store = HistoryStore(str(tmp_path / "service_history.json"))
+    store.add_event(event(1))
+    store.last_events(1)[0]["work"] = "испорчено"
+    store.oil_change()["mileage"] = 0
+    store.snapshot()["history"].clear()
+    assert store.last_events(1)[0]["work"] == "Работа 1"
+    assert store.oil_change()["mileage"] != 0
+
+
+def test_readers_do_not_wait_for_writer(tmp_path):
+    store = HistoryStore(str(tmp_path / "service_history.json"), check_interval=0)
+    store.add_event(event(1))
+    held, release = threading.Event(), threading.Event()
+
+    def slow_writer():
+        # Как запись с долгим fsync или свертка: лок записи занят
+        with store._lock:
+            held.set()
+            release.wait(5)
+
+    writer = threading.Thread(target=slow_writer)
+    writer.start()
+    held.wait(5)
+    started = time.monotonic()
+    try:
+        assert store.oil_change()
+        assert [e["work"] for e in store.last_events(5)] == ["Работа 1"]
+        assert time.monotonic() - started < 0.5
+    finally:
+        release.set()
+        writer.join()
+
+
+def test_change_from_another_process_is_picked_up(tmp_path):
+    path = str(tmp_path / "service_history.json")
+    reader = HistoryStore(path, check_interval=0)
+    assert reader.last_events(5) == []
+    HistoryStore(path).add_event(event(7))  # другой процесс (app.py)
+    assert [e["work"] for e in reader.last_events(5)] == ["Работа 7"]
@@ -0,0 +1,84 @@
+from utils.prompting import PromptAssembler, message_tokens
+
+
+def turn(i):
+    return [{"role": "user", "content": f"Вопрос {i} про машину"},
+            {"role": "assistant", "content": f"Ответ {i}: проверь масло и давление в шинах"}]
+
+
+def simulate(assembler, turns, budget=10000):
+    """Ходы диалога как в bot.process_message: история + вопрос -> kept (+ ответ) сохраняется"""
+    stored, folds = [], []
+    for i in range(turns):
+        question, answer = turn(i)
+        kept, dropped = assembler.fit_history(stored + [question], budget)
+        if dropped:
+            folds.append((i, dropped))
+        stored = kept + [answer]
+    return stored, folds
+
+
+def test_history_is_folded_in_batches_not_every_turn():
+    assembler = PromptAssembler(max_messages=10, keep_messages=4)
+    stored, folds = simulate(assembler, 20)
+    # Без гистерезиса с 5-го хода сводка обновлялась бы на каждом (15 раз)
+    assert len(folds) <= 5
+    assert all(len(dropped) >= 6 for _, dropped in folds)
+    assert len(stored) <= 10
+
+
+def test_history_within_limits_is_kept_whole():
+    assembler = PromptAssembler(max_messages=10, keep_messages=4)
+    history = turn(0) + turn(1) + turn(2)[:1]
+    kept, dropped = assembler.fit_history(history, 10000)
+    assert kept == history and dropped == []
+
+
+def test_token_overflow_cuts_to_keep_share():
+    assembler = PromptAssembler(max_messages=100, keep_messages=50, keep_share=0.5)
+    history = [m for i in range(12) for m in turn(i)]
+    budget = sum(message_tokens(m) for m in history) - 1
+    kept, dropped = assembler.fit_history(history, budget)
+    assert dropped and kept[0]["role"] == "user"
+    assert sum(message_tokens(m) for m in kept) <= budget * 0.5
+    assert dropped + kept == history
+
+
+def test_last_question_is_kept_even_if_too_long():
+    assembler = PromptAssembler()
+    history = turn(0) + [{"role": "user", "content": "очень длинный вопрос " * 500}]
+    kept, dropped = assembler.fit_history(history, 100)
+    assert kept == history[-1:] and dropped == history[:-1]
+
+
+def test_request_prefix_is_stable_between_folds(tmp_path):
+    from utils.conversations import ConversationStore
+    from utils.prompting import request_messages
+
+    store = ConversationStore(str(tmp_path / "conversations.db"))
+    assembler = PromptAssembler(max_messages=10, keep_messages=4)
+    sent, stable, folds = None, 0, 0
+    for i in range(12):
+        summary = store.get_summary(1)
+        history, dropped = assembler.fit_history(store.get(1) + [{"role": "user", "content": f"Вопрос {i}"}], 10000)
+        state = {"role": "system", "content": f"Пробег {150000 + i} км"}  # данные хода меняются каждый раз
+        turn_start = len(history) - 1
+        request = request_messages("Ты - Алекс", summary, history, turn_start, state)
+        if sent is not None and not dropped:
+            # Весь прошлый запрос (кроме его данных хода) - префикс нового
+            assert request[:len(sent)] == sent
+            stable += 1
+        # Ход с навыком: длинный ответ инструмента сразу в сохраняемом виде, как в bot.py
+        history.append({"role": "assistant", "content": "", "tool_calls": [
+            {"id": f"c{i}", "type": "function", "function": {"name": "web_search", "arguments": "{}"}}]})
+        history.append(store.compact_message({"role": "tool", "tool_call_id": f"c{i}", "name": "web_search",
+                                              "content": "результат " * 1000}))
+        sent = [m for m in request_messages("Ты - Алекс", summary, history, turn_start, state) if m is not state]
+        history.append({"role": "assistant", "content": f"Ответ {i}"})
+        store.save(1, history)
+        if dropped:
+            store.set_summary(1, f"сводка {folds}")  # свертка: префикс меняется один раз
+            folds += 1
+            sent = None
+    store.close()
+    assert folds >= 2 and stable == 12 - 1 - 2 * folds  # все ходы, кроме первого, свертки и хода после нее
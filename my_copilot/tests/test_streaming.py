@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+from utils.broadcast import RateLimiter
+from utils.streaming import TelegramStreamer
+
+
+class FakeMessage:
+    """Сообщение Telegram без сети: пишет время каждого вызова API в общий журнал"""
+
+    def __init__(self, log: list, retry_after_first_edit: int = 0):
+        self.log = log
+        self.retry_after = retry_after_first_edit
+
+    async def reply_text(self, text, parse_mode=None):
+        self.log.append(("send", time.monotonic()))
+        return FakeMessage(self.log)
+
+    async def edit_text(self, text, parse_mode=None):
+        if self.retry_after:
+            seconds, self.retry_after = self.retry_after, 0
+            raise RetryAfter(seconds)
+        self.log.append(("edit", time.monotonic()))
+
+
+async def stream(streamer: TelegramStreamer, words: int, pause: float):
+    await streamer.start()
+    for i in range(words):
+        streamer.push(f"слово{i:03d} " * 3)
+        await asyncio.sleep(pause)
+    await streamer.finish(streamer.text)
+
+
+def test_streamers_share_global_rate():
+    async def main():
+        log = []
+        limiter = RateLimiter(10)
+        streamers = [TelegramStreamer(FakeMessage(log), min_interval=0.05, min_chars=1, limiter=limiter)
+                     for _ in range(8)]
+        await asyncio.gather(*(stream(s, 20, 0.05) for s in streamers))
+        return log
+
+    log = asyncio.run(main())
+    times = sorted(t for _, t in log)
+    # Каждый стример хочет ~20 правок/с, вместе - 160/с; лимит 10/с + запас корзины (10)
+    window = times[-1] - times[0]
+    assert len(times) <= 10 + 10 * window + 2
+    assert sum(kind == "edit" for kind, _ in log) >= 8  # финальная правка у каждого дошла
+
+
+def test_retry_after_pauses_all_streamers():
+    async def main():
+        log = []
+        limiter = RateLimiter(100)
+        first = TelegramStreamer(FakeMessage(log), min_interval=0.01, min_chars=1, limiter=limiter)
+        await first.start()
+        first.message.retry_after = 1
+        await first._edit("первый ответ")  # 429: пауза для всех
+        paused_at = time.monotonic()
+        second = TelegramStreamer(FakeMessage(log), min_interval=0.01, min_chars=1, limiter=limiter)
+        await second.start()
+        return paused_at, log[-1][1]
+
+    paused_at, sent_at = asyncio.run(main())
+    assert sent_at - paused_at >= 0.9
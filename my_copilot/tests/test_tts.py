@@ -0,0 +1,135 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from utils.tts import TTSService
+
+
+class StubSynthesizer:
+    """Синтезатор без сети: считает вызовы, аудио - байты из текста"""
+
+    def __init__(self, delay: float = 0.0, size: int = None, fail: Exception = None):
+        self.delay = delay
+        self.size = size
+        self.fail = fail
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    async def __call__(self, text, voice):
+        with self._lock:
+            self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail is not None:
+            raise self.fail
+        data = f"{voice}:{text}".encode()
+        return data.ljust(self.size, b"\0") if self.size else data
+
+
+def make_service(tmp_path, **kwargs):
+    synth = StubSynthesizer(**{k: kwargs.pop(k) for k in ("delay", "size", "fail") if k in kwargs})
+    return TTSService(cache_dir=str(tmp_path / "tts"), synthesizer=synth, **kwargs), synth
+
+
+def test_second_request_is_served_from_disk(tmp_path):
+    service, synth = make_service(tmp_path)
+    first = service.synthesize_sync("Привет")
+    second = service.synthesize_sync("Привет")
+    assert first == second
+    assert synth.calls == 1
+    assert service.stats()["hits"] == 1 and service.stats()["misses"] == 1
+    assert os.path.exists(service._path(service.key("Привет", service.voice)))
+
+
+def test_voice_is_part_of_the_key(tmp_path):
+    service, synth = make_service(tmp_path)
+    service.synthesize_sync("Привет")
+    service.synthesize_sync("Привет", voice="ru-RU-DmitryNeural")
+    assert synth.calls == 2
+
+
+def test_concurrent_requests_in_one_loop_share_synthesis(tmp_path):
+    service, synth = make_service(tmp_path, delay=0.2)
+
+    async def main():
+        return await asyncio.gather(*(service.synthesize("Одинаковый текст") for _ in range(4)))
+
+    results = asyncio.run(main())
+    assert synth.calls == 1
+    assert len(set(results)) == 1
+
+
+def test_concurrent_requests_from_threads_share_synthesis(tmp_path):
+    # Сессии Streamlit: каждый поток - свой asyncio.run в synthesize_sync
+    service, synth = make_service(tmp_path, delay=0.3)
+    results, barrier = [], threading.Barrier(4)
+
+    def worker():
+        barrier.wait()
+        results.append(service.synthesize_sync("Одинаковый текст"))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert synth.calls == 1
+    assert len(results) == 4 and len(set(results)) == 1
+    stats = service.stats()
+    assert stats["misses"] == 1 and stats["hits"] == 3
+
+
+def test_failure_reaches_waiters_and_is_not_cached(tmp_path):
+    service, synth = make_service(tmp_path, delay=0.1, fail=RuntimeError("нет сети"))
+
+    async def main():
+        return await asyncio.gather(*(service.synthesize("Текст") for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert synth.calls == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    synth.fail = None
+    assert service.synthesize_sync("Текст")
+    assert synth.calls == 2
+
+
+def test_empty_audio_is_an_error(tmp_path):
+    service, _ = make_service(tmp_path)
+    service.synthesizer = lambda text, voice: asyncio.sleep(0, result=b"")
+    with pytest.raises(RuntimeError):
+        service.synthesize_sync("Текст")
+    assert not (tmp_path / "tts").exists() or not os.listdir(tmp_path / "tts")
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    service, synth = make_service(tmp_path, size=1000, max_bytes=3500)
+    now = time.time()
+    for i, text in enumerate(["a", "b", "c"]):
+        service.synthesize_sync(text)
+        path = service._path(service.key(text, service.voice))
+        os.utime(path, (now - 100 + i, now - 100 + i))
+    service.synthesize_sync("a")  # попадание обновляет mtime: "a" теперь самый свежий
+    service.synthesize_sync("d")  # 4000 > 3500 -> удаляем старые до 90% лимита
+
+    remaining = {name for name in os.listdir(tmp_path / "tts")}
+    keys = {t: f"{service.key(t, service.voice)}.mp3" for t in "abcd"}
+    assert keys["b"] not in remaining
+    assert {keys["a"], keys["d"]} <= remaining
+    assert sum(os.path.getsize(tmp_path / "tts" / n) for n in remaining) <= 3500 * 0.9
+    assert service.stats()["bytes"] <= 3500 * 0.9
+    assert synth.calls == 4
+
+
+def test_hit_survives_eviction_between_read_and_touch(tmp_path, monkeypatch):
+    service, synth = make_service(tmp_path)
+    first = service.synthesize_sync("Привет")
+
+    def evicted(path, *args, **kwargs):
+        os.remove(path)  # другой поток вытеснил файл сразу после чтения
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr("utils.tts.os.utime", evicted)
+    assert service.synthesize_sync("Привет") == first
+    assert synth.calls == 1
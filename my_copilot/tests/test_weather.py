@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils.weather import WeatherService
+
+
+class FakeWttr:
+    """wttr.in на localhost: у каждого сервера (/primary, /backup) свои ответ, код и задержка"""
+
+    def __init__(self):
+        self.routes = {
+            "primary": {"status": 200, "delay": 0.0, "text": "primary: +5°C"},
+            "backup": {"status": 200, "delay": 0.0, "text": "backup: +5°C"},
+        }
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def urls(self, *names):
+        return [f"{self.url}/{name}/{{city}}" for name in names]
+
+    def _handler(self):
+        wttr = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                _, name, city = urllib.parse.unquote(self.path.split("?")[0]).split("/", 2)
+                with wttr._lock:
+                    wttr.calls[name] += 1
+                    route = dict(wttr.routes[name])
+                time.sleep(route["delay"])
+                body = f"{city} {route['text']}".encode() if route["status"] == 200 else b"Unknown location"
+                self.send_response(route["status"])
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args): return
+
+        return Handler
+
+
+@pytest.fixture
+def wttr():
+    server = FakeWttr()
+    threading.Thread(target=server.server.serve_forever, daemon=True).start()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+def run(coro_fn, service):
+    async def main():
+        try:
+            return await coro_fn()
+        finally:
+            await service.close()
+    return asyncio.run(main())
+
+
+def test_backup_wins_when_primary_fails(wttr):
+    wttr.routes["primary"].update(status=503)
+    wttr.routes["backup"].update(delay=0.1)
+    service = WeatherService(urls=wttr.urls("primary", "backup"))
+
+    result = run(lambda: service.get("Москва"), service)
+    assert result == "Москва backup: +5°C"
+    assert wttr.calls == Counter(primary=1, backup=1)
+
+
+def test_fastest_server_wins_and_slow_one_is_not_awaited(wttr):
+    wttr.routes["primary"].update(delay=1.0)
+    service = WeatherService(urls=wttr.urls("primary", "backup"))
+
+    started = time.monotonic()
+    result = run(lambda: service.get("Москва"), service)
+    assert result == "Москва backup: +5°C"
+    assert time.monotonic() - started < 0.8
+
+
+def test_concurrent_lookups_share_one_request(wttr):
+    wttr.routes["primary"].update(delay=0.2)
+    service = WeatherService(urls=wttr.urls("primary"))
+
+    async def lookups():
+        return await asyncio.gather(*(service.get(city) for city in ("Москва", "москва ", "МОСКВА", "Москва")))
+
+    results = run(lookups, service)
+    assert len(set(results)) == 1
+    assert wttr.calls["primary"] == 1
+    assert service.stats()["misses"] == 4
+
+
+def test_stale_entry_is_served_while_refreshing(wttr):
+    service = WeatherService(urls=wttr.urls("primary"), ttl=0.05, stale_ttl=60)
+
+    async def scenario():
+        first = await service.get("Казань")
+        await asyncio.sleep(0.1)
+        wttr.routes["primary"].update(text="primary: +7°C", delay=0.2)
+        started = time.monotonic()
+        stale = await service.get("Казань")
+        stale_latency = time.monotonic() - started
+        service.ttl = 60  # обновленная запись дальше считается свежей
+        await asyncio.sleep(0.4)  # фоновое обновление успевает завершиться
+        fresh = await service.get("Казань")
+        return first, stale, stale_latency, fresh
+
+    first, stale, stale_latency, fresh = run(scenario, service)
+    assert stale == first == "Казань primary: +5°C"
+    assert stale_latency < 0.1  # не ждали сервер
+    assert fresh == "Казань primary: +7°C"
+    assert wttr.calls["primary"] == 2
+    assert service.stats() == {"cities": 1, "hits": 1, "stale_hits": 1, "misses": 1}
+
+
+def test_cached_value_is_returned_when_all_servers_fail(wttr):
+    service = WeatherService(urls=wttr.urls("primary", "backup"), ttl=0, stale_ttl=0)
+
+    async def scenario():
+        first = await service.get("Сочи")
+        for route in wttr.routes.values():
+            route.update(status=500)
+        return first, await service.get("Сочи"), await service.get("Тула")
+
+    first, fallback, unknown = run(scenario, service)
+    assert fallback == first
+    assert unknown is None
+    assert service.stats()["misses"] == 3
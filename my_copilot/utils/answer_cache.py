@@ -0,0 +1,136 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Вопросы, ответ на которые зависит от водителя, момента или требует навыков - не кэшируем
+PERSONAL_PATTERNS = re.compile(
+    r"\b(я|мне|меня|мой|моя|мое|моё|мои|моей|моего|моем|у нас|наш\w*|"
+    r"сегодня|завтра|вчера|сейчас|погод\w*|запиш\w*|удали\w*|отмени\w*|найди|поищи|"
+    r"поменял\w*|заменил\w*|залил\w*|пробег\w*|sos|помоги|авари\w*|дтп)\b",
+    re.IGNORECASE,
+)
+
+
+def is_cacheable(text: str, min_words: int = 3) -> bool:
+    """Общий вопрос (не личный, не про "сейчас", не команда навыку) и не реплика в продолжение
+    разговора вроде "а почему?" - такие без истории диалога не понять"""
+    if not text or len(text.split()) < min_words:
+        return False
+    return not PERSONAL_PATTERNS.search(text.replace("ё", "е"))
+
+
+def vehicle_fingerprint(*parts) -> str:
+    """Отпечаток состояния машины (ТО, последние события и т.п.): изменилось - кэш не подходит"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+class AnswerCache:
+    """Семантический кэш ответов: близкий по смыслу вопрос при том же состоянии машины
+    получает готовый ответ без RAG и DeepSeek.
+
+    Векторы (нормированные) лежат в одной матрице, поиск - одно умножение на вектор
+    запроса. Подходит запись с косинусной близостью >= threshold, тем же отпечатком
+    и не старше ttl. Не больше max_size записей, лишние вытесняются по LRU.
+    """
+
+    def __init__(self, threshold: float = 0.92, ttl: float = 6 * 3600, max_size: int = 1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._vectors = None  # (max_size, dim), создается при первой записи
+        self._entries = OrderedDict()  # строка матрицы -> {fingerprint, query, answer, expires}
+        self._free = list(range(max_size - 1, -1, -1))
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expired = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def _best(self, v: np.ndarray, fingerprint: str):
+        """(строка, близость) лучшей живой записи с тем же отпечатком (вызывать под self._lock)"""
+        if not self._entries or self._vectors is None or self._vectors.shape[1] != v.shape[0]:
+            return None, 0.0
+        now = time.monotonic()
+        for slot in [s for s, e in self._entries.items() if e["expires"] <= now]:
+            self._release(slot)
+            self.expired += 1
+        slots = [s for s, e in self._entries.items() if e["fingerprint"] == fingerprint]
+        if not slots:
+            return None, 0.0
+        sims = self._vectors[slots] @ v
+        best = int(np.argmax(sims))
+        return slots[best], float(sims[best])
+
+    def _release(self, slot: int):
+        del self._entries[slot]
+        self._free.append(slot)
+
+    def lookup(self, vector, fingerprint: str):
+        """Готовый ответ или None"""
+        if self.max_size <= 0:
+            return None
+        v = self._normalize(vector)
+        with self._lock:
+            slot, sim = self._best(v, fingerprint)
+            if slot is None or sim < self.threshold:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(slot)
+            self.hits += 1
+            return self._entries[slot]["answer"]
+
+    def store(self, vector, fingerprint: str, query: str, answer: str):
+        if self.max_size <= 0 or not answer:
+            return
+        v = self._normalize(vector)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != v.shape[0]:
+                self._vectors = np.zeros((self.max_size, v.shape[0]), dtype=np.float32)
+                self._entries.clear()
+                self._free = list(range(self.max_size - 1, -1, -1))
+            slot, sim = self._best(v, fingerprint)
+            if slot is not None and sim >= 0.99:
+                self._release(slot)  # тот же вопрос - заменяем ответ свежим
+            if not self._free:
+                self._release(next(iter(self._entries)))
+                self.evictions += 1
+            slot = self._free.pop()
+            self._vectors[slot] = v
+            self._entries[slot] = {
+                "fingerprint": fingerprint,
+                "query": query,
+                "answer": answer,
+                "expires": time.monotonic() + self.ttl,
+            }
+            self.stores += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._free = list(range(self.max_size - 1, -1, -1))
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
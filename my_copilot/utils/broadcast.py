@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from utils.metrics import stage
+
+
+class RateLimiter:
+    """Token bucket: не больше rate отправок в секунду, с паузой по 429 от Telegram"""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _retry_seconds(e: RetryAfter) -> float:
+    delay = e.retry_after
+    return delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay)
+
+
+class Broadcaster:
+    """Рассылка по многим чатам: параллельно, но в рамках лимитов Telegram.
+
+    global_rate - сообщений в секунду на весь бот (Telegram допускает ~30),
+    chat_interval - минимальный интервал между сообщениями в один чат.
+    RetryAfter (429) ставит на паузу всю рассылку, заблокировавшие бота чаты
+    собираются в отчет и передаются в on_blocked (синхронный, вызывается в потоке).
+    """
+
+    def __init__(self, bot, global_rate: float = 25, chat_interval: float = 1.0, concurrency: int = 20,
+                 max_retries: int = 3, on_blocked=None):
+        self.bot = bot
+        self.limiter = RateLimiter(global_rate)
+        self.chat_interval = chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.on_blocked = on_blocked
+        self._chat_next = {}
+
+    async def _wait_chat_budget(self, chat_id):
+        now = time.monotonic()
+        ready_at = self._chat_next.get(chat_id, 0.0)
+        self._chat_next[chat_id] = max(now, ready_at) + self.chat_interval
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+
+    async def _send_one(self, chat_id, text, kwargs) -> str:
+        """'delivered' | 'blocked' | 'failed'"""
+        for attempt in range(self.max_retries + 1):
+            await self._wait_chat_budget(chat_id)
+            await self.limiter.acquire()
+            try:
+                with stage("telegram_broadcast"):
+                    await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return "delivered"
+            except RetryAfter as e:
+                delay = _retry_seconds(e)
+                logging.warning(f"Рассылка: Telegram просит паузу {delay}с")
+                self.limiter.pause(delay)
+            except Forbidden:
+                return "blocked"
+            except BadRequest as e:
+                if "chat not found" in str(e).lower():
+                    return "blocked"
+                logging.error(f"Не удалось отправить бриф {chat_id}: {e}")
+                return "failed"
+            except NetworkError as e:
+                logging.warning(f"Сеть при отправке {chat_id} (попытка {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                logging.error(f"Не удалось отправить бриф {chat_id}: {e}")
+                return "failed"
+        return "failed"
+
+    async def send(self, chat_ids, text: str, **kwargs) -> dict:
+        """Разослать text по chat_ids (список, итератор или async-итератор). Возвращает отчет о прогоне"""
+        started = time.monotonic()
+        report = {"delivered": 0, "failed": 0, "blocked": 0}
+        blocked = []
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while True:
+                chat_id = await queue.get()
+                if chat_id is None:
+                    return
+                status = await self._send_one(chat_id, text, kwargs)
+                report[status] += 1
+                if status == "blocked":
+                    blocked.append(chat_id)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.concurrency)]
+        try:
+            if hasattr(chat_ids, "__aiter__"):
+                async for chat_id in chat_ids:
+                    await queue.put(chat_id)
+            else:
+                for chat_id in chat_ids:
+                    await queue.put(chat_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers:
+                w.cancel()
+
+        if blocked and self.on_blocked:
+            # on_blocked пишет в базу (лок, busy timeout SQLite) - не на event loop
+            try:
+                await asyncio.to_thread(self.on_blocked, blocked)
+            except Exception as e:
+                logging.error(f"Не удалось убрать заблокировавшие чаты: {e}")
+
+        report["elapsed"] = round(time.monotonic() - started, 2)
+        logging.info(
+            f"Рассылка: доставлено {report['delivered']}, ошибок {report['failed']}, "
+            f"заблокировали бота {report['blocked']}, {report['elapsed']}с"
+        )
+        return report
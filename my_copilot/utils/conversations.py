@@ -0,0 +1,123 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+class ConversationStore:
+    """Истории диалогов с ограничением памяти.
+
+    В памяти - не больше memory_budget байт (JSON последних активных чатов),
+    давно молчащие чаты вытесняются по LRU. На диске - все истории в SQLite
+    (сжатые zlib), запись при каждом сохранении, поэтому история переживает
+    перезапуск, а вернувшийся чат подгружается прозрачно.
+    """
+
+    def __init__(self, path: str = "conversations.db", memory_budget: int = 8 * 1024 * 1024,
+                 max_message_chars: int = 2000):
+        self.path = path
+        self.memory_budget = memory_budget
+        self.max_message_chars = max_message_chars
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # chat_id -> JSON (bytes)
+        self._bytes = 0
+        self.loads = 0
+        self.evictions = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def compact_message(self, m: dict) -> dict:
+        """Сообщение в том виде, в каком оно будет сохранено: только нужные API поля, длинные
+        ответы навыков (web_search и т.п.) обрезаны. Бот кладет в запрос уже такое сообщение,
+        чтобы следующий ход совпал с этим по префиксу (кэш DeepSeek)"""
+        m = {k: v for k, v in m.items() if v is not None}
+        content = m.get("content")
+        if m.get("role") == "tool" and isinstance(content, str) and len(content) > self.max_message_chars:
+            m["content"] = content[:self.max_message_chars] + "…"
+        return m
+
+    def _compact(self, messages: list) -> list:
+        return [self.compact_message(m) for m in messages]
+
+    def _remember(self, chat_id, raw: bytes):
+        old = self._cache.pop(chat_id, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._cache[chat_id] = raw
+        self._bytes += len(raw)
+        # Текущий чат не вытесняем, даже если он один больше бюджета
+        while self._bytes > self.memory_budget and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def _entry(self, chat_id) -> dict:
+        """{"summary": ..., "messages": [...]} из памяти или с диска (вызывать под self._lock)"""
+        raw = self._cache.get(chat_id)
+        if raw is not None:
+            self._cache.move_to_end(chat_id)
+        else:
+            row = self._conn.execute("SELECT data FROM conversations WHERE chat_id = ?", (chat_id,)).fetchone()
+            if row is None:
+                return {"summary": "", "messages": []}
+            raw = zlib.decompress(row[0])
+            self.loads += 1
+            self._remember(chat_id, raw)
+        entry = json.loads(raw)
+        if isinstance(entry, list):  # старый формат - только список сообщений
+            entry = {"summary": "", "messages": entry}
+        return entry
+
+    def get(self, chat_id) -> list:
+        """История чата (новый список). Если чата нет в памяти - читается с диска"""
+        with self._lock:
+            return self._entry(chat_id)["messages"]
+
+    def get_summary(self, chat_id) -> str:
+        """Сводка старых реплик, вытесненных из истории"""
+        with self._lock:
+            return self._entry(chat_id)["summary"]
+
+    def _store(self, chat_id, entry: dict):
+        raw = json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode()
+        self._conn.execute(
+            "INSERT INTO conversations (chat_id, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (chat_id, zlib.compress(raw), time.time()),
+        )
+        self._remember(chat_id, raw)
+
+    def save(self, chat_id, messages: list, summary: str = None):
+        """Сохранить историю (summary=None - сводка остается прежней)"""
+        messages = self._compact(messages)
+        with self._lock:
+            if summary is None:
+                summary = self._entry(chat_id)["summary"]
+            self._store(chat_id, {"summary": summary, "messages": messages})
+
+    def set_summary(self, chat_id, summary: str):
+        with self._lock:
+            entry = self._entry(chat_id)
+            entry["summary"] = summary
+            self._store(chat_id, entry)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "chats_in_memory": len(self._cache),
+                "memory_bytes": self._bytes,
+                "memory_budget": self.memory_budget,
+                "loads_from_disk": self.loads,
+                "evictions": self.evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,224 @@
+import logging
+import os
+import time
+
+import numpy as np
+
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+BACKENDS = ("torch", "int8", "onnx", "onnx_int8")
+
+# Вопросы для сверки бэкендов и бенчмарка (типичные для бота)
+SAMPLE_QUERIES = [
+    "что значит желтый значок двигателя",
+    "какое масло лить в двигатель",
+    "горит лампа давления масла что делать",
+    "как часто менять тормозную жидкость",
+    "какое давление в шинах audi a3",
+    "где находится предохранитель прикуривателя",
+    "мигает значок ABS",
+    "как сбросить сервисный интервал",
+    "стучит подвеска на кочках",
+    "когда менять ремень ГРМ",
+    "не заводится в мороз",
+    "как включить противотуманные фары",
+]
+
+
+def _onnx_model(model_name: str, quantize: str = None, cache_dir: str = "embed_onnx"):
+    """ONNX Runtime через sentence-transformers (нужны optimum[onnxruntime]).
+    quantize - конфиг int8 (avx2, avx512, avx512_vnni, arm64): сначала ищем готовый файл
+    в репозитории модели, иначе квантуем сами и кладем в cache_dir"""
+    from sentence_transformers import SentenceTransformer
+    if not quantize:
+        return SentenceTransformer(model_name, backend="onnx", device="cpu")
+    file_name = f"onnx/model_qint8_{quantize}.onnx"
+    try:
+        return SentenceTransformer(model_name, backend="onnx", device="cpu", model_kwargs={"file_name": file_name})
+    except Exception as e:
+        logging.info(f"Готового {file_name} для {model_name} нет ({e}), квантую локально")
+    from sentence_transformers.backend import export_dynamic_quantized_onnx_model
+    local_path = os.path.join(cache_dir, model_name.replace("/", "__"))
+    if not os.path.exists(os.path.join(local_path, file_name)):
+        model = SentenceTransformer(model_name, backend="onnx", device="cpu")
+        model.save(local_path)
+        export_dynamic_quantized_onnx_model(model, quantize, local_path)
+    return SentenceTransformer(local_path, backend="onnx", device="cpu", model_kwargs={"file_name": file_name})
+
+
+def _torch_model(model_name: str):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, device="cpu")
+
+
+def _int8_model(model_name: str):
+    """Та же модель PyTorch, линейные слои - динамическое квантование в int8 (без доп. пакетов)"""
+    import torch
+    model = _torch_model(model_name)
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+_LOADERS = {
+    "int8": _int8_model,
+    "onnx": _onnx_model,
+    "onnx_int8": lambda name: _onnx_model(name, quantize=os.getenv("EMBED_ONNX_QUANT", "avx2")),
+}
+
+
+def load_embedder(backend: str = None, model_name: str = DEFAULT_MODEL, verify: bool = None):
+    """Модель эмбеддингов с интерфейсом SentenceTransformer.encode.
+
+    backend (по умолчанию EMBED_BACKEND, иначе torch):
+      torch     - PyTorch fp32, как раньше;
+      int8      - PyTorch с динамическим int8-квантованием линейных слоев;
+      onnx      - ONNX Runtime fp32;
+      onnx_int8 - ONNX Runtime int8 (EMBED_ONNX_QUANT, по умолчанию avx2).
+    Если бэкенд не загрузился (нет пакетов и т.п.) - откат на torch; если не грузится
+    и torch - исключение уходит вызывающему.
+    verify (EMBED_VERIFY=1) - после загрузки сверить векторы с fp32 (грузит вторую модель).
+    Выбранный бэкенд - в model.embed_backend.
+    """
+    backend = (backend or os.getenv("EMBED_BACKEND", "torch")).lower()
+    if verify is None:
+        verify = os.getenv("EMBED_VERIFY", "0") == "1"
+    if backend != "torch" and backend not in _LOADERS:
+        logging.warning(f"Неизвестный EMBED_BACKEND={backend}, беру torch")
+        backend = "torch"
+    started = time.perf_counter()
+    model = None
+    if backend != "torch":
+        try:
+            model = _LOADERS[backend](model_name)
+        except Exception as e:
+            logging.error(f"Бэкенд эмбеддингов {backend} не загрузился ({e}), беру torch")
+            backend = "torch"
+    if model is None:
+        model = _torch_model(model_name)
+    logging.info(f"Эмбеддинги: {model_name} [{backend}] загружены за {time.perf_counter() - started:.1f} с")
+    model.embed_backend = backend
+
+    if verify and backend != "torch":
+        reference = _torch_model(model_name)
+        report = check_agreement(model, reference)
+        logging.info(f"Сверка {backend} с fp32: {report}")
+        if not report["ok"]:
+            logging.error(f"Векторы {backend} расходятся с fp32 - беру torch")
+            reference.embed_backend = "torch"
+            return reference
+    return model
+
+
+def check_agreement(candidate, reference, texts=None, min_cosine: float = 0.98) -> dict:
+    """Косинусная близость векторов candidate и эталона (fp32) на одних и тех же текстах"""
+    texts = texts or SAMPLE_QUERIES
+    a = np.asarray(candidate.encode(texts), dtype=np.float32)
+    b = np.asarray(reference.encode(texts), dtype=np.float32)
+    a /= np.linalg.norm(a, axis=1, keepdims=True)
+    b /= np.linalg.norm(b, axis=1, keepdims=True)
+    cos = (a * b).sum(axis=1)
+    return {"mean_cosine": float(cos.mean()), "min_cosine": float(cos.min()), "ok": bool(cos.min() >= min_cosine)}
+
+
+def _peak_rss_mb() -> float:
+    import resource
+    # ru_maxrss: Linux - в КБ, macOS - в байтах
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / (1024 if os.uname().sysname == "Darwin" else 1)
+
+
+def _bench_one(backend, model_name, corpus, queries, k, repeats, result_queue):
+    """Выполняется в отдельном процессе: пиковая память не смешивается между бэкендами"""
+    try:
+        rss_before = _peak_rss_mb()
+        started = time.perf_counter()
+        model = load_embedder(backend, model_name, verify=False)
+        load_s = time.perf_counter() - started
+        if model.embed_backend != backend:
+            raise RuntimeError(f"не загрузился (откат на {model.embed_backend})")
+        model.encode(queries[:2])  # прогрев
+
+        latencies = []
+        for _ in range(repeats):
+            for q in queries:
+                t = time.perf_counter()
+                model.encode(q)
+                latencies.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        matrix = np.asarray(model.encode(corpus, batch_size=64), dtype=np.float32)
+        batch_s = time.perf_counter() - t
+
+        q = np.asarray(model.encode(queries), dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        q /= np.linalg.norm(q, axis=1, keepdims=True)
+        top = np.argsort(-(q @ matrix.T), axis=1)[:, :k]
+        latencies.sort()
+        result_queue.put({
+            "backend": backend,
+            "load_s": round(load_s, 2),
+            "query_ms_p50": round(latencies[len(latencies) // 2] * 1000, 2),
+            "query_ms_p95": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+            "corpus_per_s": round(len(corpus) / batch_s, 1),
+            "rss_mb": round(_peak_rss_mb(), 1),
+            "rss_model_mb": round(_peak_rss_mb() - rss_before, 1),
+            "top": top.tolist(),
+            "vectors": q.tolist(),
+        })
+    except Exception as e:
+        result_queue.put({"backend": backend, "error": str(e)})
+
+
+def benchmark(backends=BACKENDS, model_name: str = DEFAULT_MODEL, corpus=None, queries=None,
+              k: int = 3, repeats: int = 5) -> list:
+    """Сравнение бэкендов: загрузка, задержка одиночного запроса, пропускная способность
+    на корпусе, пиковая память (RSS) и совпадение top-k выдачи с torch fp32"""
+    import multiprocessing
+    queries = queries or SAMPLE_QUERIES
+    corpus = corpus or queries
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for backend in backends:
+        result_queue = ctx.Queue()
+        proc = ctx.Process(target=_bench_one, args=(backend, model_name, corpus, queries, k, repeats, result_queue))
+        proc.start()
+        results.append(result_queue.get())
+        proc.join()
+
+    reference = next((r for r in results if r["backend"] == "torch" and "error" not in r), None)
+    ref_top, ref_vectors = (reference["top"], np.asarray(reference["vectors"])) if reference else (None, None)
+    for r in results:
+        top, vectors = r.pop("top", None), r.pop("vectors", None)
+        if reference is None or top is None:
+            continue
+        overlaps = [len(set(a) & set(b)) / k for a, b in zip(top, ref_top)]
+        r["topk_overlap"] = round(sum(overlaps) / len(overlaps), 3)
+        r["min_cosine"] = round(float((np.asarray(vectors) * ref_vectors).sum(axis=1).min()), 4)
+    return results
+
+
+def _load_corpus(index_dir: str = "vector_index"):
+    """Фрагменты инструкции из снимка (если он собран), иначе - пусто"""
+    try:
+        from utils.vector_index import VectorIndex
+    except ImportError:
+        return None
+    index = VectorIndex.load(index_dir)
+    return index.documents if index is not None else None
+
+
+if __name__ == "__main__":
+    # python -m utils.embed_backends [check|bench] [бэкенды через запятую]
+    import json
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    selected = sys.argv[2].split(",") if len(sys.argv) > 2 else list(BACKENDS)
+    if command == "check":
+        reference = load_embedder("torch", verify=False)
+        for name in selected:
+            if name != "torch":
+                print(name, check_agreement(load_embedder(name, verify=False), reference))
+    else:
+        if "torch" not in selected:
+            selected.insert(0, "torch")
+        for row in benchmark(selected, corpus=_load_corpus()):
+            print(json.dumps(row, ensure_ascii=False))
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class EmbeddingBatcher:
+    """Микробатчинг: одновременные запросы эмбеддингов копятся несколько миллисекунд
+    и уходят в модель одним вызовом encode. Каждый вызывающий получает свой вектор.
+
+    max_batch=1 - это прежнее поведение (батч из одного запроса), удобно для сравнения.
+    """
+
+    def __init__(self, model_getter, max_batch: int = 32, max_wait_ms: float = 5.0, log_every: int = 500):
+        self.model_getter = model_getter
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self.log_every = log_every
+        # Один поток: батчи идут в модель по очереди, параллелизм - внутри encode
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self._started = time.perf_counter()
+        self.requests = 0
+        self.batches = 0
+        self.encoded = 0
+        self.encode_seconds = 0.0
+
+    async def encode(self, text: str) -> list:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self.requests += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _encode(self, texts):
+        return self.model_getter().encode(texts, batch_size=len(texts)).tolist()
+
+    async def _run(self, batch):
+        # Одинаковые тексты внутри батча считаем один раз
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        started = time.perf_counter()
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(self._executor, self._encode, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.encode_seconds += time.perf_counter() - started
+        self.batches += 1
+        self.encoded += len(texts)
+
+        by_text = dict(zip(texts, vectors))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+        if self.log_every and self.batches % self.log_every == 0:
+            s = self.stats()
+            logging.info(
+                f"Эмбеддинги: {s['requests']} запросов, средний батч {s['avg_batch_size']:.1f}, "
+                f"{s['encode_throughput']:.0f} текстов/с в модели"
+            )
+
+    def stats(self) -> dict:
+        """Пропускная способность: encode_throughput - тексты в секунду работы модели"""
+        elapsed = time.perf_counter() - self._started
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "encoded": self.encoded,
+            "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "encode_seconds": self.encode_seconds,
+            "encode_throughput": self.encoded / self.encode_seconds if self.encode_seconds else 0.0,
+            "requests_per_second": self.requests / elapsed if elapsed else 0.0,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+class EmbeddingCache:
+    """LRU-кэш эмбеддингов: одинаковые запросы не гоняем через MiniLM повторно.
+
+    Ключ - нормализованный текст (регистр, пробелы, ё/е). На вектор это не влияет:
+    токенизатор all-MiniLM-L6-v2 сам приводит текст к нижнему регистру и снимает
+    диакритику, поэтому в модель отправляем уже нормализованную строку.
+    """
+
+    def __init__(self, model_getter, max_size: int = 2048, batcher: EmbeddingBatcher = None):
+        # model_getter - функция, возвращающая SentenceTransformer (модель грузится лениво)
+        self.model_getter = model_getter
+        self.batcher = batcher
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.lower().replace("ё", "е").split())
+
+    def get(self, key: str):
+        with self._lock:
+            vector = self._items.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key: str, vector):
+        with self._lock:
+            self._items[key] = tuple(vector)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def encode(self, text: str) -> list:
+        """Эмбеддинг одного текста (list[float], как ждет ChromaDB). Блокирующий"""
+        key = self.normalize(text)
+        vector = self.get(key)
+        if vector is None:
+            vector = self.model_getter().encode(key).tolist()
+            self.put(key, vector)
+        return list(vector)
+
+    async def encode_async(self, text: str) -> list:
+        """То же, что encode, но промахи считаются вне event loop (через батчер, если он задан)"""
+        key = self.normalize(text)
+        vector = self.get(key)
+        if vector is None:
+            if self.batcher is not None:
+                vector = await self.batcher.encode(key)
+            else:
+                vector = await asyncio.to_thread(lambda: self.model_getter().encode(key).tolist())
+            self.put(key, vector)
+        return list(vector)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
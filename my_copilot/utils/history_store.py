@@ -0,0 +1,216 @@
+import copy
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl  # межпроцессная блокировка (bot.py и app.py пишут в одну историю)
+except ImportError:  # Windows: остается только блокировка внутри процесса
+    fcntl = None
+
+DEFAULT_HISTORY = {"oil_change": {"mileage": 145000, "date": "2024-01-01"}, "history": []}
+
+
+class HistoryStore:
+    """История ТО в памяти, на диске - снапшот + журнал операций.
+
+    Снапшот - прежний service_history.json (плюс поле _seq), журнал - JSON-строки
+    операций с номерами. Запись = одна строка в конец журнала, раз в compact_every
+    операций журнал сворачивается в снапшот (tmp + os.replace, атомарно).
+    При чтении применяются только операции с номером больше _seq снапшота,
+    поэтому свертка в другом процессе не приводит к двойному применению.
+    Изменения файлов другим процессом замечаются по stat не чаще check_interval.
+
+    Читатели (oil_change, last_events, snapshot) берут неизменяемый снимок, который
+    запись и перечитывание подменяют под коротким локом. Файловый ввод-вывод (журнал,
+    fsync, свертка) идет под своим локом, и читатель его не ждет: если запись уже
+    идет, он отдает текущий снимок - свежий она опубликует сама.
+    """
+
+    def __init__(self, path: str = "service_history.json", compact_every: int = 50, check_interval: float = 1.0):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.lock_path = path + ".lock"
+        self.compact_every = compact_every
+        self.check_interval = check_interval
+        self._lock = threading.RLock()  # запись и перечитывание файлов
+        self._view_lock = threading.Lock()  # только подмена снимка для читателей
+        self._view = None  # {"oil_change": dict, "history": tuple, ...} - не изменяется после публикации
+        self._data = None
+        self._seq = 0
+        self._pending_ops = 0
+        self._signature = None
+        self._checked_at = 0.0
+
+    # --- Файлы ---
+    def _stat_signature(self):
+        sig = []
+        for p in (self.path, self.journal_path):
+            try:
+                st = os.stat(p)
+                sig.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                sig.append(None)
+        return tuple(sig)
+
+    def _file_lock(self, exclusive: bool):
+        store = self
+
+        class _Lock:
+            def __enter__(self):
+                self.f = None
+                if fcntl is not None:
+                    self.f = open(store.lock_path, "a")
+                    fcntl.flock(self.f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+            def __exit__(self, *exc):
+                if self.f is not None:
+                    fcntl.flock(self.f, fcntl.LOCK_UN)
+                    self.f.close()
+
+        return _Lock()
+
+    def _load(self):
+        data = copy.deepcopy(DEFAULT_HISTORY)
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                data.update(json.load(f))
+        seq = data.pop("_seq", 0)
+        pending = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r") as f:
+                for line in f:
+                    try:
+                        op = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # недописанная строка (процесс упал посреди записи)
+                    if op["seq"] > seq:
+                        self._apply(data, op)
+                        seq = op["seq"]
+                        pending += 1
+        self._data, self._seq, self._pending_ops = data, seq, pending
+        self._signature = self._stat_signature()
+        self._checked_at = time.monotonic()
+        self._publish()
+
+    def _publish(self):
+        """Новый снимок для читателей. События после записи не меняются - их можно делить со снимком"""
+        view = {k: copy.deepcopy(v) for k, v in self._data.items() if k not in ("history", "oil_change")}
+        view["oil_change"] = dict(self._data["oil_change"])
+        view["history"] = tuple(self._data.get("history", []))
+        with self._view_lock:
+            self._view = view
+
+    def _ensure_fresh(self):
+        """Для чтения: не чаще check_interval сверяемся с диском (stat), перечитываем только при изменениях.
+        Если лок записи занят - запись сама опубликует свежий снимок, читатель ее не ждет"""
+        if self._view is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return
+        if not self._lock.acquire(blocking=self._view is None):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            if self._data is None or self._stat_signature() != self._signature:
+                with self._file_lock(exclusive=False):
+                    self._load()
+        finally:
+            self._lock.release()
+
+    def _read(self) -> dict:
+        self._ensure_fresh()
+        with self._view_lock:
+            return self._view
+
+    def _reload_if_changed(self):
+        """Для записи (файл уже заблокирован): сверяемся с диском, чтобы не потерять чужие записи"""
+        if self._data is None or self._stat_signature() != self._signature:
+            self._load()
+
+    @staticmethod
+    def _apply(data: dict, op: dict):
+        kind = op["op"]
+        if kind == "add_event":
+            data.setdefault("history", []).append(op["event"])
+        elif kind == "pop_event":
+            if data.get("history"):
+                data["history"].pop()
+        elif kind == "oil_change":
+            data["oil_change"] = op["oil_change"]
+
+    def _append_locked(self, op: dict):
+        op["seq"] = self._seq + 1
+        self._apply(self._data, op)
+        with open(self.journal_path, "a") as f:
+            f.write(json.dumps(op, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._seq = op["seq"]
+        self._publish()  # до свертки: читатели видят запись, как только она на диске
+        self._pending_ops += 1
+        if self._pending_ops >= self.compact_every:
+            self._compact_locked()
+        self._signature = self._stat_signature()
+
+    def _write_op(self, op: dict):
+        with self._lock, self._file_lock(exclusive=True):
+            self._reload_if_changed()
+            self._append_locked(op)
+
+    def _compact_locked(self):
+        snapshot = dict(self._data, _seq=self._seq)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        # Журнал больше не нужен: все его операции уже в снапшоте (seq <= _seq)
+        open(self.journal_path, "w").close()
+        self._pending_ops = 0
+        self._signature = self._stat_signature()
+
+    def compact(self):
+        """Свернуть журнал в снапшот (например, при остановке)"""
+        with self._lock, self._file_lock(exclusive=True):
+            self._reload_if_changed()
+            if self._pending_ops:
+                self._compact_locked()
+
+    # --- Чтение (из памяти) ---
+    def exists(self) -> bool:
+        """Есть ли сохраненная история (иначе - значения по умолчанию)"""
+        return os.path.exists(self.path) or os.path.exists(self.journal_path)
+
+    def snapshot(self) -> dict:
+        """Вся история копией (O(n) - для отчетов и UI используйте oil_change/last_events)"""
+        view = self._read()
+        data = {k: copy.deepcopy(v) for k, v in view.items() if k != "history"}
+        data["history"] = [dict(e) for e in view["history"]]
+        return data
+
+    def oil_change(self) -> dict:
+        return dict(self._read()["oil_change"])
+
+    def last_events(self, n: int = 5) -> list:
+        return [dict(e) for e in self._read()["history"][-n:]] if n > 0 else []
+
+    # --- Запись (через журнал) ---
+    def add_event(self, event: dict):
+        self._write_op({"op": "add_event", "event": event})
+
+    def pop_event(self):
+        """Удалить последнее событие. Возвращает удаленное или None"""
+        with self._lock, self._file_lock(exclusive=True):
+            self._reload_if_changed()
+            if not self._data.get("history"):
+                return None
+            removed = copy.deepcopy(self._data["history"][-1])
+            self._append_locked({"op": "pop_event"})
+            return removed
+
+    def set_oil_change(self, mileage: int, date: str):
+        self._write_op({"op": "oil_change", "oil_change": {"mileage": mileage, "date": date}})
+
+
+history_store = HistoryStore("service_history.json")
@@ -0,0 +1,222 @@
+import bisect
+import logging
+import threading
+import time
+
+from utils import tracing
+
+# Границы корзин задержки (секунды): от быстрых кэшей до долгих ответов DeepSeek и Whisper
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value: float):
+        # Счетчик по корзине + сумма: запись - O(log корзин) под коротким локом
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def render(self):
+        with self._lock:
+            items = [(k, list(counts), total) for k, (counts, total) in self._values.items()]
+        lines = self._header()
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [le])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Метрики в текстовом формате Prometheus без внешних зависимостей.
+
+    Горячий путь - только счетчики и корзины под локом. Статистика кэшей и
+    очередей не дублируется: коллекторы читают stats() объектов в момент
+    запроса /metrics.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()) -> Counter:
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()) -> Gauge:
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def add_collector(self, collector):
+        """collector() -> [(имя, тип, описание, [(dict меток, значение)])] - вызывается при каждом /metrics"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logging.error(f"Коллектор метрик упал: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels.keys(), labels.values())} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "copilot_stage_seconds", "Длительность этапа обработки", ("stage",))
+STAGE_ERRORS = registry.counter(
+    "copilot_stage_errors_total", "Этапы, завершившиеся исключением", ("stage",))
+UPDATES_IN_FLIGHT = registry.gauge(
+    "copilot_updates_in_flight", "Апдейты Telegram в обработке", ("kind",))
+UPDATES_TOTAL = registry.counter(
+    "copilot_updates_total", "Обработанные апдейты Telegram", ("kind",))
+
+
+class stage:
+    """Замер этапа: with stage("whisper"): ... - и в обычном, и в async коде.
+    Время идет в copilot_stage_seconds, исключение - еще и в copilot_stage_errors_total.
+    Внутри трейса апдейта этап заодно пишется спаном (см. utils/tracing.py)"""
+
+    __slots__ = ("name", "started", "span")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.span = tracing.span(self.name).__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.observe(self.name, value=time.perf_counter() - self.started)
+        self.span.__exit__(exc_type, exc, tb)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(self.name)
+        return False
+
+
+class in_flight:
+    """Счетчик апдейтов в обработке: async with in_flight("message"): ..."""
+
+    __slots__ = ("kind",)
+
+    def __init__(self, kind: str):
+        self.kind = kind
+
+    async def __aenter__(self):
+        UPDATES_IN_FLIGHT.inc(self.kind)
+        return self
+
+    async def __aexit__(self, *exc):
+        UPDATES_IN_FLIGHT.dec(self.kind)
+        UPDATES_TOTAL.inc(self.kind)
+        return False
+
+
+def cache_collector(caches: dict):
+    """Коллектор для объектов со stats() {hits, misses}: {"имя кэша": объект}"""
+    def collect():
+        hits, misses, ratio = [], [], []
+        for name, cache in caches.items():
+            stats = cache.stats()
+            h, m = stats.get("hits", 0), stats.get("misses", 0)
+            hits.append(({"cache": name}, h))
+            misses.append(({"cache": name}, m))
+            ratio.append(({"cache": name}, h / (h + m) if h + m else 0.0))
+        return [
+            ("copilot_cache_hits_total", "counter", "Попадания в кэш", hits),
+            ("copilot_cache_misses_total", "counter", "Промахи кэша", misses),
+            ("copilot_cache_hit_ratio", "gauge", "Доля попаданий в кэш", ratio),
+        ]
+    return collect
+
+
+def usage_collector(tracker):
+    """Токены DeepSeek из UsageTracker по меткам вызова"""
+    def collect():
+        samples = []
+        for label, row in tracker.stats().items():
+            if label == "all":
+                continue
+            for kind in ("prompt_tokens", "completion_tokens", "cache_hit_tokens", "cache_miss_tokens"):
+                samples.append(({"call": label, "kind": kind.replace("_tokens", "")}, row[kind]))
+        requests = [({"call": label}, row["requests"]) for label, row in tracker.stats().items() if label != "all"]
+        return [
+            ("copilot_llm_tokens_total", "counter", "Токены DeepSeek", samples),
+            ("copilot_llm_requests_total", "counter", "Запросы к DeepSeek", requests),
+        ]
+    return collect
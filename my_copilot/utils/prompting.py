@@ -0,0 +1,148 @@
+import logging
+import math
+
+try:
+    import tiktoken  # необязательно: точнее эвристики, но токенизатор не DeepSeek-овский
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+
+def count_tokens(text: str) -> int:
+    """Оценка числа токенов. Без tiktoken - эвристика: кириллица ~2.5 символа
+    на токен, остальное ~4 (для русских текстов DeepSeek ближе к этому)"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    cyrillic = sum(1 for ch in text if "а" <= ch.lower() <= "я" or ch in "ёЁ")
+    return math.ceil(cyrillic / 2.5 + (len(text) - cyrillic) / 4)
+
+
+def message_tokens(message: dict) -> int:
+    # ~4 служебных токена на сообщение (роль, разделители)
+    tokens = 4 + count_tokens(message.get("content") or "")
+    for call in message.get("tool_calls") or []:
+        tokens += count_tokens(call["function"]["name"]) + count_tokens(call["function"]["arguments"])
+    return tokens
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """Обрезать текст примерно до tokens токенов (по словам)"""
+    if count_tokens(text) <= tokens:
+        return text
+    words = text.split()
+    lo, hi = 0, len(words)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(" ".join(words[:mid])) <= tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return " ".join(words[:lo]) + "…" if lo else ""
+
+
+class PromptAssembler:
+    """Сборка промпта в бюджет токенов.
+
+    Бюджет делится так: системный промпт целиком, RAG-фрагменты - не больше
+    rag_share бюджета (самые релевантные первыми, хвост обрезается), сводка
+    старых реплик и свежая история - на остаток.
+
+    История режется с гистерезисом: пока она влезает в остаток бюджета и в
+    max_messages, она идет целиком и только растет (префикс запроса стабилен).
+    При переполнении остаются keep_messages реплик и не больше keep_share
+    остатка, а остальное возвращается отдельно пачкой - для свертки в сводку.
+    Так сводка обновляется раз в несколько ходов, а не на каждом.
+    """
+
+    def __init__(self, budget: int = 3000, rag_share: float = 0.4, snippet_tokens: int = 400, max_messages: int = 10,
+                 keep_messages: int = 4, keep_share: float = 0.5):
+        self.budget = budget
+        self.rag_share = rag_share
+        self.snippet_tokens = snippet_tokens
+        self.max_messages = max_messages
+        self.keep_messages = min(keep_messages, max_messages)
+        self.keep_share = keep_share
+
+    def fit_snippets(self, snippets: list, budget: int) -> list:
+        """snippets: [(текст, расстояние, заголовок)]; меньше расстояние - релевантнее.
+        Возвращает [(заголовок, текст)] в порядке релевантности"""
+        fitted = []
+        titles = set()
+        left = budget
+        for text, _, title in sorted(snippets, key=lambda s: s[1]):
+            if title not in titles:
+                left -= count_tokens(title) + 2
+            if left <= 20:
+                break
+            text = truncate_to_tokens(text, min(self.snippet_tokens, left))
+            if text:
+                fitted.append((title, text))
+                titles.add(title)
+                left -= count_tokens(text) + 1
+        return fitted
+
+    def fit_history(self, history: list, budget: int):
+        """-> (kept, dropped). Влезает в budget и max_messages - вся история, иначе свежие реплики
+        до keep_messages и keep_share * budget. Начало kept - всегда реплика пользователя
+        (ответ навыка без своего assistant-сообщения DeepSeek отвергает)"""
+        if len(history) <= self.max_messages and sum(message_tokens(m) for m in history) <= budget:
+            start = 0
+        else:
+            start = len(history)
+            used = 0
+            for i in range(len(history) - 1, -1, -1):
+                cost = message_tokens(history[i])
+                if used + cost > budget * self.keep_share or len(history) - i > self.keep_messages:
+                    break
+                used += cost
+                start = i
+        while start < len(history) and history[start]["role"] != "user":
+            start += 1
+        if start == len(history):
+            # Даже последняя реплика не влезла - берем ее (и все после нее) все равно
+            start = max(i for i, m in enumerate(history) if m["role"] == "user") if any(
+                m["role"] == "user" for m in history) else 0
+        return history[start:], history[:start]
+
+    def build(self, system_prompt: str, snippets: list, summary: str, history: list):
+        """-> (context, kept, dropped, report). context - текст RAG для промпта"""
+        report = {"budget": self.budget, "system": count_tokens(system_prompt)}
+        left = self.budget - report["system"]
+
+        fitted = self.fit_snippets(snippets, int(min(self.budget * self.rag_share, max(left, 0))))
+        sections = {}
+        for title, text in fitted:
+            sections.setdefault(title, []).append(text)
+        context = "".join(f"\n{title}:\n" + "\n".join(texts) for title, texts in sections.items())
+        report["context"] = count_tokens(context)
+        report["summary"] = count_tokens(summary)
+        left -= report["context"] + report["summary"]
+
+        kept, dropped = self.fit_history(history, max(left, 0))
+        report["history"] = sum(message_tokens(m) for m in kept)
+        report["dropped_messages"] = len(dropped)
+        report["total"] = report["system"] + report["context"] + report["summary"] + report["history"]
+        return context, kept, dropped, report
+
+
+def request_messages(system_prompt: str, summary: str, history: list, turn_start: int, state: dict) -> list:
+    """Порядок сообщений под кэш префикса DeepSeek: инструкции -> сводка -> прошлые реплики ->
+    данные этого запроса (state) -> текущий вопрос и ответы навыков (history[turn_start:]).
+    Между свертками сводка не меняется, а история только дописывается, поэтому запрос
+    совпадает с предыдущим по всему префиксу до state"""
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary:
+        messages.append({"role": "system", "content": f"Краткое содержание предыдущего разговора:\n{summary}"})
+    return messages + history[:turn_start] + [state] + history[turn_start:]
+
+
+def log_prompt_report(report: dict, usage=None):
+    """Оценка по частям промпта и (если пришло) реальное prompt_tokens от DeepSeek"""
+    real = f", DeepSeek насчитал {usage.prompt_tokens}" if usage is not None else ""
+    logging.info(
+        f"Промпт: система {report['system']} + контекст {report['context']} + сводка {report['summary']} "
+        f"+ история {report['history']} = ~{report['total']} ток. (бюджет {report['budget']}, "
+        f"в сводку ушло {report['dropped_messages']} реплик){real}"
+    )
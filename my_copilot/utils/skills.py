@@ -1,7 +1,14 @@
-import requests
 import urllib.parse
 import logging
 import time
+import os
+import json
+import asyncio
+import inspect
+from collections import OrderedDict
+from utils.weather import weather_service
+from utils.history_store import history_store
+from utils.metrics import stage
 
 # База артикулов для Audi A3 (1.6 BSE)
 VAG_PARTS = {
@@ -18,33 +25,22 @@ class SkillManager:
     """Управление навыками (Skills) в стиле OpenClaw"""
     
     @staticmethod
-    def get_weather(city: str = "Москва"):
-        """Навык: Прогноз погоды с авто-ретритами"""
-        urls = [
-            f"https://wttr.in/{urllib.parse.quote(city)}?format=3",
-            f"https://v2.wttr.in/{urllib.parse.quote(city)}?format=3" # Резервный сервер
-        ]
+    async def get_weather(city: str = "Москва"):
+        """Навык: Прогноз погоды (пул соединений, кэш по городу, гонка основного и резервного сервера)"""
+        weather = await weather_service.get(city)
+        if weather is None:
+            return "Не удалось достучаться до метеослужбы. Но Алекс советует: на дороге всегда будь начеку!"
         
-        for url in urls:
-            try:
-                response = requests.get(url, timeout=10)
-                if response.status_code == 200:
-                    weather = response.text.strip()
-                    advice = f"🌤 Погода: {weather}. "
-                    
-                    lower_w = weather.lower()
-                    if any(x in lower_w for x in ["rain", "🌧", "дождь"]):
-                        advice += "Дорога мокрая, держи дистанцию."
-                    elif any(x in lower_w for x in ["snow", "❄️", "снег", "ice"]):
-                        advice += "Скользко! Двигайся плавно."
-                    else:
-                        advice += "Условия для вождения в норме."
-                    return advice
-            except Exception as e:
-                logging.error(f"Ошибка погоды на {url}: {e}")
-                time.sleep(1)
+        advice = f"🌤 Погода: {weather}. "
         
-        return "Не удалось достучаться до метеослужбы. Но Алекс советует: на дороге всегда будь начеку!"
+        lower_w = weather.lower()
+        if any(x in lower_w for x in ["rain", "🌧", "дождь"]):
+            advice += "Дорога мокрая, держи дистанцию."
+        elif any(x in lower_w for x in ["snow", "❄️", "снег", "ice"]):
+            advice += "Скользко! Двигайся плавно."
+        else:
+            advice += "Условия для вождения в норме."
+        return advice
 
     @staticmethod
     def get_part_info(part_name: str):
@@ -54,24 +50,21 @@ class SkillManager:
         return f"🔍 Поиск запчасти '{part_name}': рекомендуемые бренды для Audi — VAG, Sachs, Lemförder. Подробнее тут: {search_link}"
 
     @staticmethod
-    def generate_service_report(history_file="service_history.json"):
+    def generate_service_report():
         """Навык: Генерация текстового отчета по истории ТО"""
-        import json
-        import os
-        if not os.path.exists(history_file):
+        if not history_store.exists():
             return "История обслуживания пока пуста."
         
-        with open(history_file, "r") as f:
-            data = json.load(f)
+        # Только то, что нужно отчету: без копии всей истории
+        oc = history_store.oil_change()
+        events = history_store.last_events(5)
         
         report = "📋 <b>ОТЧЕТ ПО ОБСЛУЖИВАНИЮ AUDI A3</b>\n\n"
-        if "oil_change" in data:
-            oc = data["oil_change"]
-            report += f"🛢 <b>Замена масла:</b>\n- Дата: {oc.get('date', 'Неизвестно')}\n- Пробег: {oc.get('mileage', '0')} км\n\n"
+        report += f"🛢 <b>Замена масла:</b>\n- Дата: {oc.get('date', 'Неизвестно')}\n- Пробег: {oc.get('mileage', '0')} км\n\n"
         
-        if "history" in data and data["history"]:
+        if events:
             report += "🛠 <b>История последних работ:</b>\n"
-            for item in data["history"][-5:]: # Последние 5 записей
+            for item in events: # Последние 5 записей
                 report += f"- {item['date']}: {item['work']} ({item['mileage']} км)\n"
         else:
             report += "Дополнительных записей о работах не найдено."
@@ -79,23 +72,17 @@ class SkillManager:
         return report
 
     @staticmethod
-    def get_proactive_briefing(city: str = "Калуга"):
+    async def get_proactive_briefing(city: str = "Калуга"):
         """Навык: Генерация утреннего брифинга (Погода + Состояние авто)"""
-        weather = SkillManager.get_weather(city)
+        weather = await SkillManager.get_weather(city)
         
-        # Загружаем ТО
-        import json
-        import os
-        history_file = "service_history.json"
+        # ТО - из памяти хранилища истории
         oil_msg = ""
-        if os.path.exists(history_file):
-            with open(history_file, "r") as f:
-                data = json.load(f)
-                if "oil_change" in data:
-                    # Предположим текущий пробег 150000 для примера, 
-                    # в идеале нужно брать последний известный
-                    last_mileage = data["oil_change"].get("mileage", 0)
-                    oil_msg = f"\n🔧 Напоминание по маслу: последняя замена была на {last_mileage} км. Не забывай поглядывать на одометр!"
+        if history_store.exists():
+            # Предположим текущий пробег 150000 для примера, 
+            # в идеале нужно брать последний известный
+            last_mileage = history_store.oil_change().get("mileage", 0)
+            oil_msg = f"\n🔧 Напоминание по маслу: последняя замена была на {last_mileage} км. Не забывай поглядывать на одометр!"
 
         brief = f"Доброе утро! ☕️\n\n{weather}{oil_msg}\n\nУдачного дня за рулем Audi!"
         return brief
@@ -103,26 +90,16 @@ class SkillManager:
     @staticmethod
     def log_car_event(event_description: str, mileage: int = 150000):
         """Навык: Сохранить любое событие по машине (поломка, замена, наблюдение)"""
-        import json
-        import os
         import datetime
-        history_file = "service_history.json"
-        
-        # 1. Сохраняем в JSON (структура)
-        data = {"oil_change": {"mileage": 145000, "date": "2024-01-01"}, "history": []}
-        if os.path.exists(history_file):
-            with open(history_file, "r") as f: data = json.load(f)
         
+        # 1. Сохраняем в журнал истории (одна строка в конец файла, без перезаписи)
         now = datetime.datetime.now()
         new_event = {
             "date": now.strftime("%d.%m.%Y"),
             "work": event_description,
             "mileage": mileage
         }
-        data.setdefault("history", []).append(new_event)
-        
-        with open(history_file, "w") as f:
-            json.dump(data, f, indent=4)
+        history_store.add_event(new_event)
         
         # 2. Сообщаем о сохранении (ChromaDB обновим через bot.py)
         return f"Запомнил событие: '{event_description}' на пробеге {mileage} км. Это сохранено в твою базу знаний."
@@ -130,19 +107,11 @@ class SkillManager:
     @staticmethod
     def remove_last_event():
         """Навык: Удалить последнюю запись из истории (если ошибся)"""
-        import json
-        import os
-        history_file = "service_history.json"
-        if not os.path.exists(history_file):
+        if not history_store.exists():
             return "История пуста, удалять нечего."
         
-        with open(history_file, "r") as f:
-            data = json.load(f)
-        
-        if "history" in data and data["history"]:
-            removed = data["history"].pop()
-            with open(history_file, "w") as f:
-                json.dump(data, f, indent=4)
+        removed = history_store.pop_event()
+        if removed:
             return f"Удалил последнюю запись: '{removed['work']}' за {removed['date']}."
         else:
             return "В списке дополнительных работ нет записей для удаления."
@@ -211,101 +180,163 @@ class SkillManager:
         except Exception as e:
             return f"Ошибка поиска: {e}"
 
+# Реестр навыков: схема для ИИ, асинхронная реализация и лимиты объявляются рядом.
+# Новый навык = новая функция с @skill ниже, bot.py трогать не нужно.
+DEFAULT_SKILL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", 15))
+
+
+class Skill:
+    """Навык: схема, реализация, таймаут, лимит параллельных вызовов и кэш результатов"""
+
+    def __init__(self, name, func, description, parameters, required, timeout, concurrency, cacheable, cache_ttl, cache_size=256):
+        self.name = name
+        self.func = func
+        self.description = description
+        self.parameters = parameters
+        self.required = required
+        self.timeout = timeout
+        self.cacheable = cacheable
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._cache = OrderedDict()
+
+    @property
+    def schema(self) -> dict:
+        params = {"type": "object", "properties": self.parameters}
+        if self.required:
+            params["required"] = self.required
+        return {"type": "function", "function": {"name": self.name, "description": self.description, "parameters": params}}
+
+    async def _invoke(self, args):
+        async with self._semaphore:
+            if inspect.iscoroutinefunction(self.func):
+                return await self.func(**args)
+            # Синхронная реализация не должна блокировать event loop
+            return await asyncio.to_thread(self.func, **args)
+
+    async def __call__(self, **args) -> str:
+        key = json.dumps(args, sort_keys=True, ensure_ascii=False)
+        if self.cacheable:
+            cached = self._cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                return cached[1]
+
+        result = await asyncio.wait_for(self._invoke(args), self.timeout)
+
+        if self.cacheable:
+            self._cache[key] = (time.monotonic() + self.cache_ttl, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+
+class SkillRegistry:
+    """Все навыки агента. Из него же генерируется описание tools для DeepSeek"""
+
+    def __init__(self):
+        self._skills = {}
+        self._listeners = {}
+
+    def skill(self, name: str, description: str, parameters: dict = None, required: list = None,
+              timeout: float = None, concurrency: int = 4, cacheable: bool = False, cache_ttl: float = 300):
+        def decorator(func):
+            self._skills[name] = Skill(
+                name, func, description, parameters or {}, required or [],
+                timeout or DEFAULT_SKILL_TIMEOUT, concurrency, cacheable, cache_ttl,
+            )
+            return func
+        return decorator
+
+    def add_listener(self, name: str, callback):
+        """callback(args, result) - async-функция, вызывается после успешного выполнения навыка"""
+        self._listeners.setdefault(name, []).append(callback)
+
+    @property
+    def tools(self) -> list:
+        return [s.schema for s in self._skills.values()]
+
+    def __contains__(self, name):
+        return name in self._skills
+
+    async def call(self, name: str, args: dict) -> str:
+        """Вызов навыка по имени. Ошибки и таймауты возвращаются текстом для модели"""
+        skill = self._skills.get(name)
+        if skill is None:
+            return "Навык не найден."
+        try:
+            with stage(f"skill_{name}"):
+                result = await skill(**args)
+        except asyncio.TimeoutError:
+            logging.error(f"Навык {name} не уложился в {skill.timeout}с")
+            return f"Навык {name} не ответил вовремя."
+        except Exception as e:
+            logging.error(f"Ошибка навыка {name}: {e}")
+            return f"Ошибка навыка {name}: {e}"
+
+        for callback in self._listeners.get(name, []):
+            try:
+                await callback(args, result)
+            except Exception as e:
+                logging.error(f"Ошибка обработчика навыка {name}: {e}")
+        return result
+
+
+registry = SkillRegistry()
+skill = registry.skill
+
+
+@skill("get_weather", "Узнать реальную погоду и получить совет по вождению",
+       {"city": {"type": "string", "description": "Город (например, Калуга)"}}, required=["city"],
+       timeout=15, concurrency=8)
+async def get_weather(city: str = "Москва"):
+    # Кэш со stale-while-revalidate - внутри weather_service
+    return await SkillManager.get_weather(city)
+
+
+@skill("get_part_info", "Найти информацию о запчасти или её цену",
+       {"part_name": {"type": "string", "description": "Название детали"}}, required=["part_name"],
+       cacheable=True, cache_ttl=86400)
+async def get_part_info(part_name: str):
+    return SkillManager.get_part_info(part_name)
+
+
+@skill("log_car_event", "Записать событие, поломку или замену детали в историю машины",
+       {
+           "event_description": {"type": "string", "description": "Что произошло (например, заскрипели колодки или поменял свечи)"},
+           "mileage": {"type": "integer", "description": "Текущий пробег"}
+       }, required=["event_description"], timeout=10, concurrency=2)
+async def log_car_event(event_description: str, mileage: int = 150000):
+    return await asyncio.to_thread(SkillManager.log_car_event, event_description, mileage)
+
+
+@skill("remove_last_event", "Удалить последнюю добавленную запись из истории обслуживания, если пользователь совершил ошибку",
+       timeout=10, concurrency=2)
+async def remove_last_event():
+    return await asyncio.to_thread(SkillManager.remove_last_event)
+
+
+@skill("get_part_numbers", "Получить оригинальные артикулы (VAG) и проверенные аналоги запчастей для двигателя 1.6 BSE Audi A3",
+       {"part_name": {"type": "string", "description": "Название запчасти (например, свечи, фильтр)"}}, required=["part_name"],
+       cacheable=True, cache_ttl=86400)
+async def get_part_numbers(part_name: str):
+    return SkillManager.get_part_numbers(part_name)
+
+
+@skill("sos_help", "Получить экстренные инструкции при ДТП (аварии) или технической поломке в пути",
+       {"situation_type": {"type": "string", "description": "Тип ситуации: 'авария' или 'поломка'"}})
+async def sos_help(situation_type: str = "авария"):
+    return SkillManager.sos_help(situation_type)
+
+
+@skill("web_search", "Найти информацию в интернете (цены на запчасти, отзывы, инструкции, если нет в базе)",
+       {"query": {"type": "string", "description": "Запрос для поиска (например, 'цена лобовое стекло Audi A3 8P')"}}, required=["query"],
+       timeout=20, concurrency=2, cacheable=True, cache_ttl=3600)
+async def web_search(query: str):
+    return await asyncio.to_thread(SkillManager.web_search, query)
+
+
 # Описание для ИИ
-OPENCLAW_TOOLS = [
-    {
-        "type": "function",
-        "function": {
-            "name": "get_weather",
-            "description": "Узнать реальную погоду и получить совет по вождению",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "city": {"type": "string", "description": "Город (например, Калуга)"}
-                },
-                "required": ["city"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "get_part_info",
-            "description": "Найти информацию о запчасти или её цену",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "part_name": {"type": "string", "description": "Название детали"}
-                },
-                "required": ["part_name"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "log_car_event",
-            "description": "Записать событие, поломку или замену детали в историю машины",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "event_description": {"type": "string", "description": "Что произошло (например, заскрипели колодки или поменял свечи)"},
-                    "mileage": {"type": "integer", "description": "Текущий пробег"}
-                },
-                "required": ["event_description"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "remove_last_event",
-            "description": "Удалить последнюю добавленную запись из истории обслуживания, если пользователь совершил ошибку",
-            "parameters": {
-                "type": "object",
-                "properties": {}
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "get_part_numbers",
-            "description": "Получить оригинальные артикулы (VAG) и проверенные аналоги запчастей для двигателя 1.6 BSE Audi A3",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "part_name": {"type": "string", "description": "Название запчасти (например, свечи, фильтр)"}
-                },
-                "required": ["part_name"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "sos_help",
-            "description": "Получить экстренные инструкции при ДТП (аварии) или технической поломке в пути",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "situation_type": {"type": "string", "description": "Тип ситуации: 'авария' или 'поломка'"}
-                }
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "web_search",
-            "description": "Найти информацию в интернете (цены на запчасти, отзывы, инструкции, если нет в базе)",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "query": {"type": "string", "description": "Запрос для поиска (например, 'цена лобовое стекло Audi A3 8P')"}
-                },
-                "required": ["query"]
-            }
-        }
-    }
-]
+OPENCLAW_TOOLS = registry.tools
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+
+from telegram.error import BadRequest, RetryAfter
+
+from utils.metrics import stage
+
+TG_MAX_LEN = 4096
+_TAG_RE = re.compile(r"<(/?)([a-zA-Z]+)[^>]*>")
+
+
+def strip_html(text: str) -> str:
+    """Чистим теги, чтобы не пугать юзера, если HTML сломан"""
+    return text.replace("<b>", "").replace("</b>", "").replace("<i>", "").replace("</i>", "")
+
+
+def balance_html(text: str) -> str:
+    """Промежуточный текст обрезан посреди генерации: убираем недописанный тег в конце
+    и закрываем открытые, чтобы Telegram принял частичный HTML"""
+    text = re.sub(r"<[^>]*$", "", text)
+    stack = []
+    for closing, tag in _TAG_RE.findall(text):
+        tag = tag.lower()
+        if not closing:
+            stack.append(tag)
+        elif tag in stack:
+            # Закрываем все, что открыто после него (Telegram не любит перекрестные теги)
+            while stack and stack.pop() != tag:
+                pass
+    return text + "".join(f"</{tag}>" for tag in reversed(stack))
+
+
+def split_text(text: str, limit: int = TG_MAX_LEN) -> list:
+    """Режем длинный ответ на сообщения по границам строк"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+
+def _retry_seconds(e: RetryAfter) -> float:
+    delay = e.retry_after
+    return delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay)
+
+
+async def reply_html(message, text: str):
+    """Отправка текста с поддержкой HTML и фоллбэком на чистый текст"""
+    for part in split_text(text):
+        try:
+            with stage("telegram_send"):
+                await message.reply_text(part, parse_mode="HTML")
+        except Exception as e_html:
+            logging.error(f"HTML Error: {e_html}. Sending raw text.")
+            with stage("telegram_send"):
+                await message.reply_text(strip_html(part), parse_mode=None)
+
+
+class TTFTStats:
+    """Время до первого видимого токена (от начала обработки до первого edit)"""
+
+    def __init__(self, window: int = 500):
+        self._values = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, seconds: float):
+        self._values.append(seconds)
+        self.count += 1
+
+    def stats(self) -> dict:
+        values = sorted(self._values)
+        n = len(values)
+        return {
+            "count": self.count,
+            "avg": sum(values) / n if n else 0.0,
+            "p50": values[n // 2] if n else 0.0,
+            "p95": values[min(n - 1, int(n * 0.95))] if n else 0.0,
+        }
+
+
+ttft_stats = TTFTStats()
+
+
+class TelegramStreamer:
+    """Прогрессивный вывод ответа: плейсхолдер, затем edit_message_text по мере генерации.
+
+    Правки идут не чаще min_interval секунд (лимит Telegram ~1 сообщение/с на чат)
+    и в фоне, чтобы чтение стрима от DeepSeek не ждало сеть Telegram. limiter -
+    общий на все стримеры RateLimiter (utils/broadcast.py): держит суммарный темп
+    правок в пределах лимита на бота, а RetryAfter ставит на паузу всех.
+    """
+
+    def __init__(self, reply_to, started_at: float = None, placeholder: str = "✍️ Думаю...",
+                 min_interval: float = 1.0, min_chars: int = 20, limiter=None):
+        self.reply_to = reply_to
+        self.limiter = limiter
+        self.started_at = started_at or time.perf_counter()
+        self.placeholder = placeholder
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.message = None
+        self.text = ""
+        self._shown = ""
+        self._next_edit_at = 0.0
+        self._edit_task = None
+        self.first_visible = None
+
+    async def _acquire(self):
+        if self.limiter is not None:
+            with stage("telegram_rate_wait"):
+                await self.limiter.acquire()
+
+    def _retry_after(self, e: RetryAfter) -> float:
+        seconds = _retry_seconds(e)
+        if self.limiter is not None:
+            self.limiter.pause(seconds)
+        self._next_edit_at = time.perf_counter() + seconds
+        return seconds
+
+    async def start(self):
+        await self._acquire()
+        with stage("telegram_send"):
+            self.message = await self.reply_to.reply_text(self.placeholder)
+        self._next_edit_at = time.perf_counter() + self.min_interval
+
+    def reset(self):
+        """Новый ответ модели (например, после вызова навыков) заменяет предыдущий"""
+        self.text = ""
+
+    def push(self, delta: str):
+        self.text += delta
+        now = time.perf_counter()
+        if (self._edit_task is None or self._edit_task.done()) and now >= self._next_edit_at \
+                and len(self.text) - len(self._shown) >= self.min_chars:
+            self._edit_task = asyncio.ensure_future(self._edit(None))
+
+    async def _edit(self, text: str = None, final: bool = False) -> bool:
+        """text=None - промежуточная правка: текст берется после ожидания лимита, самый свежий"""
+        if text is not None and (not text.strip() or text == self._shown):
+            return True
+        await self._acquire()
+        if text is None:
+            text = self.text[:TG_MAX_LEN]
+            if not text.strip() or text == self._shown:
+                return True
+        body = text if final else balance_html(text)
+        try:
+            try:
+                with stage("telegram_edit"):
+                    await self.message.edit_text(body, parse_mode="HTML")
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return True
+                if final:
+                    logging.error(f"HTML Error: {e}. Sending raw text.")
+                with stage("telegram_edit"):
+                    await self.message.edit_text(strip_html(text), parse_mode=None)
+        except RetryAfter as e:
+            seconds = self._retry_after(e)
+            if final:
+                await asyncio.sleep(seconds)
+                return await self._edit(text, final=True)
+            return False
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                logging.error(f"Не удалось обновить сообщение: {e}")
+                return False
+        self._shown = text
+        self._next_edit_at = time.perf_counter() + self.min_interval
+        if self.first_visible is None:
+            self.first_visible = time.perf_counter() - self.started_at
+            ttft_stats.record(self.first_visible)
+            logging.info(f"Первый видимый токен через {self.first_visible:.2f}с")
+        return True
+
+    async def finish(self, text: str = None, html: bool = True):
+        """Финальная правка: полный текст (длинный - продолжается новыми сообщениями)"""
+        if text is not None:
+            self.text = text
+        if self._edit_task is not None:
+            await asyncio.gather(self._edit_task, return_exceptions=True)
+        parts = split_text(self.text or "…")
+        delay = self._next_edit_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if html:
+            await self._edit(parts[0], final=True)
+        else:
+            await self._acquire()
+            with stage("telegram_edit"):
+                await self.message.edit_text(parts[0], parse_mode=None)
+        for part in parts[1:]:
+            await self._acquire()
+            if html:
+                await reply_html(self.reply_to, part)
+            else:
+                with stage("telegram_send"):
+                    await self.reply_to.reply_text(part)
+
+
+async def stream_completion(client, streamer: TelegramStreamer = None, **kwargs):
+    """Читает ответ модели со stream=True: текст сразу отдает в streamer,
+    tool_calls собирает из дельт. Возвращает (сообщение ассистента как dict, usage)."""
+    if streamer is not None:
+        streamer.reset()
+    stream = await client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+    content = []
+    tool_calls = {}
+    usage = None
+    async for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content.append(delta.content)
+            if streamer is not None:
+                streamer.push(delta.content)
+        for tc in delta.tool_calls or []:
+            slot = tool_calls.setdefault(tc.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+            if tc.id:
+                slot["id"] = tc.id
+            if tc.function:
+                if tc.function.name:
+                    slot["function"]["name"] += tc.function.name
+                if tc.function.arguments:
+                    slot["function"]["arguments"] += tc.function.arguments
+
+    msg = {"role": "assistant", "content": "".join(content)}
+    if tool_calls:
+        msg["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+    return msg, usage
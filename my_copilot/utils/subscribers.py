@@ -0,0 +1,120 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+class SubscriberStore:
+    """Подписчики утреннего брифа в SQLite (WAL).
+
+    Подписка - атомарный upsert, поэтому одновременные /start не теряют записи.
+    Для рассылки - постраничный проход по первичному ключу без загрузки всего списка.
+    """
+
+    def __init__(self, path: str = "subscribers.db", legacy_json: str = "user_data.json"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS subscribers (
+                chat_id INTEGER PRIMARY KEY,
+                active INTEGER NOT NULL DEFAULT 1,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_subscribers_active ON subscribers (active, chat_id);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        if legacy_json:
+            self.import_json(legacy_json)
+
+    def _write(self, sql: str, rows: list):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(sql, rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def add(self, chat_id: int):
+        self.add_many([chat_id])
+
+    def add_many(self, chat_ids):
+        """Пакетный upsert одной транзакцией (повторная подписка снова делает чат активным)"""
+        now = time.time()
+        self._write(
+            "INSERT INTO subscribers (chat_id, active, updated_at) VALUES (?, 1, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET active = 1, updated_at = excluded.updated_at",
+            [(int(c), now) for c in chat_ids],
+        )
+
+    def deactivate_many(self, chat_ids):
+        """Чаты, заблокировавшие бота, больше не получают рассылку"""
+        now = time.time()
+        self._write("UPDATE subscribers SET active = 0, updated_at = ? WHERE chat_id = ?",
+                    [(now, int(c)) for c in chat_ids])
+
+    def is_subscribed(self, chat_id: int) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT active FROM subscribers WHERE chat_id = ?", (int(chat_id),)).fetchone()
+        return bool(row and row[0])
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM subscribers WHERE active = 1").fetchone()[0]
+
+    def active_page(self, after: int = None, page_size: int = 500) -> list:
+        """Страница активных chat_id после after (keyset по индексу, без OFFSET). Блокирующий"""
+        with self._lock:
+            if after is None:
+                rows = self._conn.execute(
+                    "SELECT chat_id FROM subscribers WHERE active = 1 ORDER BY chat_id LIMIT ?",
+                    (page_size,)).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT chat_id FROM subscribers WHERE active = 1 AND chat_id > ? ORDER BY chat_id LIMIT ?",
+                    (after, page_size)).fetchall()
+        return [chat_id for (chat_id,) in rows]
+
+    def iter_active(self, page_size: int = 500):
+        """Активные chat_id страницами (синхронно - для скриптов и потоков)"""
+        last = None
+        while True:
+            page = self.active_page(last, page_size)
+            if not page:
+                return
+            yield from page
+            last = page[-1]
+
+    async def aiter_active(self, page_size: int = 500):
+        """То же для event loop: каждая страница читается в потоке, SQLite не блокирует апдейты"""
+        last = None
+        while True:
+            page = await asyncio.to_thread(self.active_page, last, page_size)
+            if not page:
+                return
+            for chat_id in page:
+                yield chat_id
+            last = page[-1]
+
+    def import_json(self, legacy_json: str):
+        """Одноразовый перенос старого user_data.json (повторно не выполняется)"""
+        with self._lock:
+            done = self._conn.execute("SELECT value FROM meta WHERE key = 'json_imported'").fetchone()
+        if done or not os.path.exists(legacy_json):
+            return
+        with open(legacy_json, "r") as f:
+            users = json.load(f)
+        self.add_many(users)
+        self._write("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [("json_imported", legacy_json)])
+        logging.info(f"Импортировано {len(users)} подписчиков из {legacy_json}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
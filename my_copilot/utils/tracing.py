@@ -0,0 +1,216 @@
+import collections
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+# Текущий трейс и текущий спан: contextvars копируются в задачи asyncio и в asyncio.to_thread,
+# поэтому спаны из gather(), фоновых правок сообщения и потоков попадают в свой апдейт
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+
+
+class Trace:
+    """Один апдейт: trace_id, атрибуты и плоский список спанов (с глубиной вложенности)"""
+
+    __slots__ = ("trace_id", "name", "attrs", "spans", "started", "started_at", "duration", "error", "_lock")
+
+    def __init__(self, name: str, attrs: dict):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.duration = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = [dict(s) for s in self.spans]
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "attrs": self.attrs,
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+            "duration_ms": round(self.duration * 1000, 1) if self.duration is not None else None,
+            "error": self.error,
+            "spans": sorted(spans, key=lambda s: s["start_ms"]),
+        }
+
+
+class TraceBuffer:
+    """Кольцевой буфер последних завершенных трейсов"""
+
+    def __init__(self, size: int = 200):
+        self._items = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace):
+        with self._lock:
+            self._items.append(trace)
+
+    def recent(self, limit: int = 20) -> list:
+        with self._lock:
+            items = list(self._items)[-limit:]
+        return [t.to_dict() for t in reversed(items)]
+
+    def slowest(self, limit: int = 20) -> list:
+        with self._lock:
+            items = sorted(self._items, key=lambda t: t.duration or 0, reverse=True)[:limit]
+        return [t.to_dict() for t in items]
+
+    def get(self, trace_id: str):
+        with self._lock:
+            for t in self._items:
+                if t.trace_id == trace_id:
+                    return t.to_dict()
+        return None
+
+
+buffer = TraceBuffer(int(os.getenv("TRACE_BUFFER_SIZE", 200)))
+SLOW_TRACE_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", 10))
+
+
+class trace:
+    """Трейс апдейта: async with trace("message", chat_id=...): ...
+    Медленные трейсы (дольше TRACE_SLOW_SECONDS) дополнительно пишутся в лог с разбивкой по спанам"""
+
+    def __init__(self, name: str, **attrs):
+        self.trace = Trace(name, attrs)
+
+    async def __aenter__(self):
+        self._token = _trace.set(self.trace)
+        self._span_token = _span.set(None)
+        return self.trace
+
+    async def __aexit__(self, exc_type, exc, tb):
+        t = self.trace
+        t.duration = time.perf_counter() - t.started
+        if exc_type is not None:
+            t.error = f"{exc_type.__name__}: {exc}"
+        _span.reset(self._span_token)
+        _trace.reset(self._token)
+        buffer.add(t)
+        if t.duration >= SLOW_TRACE_SECONDS:
+            breakdown = ", ".join(f"{s['name']} {s['duration_ms']:.0f}мс" for s in t.to_dict()["spans"] if s["depth"] == 0)
+            logging.warning(f"Медленный апдейт {t.trace_id} ({t.name}, {t.attrs}): {t.duration:.1f}с - {breakdown}")
+        return False
+
+
+class span:
+    """Спан этапа внутри текущего трейса (вне трейса ничего не делает)"""
+
+    __slots__ = ("name", "trace", "record", "_token", "_profiler")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = _trace.get()
+        if self.trace is None or self.trace.duration is not None:
+            self.trace = None  # нет трейса или он уже закрыт (фоновые задачи после ответа)
+            return self
+        parent = _span.get()
+        now = time.perf_counter()
+        self.record = {
+            "name": self.name,
+            "start_ms": round((now - self.trace.started) * 1000, 1),
+            "duration_ms": None,
+            "depth": parent["depth"] + 1 if parent else 0,
+            "parent": parent["name"] if parent else None,
+            "thread": threading.current_thread().name,
+        }
+        self.record["_started"] = now
+        self._token = _span.set(self.record)
+        self._profiler = profiler.maybe_start(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is None:
+            return False
+        record = self.record
+        record["duration_ms"] = round((time.perf_counter() - record.pop("_started")) * 1000, 1)
+        if exc_type is not None:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        if self._profiler is not None:
+            record["profile"] = self._profiler.stop()
+        try:
+            _span.reset(self._token)
+        except ValueError:
+            _span.set(None)  # спан закрыт в другом контексте (не должно случаться, но не падаем)
+        with self.trace._lock:
+            self.trace.spans.append(record)
+        return False
+
+
+def current_trace_id():
+    t = _trace.get()
+    return t.trace_id if t is not None else None
+
+
+# --- Сэмплирующий профилировщик (по желанию) ---
+
+# Функции, в которых поток просто ждет: такие сэмплы не показываем
+_IDLE_FUNCTIONS = {"wait", "select", "poll", "_worker", "acquire", "get", "sleep", "accept",
+                   "serve_forever", "_run_once", "run_forever", "readinto", "recv_into", "epoll",
+                   "_wait_for_tstate_lock"}
+
+
+class SamplingProfiler:
+    """Раз в interval снимает стеки всех потоков (sys._current_frames) и считает самые частые.
+
+    Только на время спанов из TRACE_PROFILE_STAGES (через запятую, например
+    "whisper,embedding") и не больше одного профиля одновременно - без этой
+    переменной окружения не делает ничего. Спаны с асинхронной работой в
+    пулах потоков (Whisper, эмбеддинги) видны, потому что смотрим все потоки.
+    """
+
+    def __init__(self, stages: str = "", interval_ms: float = 5.0, top: int = 15):
+        self.stages = {s.strip() for s in stages.split(",") if s.strip()}
+        self.interval = interval_ms / 1000
+        self.top = top
+        self._busy = threading.Lock()
+
+    def maybe_start(self, name: str):
+        if name not in self.stages or not self._busy.acquire(blocking=False):
+            return None
+        return _ProfileRun(self)
+
+
+class _ProfileRun:
+    def __init__(self, owner: SamplingProfiler):
+        self.owner = owner
+        self.samples = collections.Counter()
+        self.total = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trace-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.owner.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or frame.f_code.co_name in _IDLE_FUNCTIONS:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < 6:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                self.samples[" <- ".join(stack)] += 1
+                self.total += 1
+
+    def stop(self) -> list:
+        self._stop.set()
+        self._thread.join()
+        self.owner._busy.release()
+        return [{"stack": stack, "samples": n, "share": round(n / self.total, 3)}
+                for stack, n in self.samples.most_common(self.owner.top)]
+
+
+profiler = SamplingProfiler(os.getenv("TRACE_PROFILE_STAGES", ""), float(os.getenv("TRACE_PROFILE_INTERVAL_MS", 5)))
@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Подсказка для Whisper: словарь водителя, чтобы термины не превращались в созвучные слова
+CAR_PROMPT = (
+    "Audi A3, ТО, замена масла, пробег, километров, тормозные колодки, ремень ГРМ, свечи, "
+    "антифриз, check engine, ABS, ESP, подвеска, стойки, шины, аккумулятор, DSG, турбина."
+)
+WHISPER_LANGUAGE = os.getenv("WHISPER_LANGUAGE", "ru") or None  # пусто - автоопределение
+
+# fast - жадное декодирование, для длинных сообщений (время растет с длиной записи);
+# accurate - beam search, для коротких: там каждое слово - команда, а стоит он недорого
+PROFILES = {
+    "fast": {
+        "beam_size": 1, "best_of": 1, "temperature": 0.0, "language": WHISPER_LANGUAGE,
+        "vad_filter": True, "initial_prompt": CAR_PROMPT, "condition_on_previous_text": False,
+    },
+    "accurate": {
+        "beam_size": 5, "language": WHISPER_LANGUAGE, "vad_filter": True, "initial_prompt": CAR_PROMPT,
+    },
+}
+
+
+def choose_profile(duration: float = None, fast_after: float = 20.0) -> str:
+    """Профиль по длине записи в секундах (неизвестна - accurate)"""
+    return "fast" if duration and duration > fast_after else "accurate"
+
+
+def run_whisper(model, path: str, profile: str = "accurate", **overrides) -> str:
+    """Распознать файл с профилем (блокирующий). segments - генератор: само декодирование
+    происходит при итерации, поэтому текст собирается здесь же"""
+    kwargs = dict(PROFILES[profile], **overrides)
+    segments, _ = model.transcribe(path, **kwargs)
+    return " ".join(segment.text for segment in segments).strip()
+
+
+def audio_key(data: bytes) -> str:
+    """Ключ кэша по содержимому записи (когда нет file_unique_id)"""
+    return "sha1:" + hashlib.sha1(data).hexdigest()
+
+
+class TranscriptCache:
+    """LRU расшифровок: file_unique_id Telegram (или хэш аудио) -> текст.
+    Пересланное или повторно отправленное голосовое не распознается заново"""
+
+    def __init__(self, max_size: int = 512):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            text = self._items.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def peek(self, key):
+        """Как get, но без учета в hits/misses (повторная проверка того же запроса)"""
+        if key is None:
+            return None
+        with self._lock:
+            return self._items.get(key)
+
+    def put(self, key, text: str):
+        if key is None or self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = text
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._items), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / total if total else 0.0}
+
+
+class TranscriptionBusy(Exception):
+    """Очередь распознавания переполнена - пользователю стоит повторить позже"""
+
+
+class TranscriptionPool:
+    """Пул воркеров Whisper: распознавание идет вне event loop, очередь ограничена.
+
+    Потоки, а не процессы: CTranslate2 (faster-whisper) отпускает GIL на время
+    декодирования, а одна модель в памяти на все воркеры дешевле копии на процесс.
+    """
+
+    def __init__(self, model_getter, workers: int = 2, max_queue: int = 8, submit_timeout: float = 5.0,
+                 cache: TranscriptCache = None, fast_after: float = 20.0):
+        # model_getter - функция, возвращающая модель (модели грузятся лениво)
+        self.model_getter = model_getter
+        self.workers = workers
+        self.max_queue = max_queue
+        self.submit_timeout = submit_timeout
+        self.cache = cache if cache is not None else TranscriptCache()
+        self.fast_after = fast_after
+        self._inflight = {}  # cache_key -> Future: одна запись, пришедшая дважды, распознается один раз
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="whisper")
+        self._slots = None  # asyncio.Semaphore, создается внутри event loop
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._latencies = deque(maxlen=200)
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _run_job(self, path, submitted_at, profile, kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        started = time.perf_counter()
+        try:
+            text = run_whisper(self.model_getter(), path, profile, **kwargs)
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self._running -= 1
+        return text, started - submitted_at, finished - started
+
+    def cached(self, cache_key):
+        """Готовая расшифровка (например, по file_unique_id - еще до скачивания файла)"""
+        return self.cache.get(cache_key)
+
+    async def transcribe(self, path: str, duration: float = None, profile: str = None,
+                         cache_key: str = None, **kwargs) -> str:
+        """Распознать аудиофайл. Профиль - по длительности (или явно), kwargs переопределяют его.
+        С cache_key результат кэшируется. Ждет места в очереди не дольше submit_timeout.
+        Попадание/промах кэша здесь не считается - его учитывает cached(), которую вызывают
+        до скачивания файла; тут только повторная проверка (запись могла успеть распознаться)"""
+        cached = self.cache.peek(cache_key)
+        if cached is not None:
+            return cached
+        if cache_key is not None and cache_key in self._inflight:
+            return await asyncio.shield(self._inflight[cache_key])
+        profile = profile or choose_profile(duration, self.fast_after)
+        if cache_key is None:
+            return await self._transcribe(path, profile, kwargs)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            text = await self._transcribe(path, profile, kwargs)
+            self.cache.put(cache_key, text)
+            future.set_result(text)
+            return text
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # ждущих может не быть - не ругаемся "exception never retrieved"
+            raise
+        finally:
+            self._inflight.pop(cache_key, None)
+
+    async def _transcribe(self, path, profile, kwargs) -> str:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers + self.max_queue)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.submit_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise TranscriptionBusy(f"В очереди распознавания уже {self.queue_depth} задач")
+
+        try:
+            submitted_at = time.perf_counter()
+            with self._lock:
+                self._queued += 1
+            loop = asyncio.get_running_loop()
+            try:
+                text, waited, took = await loop.run_in_executor(
+                    self._executor, self._run_job, path, submitted_at, profile, kwargs
+                )
+            except Exception:
+                self.failed += 1
+                raise
+            self.completed += 1
+            self._latencies.append(waited + took)
+            logging.info(
+                f"Whisper [{profile}]: {took:.2f}с распознавание, {waited:.2f}с в очереди (в очереди сейчас: {self.queue_depth})"
+            )
+            return text
+        finally:
+            self._slots.release()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def stats(self) -> dict:
+        """Глубина очереди и задержки последних задач (ожидание + распознавание)"""
+        latencies = sorted(self._latencies)
+        n = len(latencies)
+        return {
+            "queue_depth": self._queued,
+            "running": self._running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "latency_avg": sum(latencies) / n if n else 0.0,
+            "latency_p95": latencies[min(n - 1, int(n * 0.95))] if n else 0.0,
+            "cache": self.cache.stats(),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,146 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import logging
+import os
+import threading
+
+DEFAULT_VOICE = "ru-RU-SvetlanaNeural"
+AUDIO_FORMAT = "mp3"  # edge-tts по умолчанию отдает audio-24khz-48kbitrate-mono-mp3
+
+
+async def edge_tts_synthesize(text: str, voice: str) -> bytes:
+    """Синтез через edge-tts сразу в память (поток чанков, без файлов)"""
+    import edge_tts
+    communicate = edge_tts.Communicate(text, voice)
+    audio = bytearray()
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio":
+            audio += chunk["data"]
+    return bytes(audio)
+
+
+class TTSService:
+    """Озвучка с кэшем на диске: ключ - хэш (текст, голос, формат), файл - <ключ>.mp3.
+
+    Кэш ограничен max_bytes: при переполнении удаляются давно не использованные
+    файлы (по mtime, он обновляется при каждом попадании). Одинаковые запросы,
+    пришедшие одновременно, синтезируются один раз - в том числе из разных потоков
+    со своими event loop (сессии Streamlit через synthesize_sync). synthesizer - async (text, voice) -> bytes,
+    его можно подменить (например, заглушкой без сети).
+    """
+
+    def __init__(self, cache_dir: str = "tts_cache", max_bytes: int = 50 * 1024 * 1024,
+                 voice: str = DEFAULT_VOICE, synthesizer=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.voice = voice
+        self.synthesizer = synthesizer or edge_tts_synthesize
+        self._lock = threading.Lock()  # файлы кэша и их суммарный размер
+        self._state = threading.Lock()  # _inflight и счетчики
+        self._inflight = {}  # ключ -> concurrent.futures.Future (общий для всех потоков и loop)
+        self._total = None  # размер кэша на диске, считается при первом обращении
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str, voice: str, fmt: str = AUDIO_FORMAT) -> str:
+        return hashlib.sha256(f"{voice}\0{fmt}\0{text}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.{AUDIO_FORMAT}")
+
+    def _read(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # отметка "использовался недавно" для вытеснения
+        except OSError:
+            pass  # файл только что вытеснил другой поток - прочитанные данные все равно верны
+        return data
+
+    def _scan(self) -> int:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return sum(e.stat().st_size for e in os.scandir(self.cache_dir) if e.is_file())
+
+    def _write(self, key: str, data: bytes):
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan()
+            path = self._path(key)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._total += len(data)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Удалять самые старые файлы, пока кэш не уменьшится до 90% лимита (под self._lock)"""
+        entries = sorted(
+            (e for e in os.scandir(self.cache_dir) if e.is_file() and e.name.endswith(f".{AUDIO_FORMAT}")),
+            key=lambda e: e.stat().st_mtime,
+        )
+        total = sum(e.stat().st_size for e in entries)
+        for entry in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._total = total
+
+    async def synthesize(self, text: str, voice: str = None) -> bytes:
+        """Аудио (mp3) для текста: из кэша или синтезом"""
+        voice = voice or self.voice
+        key = self.key(text, voice)
+        data = await asyncio.to_thread(self._read, key)
+        with self._state:
+            if data is not None:
+                self.hits += 1
+                return data
+            pending = self._inflight.get(key)
+            if pending is None:
+                future = self._inflight[key] = concurrent.futures.Future()
+                self.misses += 1
+            else:
+                self.hits += 1  # тот же текст уже синтезируется - ждем его
+        if pending is not None:
+            # shield: отмена ожидающего не отменяет синтез для остальных
+            return await asyncio.shield(asyncio.wrap_future(pending))
+
+        try:
+            data = await self.synthesizer(text, voice)
+            if not data:
+                raise RuntimeError("Синтезатор вернул пустое аудио")
+            try:
+                await asyncio.to_thread(self._write, key, data)
+            except OSError as e:
+                logging.error(f"Не удалось сохранить озвучку в кэш: {e}")
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._state:
+                self._inflight.pop(key, None)
+
+    def synthesize_sync(self, text: str, voice: str = None) -> bytes:
+        """Для синхронного кода (Streamlit): свой event loop на вызов"""
+        return asyncio.run(self.synthesize(text, voice))
+
+    def stats(self) -> dict:
+        with self._state:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0,
+                "bytes": self._total, "max_bytes": self.max_bytes}
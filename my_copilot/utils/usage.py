@@ -0,0 +1,56 @@
+import logging
+import threading
+
+
+class UsageTracker:
+    """Учет токенов DeepSeek по полю usage каждого ответа, включая попадания
+    в кэш префикса (prompt_cache_hit_tokens / prompt_cache_miss_tokens)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}
+
+    @staticmethod
+    def extract(usage) -> dict:
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        hit = getattr(usage, "prompt_cache_hit_tokens", None)
+        miss = getattr(usage, "prompt_cache_miss_tokens", None)
+        if hit is None:
+            # OpenAI-совместимый формат: usage.prompt_tokens_details.cached_tokens
+            details = getattr(usage, "prompt_tokens_details", None)
+            hit = getattr(details, "cached_tokens", 0) or 0
+            miss = prompt - hit
+        return {
+            "requests": 1,
+            "prompt_tokens": prompt,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            "cache_hit_tokens": hit or 0,
+            "cache_miss_tokens": miss or 0,
+        }
+
+    def record(self, usage, label: str = "chat") -> dict:
+        """Учесть usage одного ответа (None - стрим без usage, пропускаем)"""
+        if usage is None:
+            return {}
+        row = self.extract(usage)
+        with self._lock:
+            for key in (label, "all"):
+                bucket = self.totals.setdefault(key, dict.fromkeys(row, 0))
+                for k, v in row.items():
+                    bucket[k] += v
+        logging.info(
+            f"DeepSeek [{label}]: prompt {row['prompt_tokens']} (кэш {row['cache_hit_tokens']}, "
+            f"мимо {row['cache_miss_tokens']}), ответ {row['completion_tokens']}"
+        )
+        return row
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {}
+            for label, bucket in self.totals.items():
+                cached = bucket["cache_hit_tokens"] + bucket["cache_miss_tokens"]
+                result[label] = dict(bucket, cache_hit_rate=bucket["cache_hit_tokens"] / cached if cached else 0.0)
+            return result
+
+
+usage_tracker = UsageTracker()
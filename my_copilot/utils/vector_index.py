@@ -0,0 +1,146 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+
+MANIFEST = "manifest.json"
+
+
+def export_collection(collection, out_dir: str = "vector_index", page_size: int = 1000, keep_versions: int = 2) -> dict:
+    """Снимок коллекции Chroma в готовый к mmap артефакт.
+
+    out_dir/<версия>/vectors.f32 - матрица float32 (count x dim, векторы нормированы),
+    out_dir/<версия>/chunks.json - тексты и id в том же порядке,
+    out_dir/manifest.json - текущая версия; пишется последним (tmp + os.replace),
+    поэтому читатель всегда видит целую версию. Версия - хэш содержимого:
+    повторный экспорт той же коллекции ничего не переписывает.
+    """
+    ids, documents, vectors = [], [], []
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings", "documents"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        ids += page["ids"]
+        documents += page["documents"]
+        vectors.append(np.asarray(page["embeddings"], dtype=np.float32))
+        offset += len(page["ids"])
+    if not ids:
+        raise ValueError("Коллекция пуста - экспортировать нечего")
+
+    matrix = np.vstack(vectors)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1, norms)
+    # Порядок id стабилен независимо от порядка выдачи Chroma
+    order = sorted(range(len(ids)), key=ids.__getitem__)
+    matrix = np.ascontiguousarray(matrix[order])
+    ids = [ids[i] for i in order]
+    documents = [documents[i] for i in order]
+
+    digest = hashlib.sha1(matrix.tobytes())
+    digest.update(json.dumps([ids, documents], ensure_ascii=False).encode())
+    version = digest.hexdigest()[:12]
+    manifest = {
+        "version": version,
+        "count": matrix.shape[0],
+        "dim": matrix.shape[1],
+        "dtype": "float32",
+        "collection": collection.name,
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+    os.makedirs(out_dir, exist_ok=True)
+    version_dir = os.path.join(out_dir, version)
+    if not os.path.exists(version_dir):
+        tmp_dir = version_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        matrix.tofile(os.path.join(tmp_dir, "vectors.f32"))
+        with open(os.path.join(tmp_dir, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "documents": documents}, f, ensure_ascii=False)
+        os.replace(tmp_dir, version_dir)
+
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    # Старые версии: оставляем keep_versions последних (текущая - всегда)
+    versions = sorted(
+        (d for d in os.listdir(out_dir) if os.path.isdir(os.path.join(out_dir, d)) and not d.endswith(".tmp")),
+        key=lambda d: os.path.getmtime(os.path.join(out_dir, d)), reverse=True,
+    )
+    for old in [d for d in versions if d != version][max(keep_versions - 1, 0):]:
+        shutil.rmtree(os.path.join(out_dir, old), ignore_errors=True)
+    return manifest
+
+
+class VectorIndex:
+    """Точный top-k по снимку коллекции: матрица открывается через np.memmap
+    (без чтения файла целиком), поиск - одно умножение матрицы на вектор.
+
+    Расстояние - квадрат L2 между нормированными векторами (2 - 2*cos), как у Chroma
+    по умолчанию, поэтому его можно сравнивать с расстояниями из других коллекций.
+    """
+
+    def __init__(self, path: str, manifest: dict):
+        self.path = path
+        self.manifest = manifest
+        self.version = manifest["version"]
+        version_dir = os.path.join(path, self.version)
+        self.vectors = np.memmap(
+            os.path.join(version_dir, "vectors.f32"), dtype=np.float32, mode="r",
+            shape=(manifest["count"], manifest["dim"]),
+        )
+        with open(os.path.join(version_dir, "chunks.json"), "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        self.ids = chunks["ids"]
+        self.documents = chunks["documents"]
+
+    @classmethod
+    def load(cls, path: str = "vector_index"):
+        """Индекс по manifest.json или None, если артефакта нет (или он битый)"""
+        try:
+            with open(os.path.join(path, MANIFEST), "r") as f:
+                manifest = json.load(f)
+            index = cls(path, manifest)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.error(f"Не удалось открыть векторный индекс {path}: {e}")
+            return None
+        logging.info(f"Векторный индекс {path}: версия {index.version}, {len(index)} фрагментов")
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, vector, k: int = 3):
+        """-> (документы, расстояния) k ближайших, ближайший первым"""
+        v = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(v)
+        if norm:
+            v = v / norm
+        scores = self.vectors @ v
+        k = min(k, len(scores))
+        if k <= 0:
+            return [], []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self.documents[i] for i in top], [float(2 - 2 * scores[i]) for i in top]
+
+
+if __name__ == "__main__":
+    # python -m utils.vector_index [путь к chroma_db] [папка индекса]
+    import sys
+    import chromadb
+
+    logging.basicConfig(level=logging.INFO)
+    chroma_path = sys.argv[1] if len(sys.argv) > 1 else "chroma_db"
+    out_dir = sys.argv[2] if len(sys.argv) > 2 else "vector_index"
+    collection = chromadb.PersistentClient(path=chroma_path).get_collection(name="audi_manual")
+    print(export_collection(collection, out_dir))
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+class ModelWarmup:
+    """Фоновая загрузка моделей: каждая - в своем потоке, все одновременно.
+
+    Бот начинает принимать апдейты сразу; обработчик, которому нужна модель,
+    ждет ее через wait() (или отвечает "прогреваюсь"). report() - состояние
+    и время загрузки каждой модели для /readyz.
+    """
+
+    def __init__(self):
+        self._models = OrderedDict()  # имя -> {"loader", "status", "seconds", "error", "event"}
+        self._lock = threading.Lock()
+        self.started_at = None
+
+    def add(self, name: str, loader):
+        self._models[name] = {"loader": loader, "status": "pending", "seconds": None, "error": None,
+                              "event": threading.Event()}
+
+    def start(self):
+        """Запустить загрузку всех моделей (повторный вызов ничего не делает)"""
+        if self.started_at is not None:
+            return
+        self.started_at = time.monotonic()
+        for name in self._models:
+            threading.Thread(target=self._load, args=(name,), name=f"warmup-{name}", daemon=True).start()
+
+    def _load(self, name):
+        model = self._models[name]
+        with self._lock:
+            model["status"] = "loading"
+        started = time.perf_counter()
+        try:
+            model["loader"]()
+            status, error = "ready", None
+        except Exception as e:
+            logging.exception(f"Модель {name} не загрузилась")
+            status, error = "failed", str(e)
+        with self._lock:
+            model["status"], model["error"] = status, error
+            model["seconds"] = round(time.perf_counter() - started, 2)
+        model["event"].set()
+        logging.info(f"Прогрев: {name} - {status} за {model['seconds']} с")
+
+    def _selected(self, names):
+        return [self._models[n] for n in (names or self._models)]
+
+    def is_ready(self, *names) -> bool:
+        """Готовы ли модели names (без аргументов - все)"""
+        return all(m["status"] == "ready" for m in self._selected(names))
+
+    def failed(self, *names) -> list:
+        return [n for n in (names or self._models) if self._models[n]["status"] == "failed"]
+
+    async def wait(self, *names, timeout: float = 60.0) -> bool:
+        """Дождаться моделей (без блокировки event loop). False - таймаут или модель не загрузилась"""
+        deadline = time.monotonic() + timeout
+        while not self.is_ready(*names):
+            if self.failed(*names) or time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.2)
+        return True
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "ready": all(m["status"] == "ready" for m in self._models.values()),
+                "uptime_seconds": round(time.monotonic() - self.started_at, 1) if self.started_at else 0.0,
+                "models": {
+                    name: {"status": m["status"], "load_seconds": m["seconds"], "error": m["error"]}
+                    for name, m in self._models.items()
+                },
+            }
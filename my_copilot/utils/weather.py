@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+import urllib.parse
+
+import httpx
+
+# Основной и резервный сервер wttr.in, {city} подставляется в URL
+WTTR_URLS = [
+    "https://wttr.in/{city}?format=3",
+    "https://v2.wttr.in/{city}?format=3",
+]
+
+
+class WeatherService:
+    """Погода через общий пул соединений httpx с кэшем по городу.
+
+    Свежий ответ (моложе ttl) отдается из кэша. Устаревший, но моложе stale_ttl,
+    тоже отдается сразу, а обновление идет в фоне (stale-while-revalidate).
+    Основной и резервный серверы опрашиваются одновременно, побеждает первый успешный.
+    """
+
+    def __init__(self, urls: list = None, ttl: float = 600, stale_ttl: float = 3 * 3600, timeout: float = 10):
+        self.urls = urls or WTTR_URLS
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self._client = None
+        self._cache = {}       # город -> (время получения, текст)
+        self._inflight = {}    # город -> задача обновления (одновременные запросы ждут одну)
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            )
+        return self._client
+
+    async def _fetch_one(self, url: str) -> str:
+        response = await self._get_client().get(url)
+        text = response.text.strip()
+        if response.status_code != 200 or not text:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        return text
+
+    async def _fetch(self, city: str) -> str:
+        quoted = urllib.parse.quote(city)
+        tasks = {asyncio.ensure_future(self._fetch_one(u.format(city=quoted))): u for u in self.urls}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    logging.error(f"Ошибка погоды на {tasks[task]}: {task.exception()}")
+            raise RuntimeError("Все метеосерверы недоступны")
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _refresh(self, key: str, city: str) -> str:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(city))
+            self._inflight[key] = task
+
+            def _done(t):
+                self._inflight.pop(key, None)
+                if not t.cancelled() and t.exception() is None:
+                    self._cache[key] = (time.monotonic(), t.result())
+                elif not t.cancelled():
+                    t.exception()  # ошибка уже залогирована, не даем asyncio ругаться
+
+            task.add_done_callback(_done)
+        return await asyncio.shield(task)
+
+    async def get(self, city: str):
+        """Строка погоды для города или None, если серверы недоступны и в кэше пусто"""
+        key = city.strip().lower()
+        entry = self._cache.get(key)
+        age = time.monotonic() - entry[0] if entry else None
+
+        if entry and age < self.ttl:
+            self.hits += 1
+            return entry[1]
+        if entry and age < self.stale_ttl:
+            self.stale_hits += 1
+            if key not in self._inflight:
+                asyncio.ensure_future(self._refresh(key, city)).add_done_callback(
+                    lambda t: t.cancelled() or t.exception())
+            return entry[1]
+
+        self.misses += 1
+        try:
+            return await self._refresh(key, city)
+        except Exception as e:
+            logging.error(f"Погода для {city} недоступна: {e}")
+            return entry[1] if entry else None
+
+    def stats(self) -> dict:
+        return {"cities": len(self._cache), "hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses}
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+weather_service = WeatherService()